@@ -0,0 +1,102 @@
+"""ベンチマーク共通の小道具
+
+アプリをスレッド付きの開発サーバーで起動し、Cookie付きのHTTPクライアントで
+叩いて、レイテンシのパーセンタイルを集計する。
+"""
+import http.cookiejar
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+
+# src パッケージを import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@contextmanager
+def serve(app, host='127.0.0.1', port=0):
+    """アプリをバックグラウンドのスレッドで起動し、ベースURLを返す"""
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server(host, port, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://{host}:{server.server_port}'
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+class Client:
+    """セッションCookieを保持する最小限のJSONクライアント"""
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+
+    def request(self, method, path, payload=None):
+        """(ステータス, 本文バイト数, 経過秒) を返す"""
+        status, body, elapsed = self.fetch(method, path, payload)
+        return status, len(body), elapsed
+
+    def request_json(self, method, path, payload=None):
+        """(ステータス, JSON本文, 経過秒) を返す。JSONでなければ本文は None"""
+        status, body, elapsed = self.fetch(method, path, payload)
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            data = None
+        return status, data, elapsed
+
+    def fetch(self, method, path, payload=None):
+        """(ステータス, 本文のバイト列, 経過秒) を返す"""
+        data = None
+        headers = {}
+        if payload is not None:
+            data = json.dumps(payload).encode()
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+
+        started = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=self.timeout) as res:
+                body = res.read()
+                status = res.status
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            status = e.code
+        return status, body, time.perf_counter() - started
+
+    def get(self, path):
+        return self.request('GET', path)
+
+    def post(self, path, payload=None):
+        return self.request('POST', path, payload if payload is not None else {})
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples):
+    """秒のリストを p50/p95/p99（ミリ秒）にまとめる"""
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 2),
+        'p95_ms': round(percentile(samples, 95) * 1000, 2),
+        'p99_ms': round(percentile(samples, 99) * 1000, 2),
+    }
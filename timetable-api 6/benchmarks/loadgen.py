@@ -0,0 +1,177 @@
+"""複数ユーザーの操作を再現する負荷試験
+
+  flask --app src.main seed --users 100000 --messages 2000000
+  python benchmarks/loadgen.py --clients 32 --seconds 60
+  python benchmarks/loadgen.py --base-url http://127.0.0.1:8000 --clients 64
+
+seed コマンドで作ったユーザー（{prefix}{連番}、共通パスワード）でそれぞれ
+ログインし、ダッシュボード・友達・チャット・検索の操作を --mix の比率で
+ランダムに繰り返す。--base-url を省略すると、DATABASE_URL のDBでアプリを
+このプロセス内に起動する（gunicorn の構成を測るときは --base-url を使う）。
+
+ルートごとのスループットと p50/p95/p99、エラー件数を JSON で出力する。
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+
+from harness import Client, serve, summarize
+
+DEFAULT_MIX = 'dashboard=4,friends=3,chat=2,search=1'
+
+
+class VirtualUser:
+    """1人分の操作。ルート名ごとに (ステータス, 経過秒) を記録する"""
+
+    def __init__(self, base_url, username, password, rng, samples):
+        self.client = Client(base_url)
+        self.username = username
+        self.password = password
+        self.rng = rng
+        self.samples = samples  # ルート名 -> [(ステータス, 経過秒)]
+
+    def call(self, route, method, path, payload=None):
+        status, data, elapsed = self.client.request_json(method, path, payload)
+        self.samples[route].append((status, elapsed))
+        return status, data
+
+    def login(self, deadline):
+        # ログインが集中すると 503 で断られるので、少し待って再試行する
+        while time.monotonic() < deadline:
+            status, _ = self.call('POST /api/login', 'POST', '/api/login',
+                                  {'username': self.username, 'password': self.password})
+            if status == 200:
+                return True
+            if status != 503:
+                return False
+            time.sleep(0.5)
+        return False
+
+    def dashboard(self):
+        self.call('GET /api/dashboard', 'GET', '/api/dashboard')
+
+    def friends(self):
+        status, data = self.call('GET /api/friends', 'GET', '/api/friends')
+        friends = (data or {}).get('friends') or []
+        if status == 200 and friends:
+            friend = self.rng.choice(friends)
+            self.call('GET /api/timetable/user/<user_id>', 'GET', f"/api/timetable/user/{friend['id']}")
+        self.call('GET /api/friend-requests', 'GET', '/api/friend-requests')
+
+    def chat(self):
+        status, data = self.call('GET /api/conversations', 'GET', '/api/conversations')
+        conversations = (data or {}).get('conversations') or []
+        if status != 200 or not conversations:
+            return
+        conversation = self.rng.choice(conversations[:10])
+        path = f"/api/conversations/{conversation['id']}/messages"
+        self.call('GET /api/conversations/<id>/messages', 'GET', path + '?per_page=30')
+        self.call('POST /api/conversations/<id>/messages', 'POST', path,
+                  {'content': f'loadgen {self.rng.randint(0, 10 ** 6)}'})
+
+    def search(self):
+        query = self.username[:-3] + str(self.rng.randint(0, 9))
+        self.call('GET /api/users/search', 'GET', f'/api/users/search?q={query}')
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        if not hasattr(VirtualUser, name.strip()):
+            raise SystemExit(f'unknown flow: {name}')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def run_user(base_url, args, index, mix, deadline, samples, completed):
+    rng = random.Random(args.random_seed + index)
+    username = f'{args.prefix}{rng.randrange(args.user_count):06d}'
+    user = VirtualUser(base_url, username, args.password, rng, samples)
+    if not user.login(deadline):
+        return
+
+    flows, weights = list(mix), list(mix.values())
+    while time.monotonic() < deadline:
+        flow = rng.choices(flows, weights)[0]
+        getattr(user, flow)()
+        completed[flow] += 1
+        if args.think_ms:
+            time.sleep(args.think_ms / 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', help='省略時はアプリをこのプロセス内で起動する')
+    parser.add_argument('--clients', type=int, default=16, help='同時に操作するユーザー数（スレッド数）')
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='操作の比率')
+    parser.add_argument('--think-ms', type=float, default=0, help='操作の間の待ち時間')
+    parser.add_argument('--user-count', type=int, default=100_000, help='seed で作ったユーザー数')
+    parser.add_argument('--prefix', default='user')
+    parser.add_argument('--password', default='seed-password')
+    parser.add_argument('--seed', dest='random_seed', type=int, default=1)
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    if args.base_url:
+        server = nullcontext(args.base_url)
+    else:
+        from src.main import app
+        server = serve(app)
+
+    per_user_samples = [defaultdict(list) for _ in range(args.clients)]
+    per_user_flows = [defaultdict(int) for _ in range(args.clients)]
+    with server as base_url:
+        started = time.monotonic()
+        deadline = started + args.seconds
+        threads = [
+            threading.Thread(target=run_user, args=(base_url, args, i, mix, deadline,
+                                                    per_user_samples[i], per_user_flows[i]))
+            for i in range(args.clients)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.monotonic() - started
+
+    if not args.base_url:
+        from src.services.passwords import password_hasher
+        password_hasher.shutdown()
+
+    samples = defaultdict(list)
+    flows = defaultdict(int)
+    for user_samples, user_flows in zip(per_user_samples, per_user_flows):
+        for route, values in user_samples.items():
+            samples[route].extend(values)
+        for flow, count in user_flows.items():
+            flows[flow] += count
+
+    routes = {}
+    for route, values in sorted(samples.items()):
+        ok = [e for status, e in values if status < 400]
+        routes[route] = {
+            **summarize(ok),
+            'rps': round(len(values) / elapsed, 1),
+            'errors': len(values) - len(ok),
+        }
+
+    total = sum(len(values) for values in samples.values())
+    print(json.dumps({
+        'clients': args.clients,
+        'seconds': round(elapsed, 1),
+        'requests': total,
+        'rps': round(total / elapsed, 1),
+        'errors': sum(r['errors'] for r in routes.values()),
+        'flows': dict(flows),
+        'routes': routes,
+    }, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""ログイン集中時に他のエンドポイントが遅くならないかを測るベンチマーク
+
+  python benchmarks/login_storm.py --hash-workers 2 --storm 16 --seconds 10
+  python benchmarks/login_storm.py --hash-workers 0   # 従来のインライン計算
+
+まず負荷なしで /api/me のレイテンシを測り、次に --storm 本のスレッドで
+/api/login を叩き続けながら同じ計測を行う。ログインのスループットと
+503（負荷制限）の件数もあわせて表示する。
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+from harness import Client, serve, summarize
+
+
+def probe(client, seconds):
+    samples = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        status, _, elapsed = client.get('/api/me')
+        if status == 200:
+            samples.append(elapsed)
+        time.sleep(0.01)
+    return samples
+
+
+def storm(base_url, username, seconds, results):
+    client = Client(base_url)
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        status, _, elapsed = client.post('/api/login', {'username': username, 'password': 'storm-password'})
+        results.append((status, elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hash-workers', type=int, default=2)
+    parser.add_argument('--queue-limit', type=int, default=None)
+    parser.add_argument('--storm', type=int, default=16, help='ログインを送り続けるスレッド数')
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')  # メモリ内DBで起動する
+    os.environ.setdefault('AUTO_MIGRATE', '1')
+    from src.main import app
+    from src.models.user import User, db
+    from src.services.passwords import password_hasher
+
+    app.config['PASSWORD_HASH_WORKERS'] = args.hash_workers
+    if args.queue_limit is not None:
+        app.config['PASSWORD_HASH_QUEUE_LIMIT'] = args.queue_limit
+    password_hasher.init_app(app)
+
+    with app.app_context():
+        for name, password in [('probe', 'probe-password')] + [(f'storm{i}', 'storm-password') for i in range(args.storm)]:
+            user = User(username=name, email=f'{name}@example.com')
+            user.set_password(password)
+            db.session.add(user)
+        db.session.commit()
+
+    with serve(app) as base_url:
+        prober = Client(base_url)
+        prober.post('/api/login', {'username': 'probe', 'password': 'probe-password'})
+        baseline = summarize(probe(prober, min(args.seconds, 3)))
+
+        results = []
+        threads = [
+            threading.Thread(target=storm, args=(base_url, f'storm{i}', args.seconds, results))
+            for i in range(args.storm)
+        ]
+        for t in threads:
+            t.start()
+        under_storm = summarize(probe(prober, args.seconds))
+        for t in threads:
+            t.join()
+
+    password_hasher.shutdown()
+
+    ok = [elapsed for status, elapsed in results if status == 200]
+    shed = sum(1 for status, _ in results if status == 503)
+    print(json.dumps({
+        'hash_workers': args.hash_workers,
+        'storm_threads': args.storm,
+        'logins_per_sec': round(len(ok) / args.seconds, 1),
+        'login_latency': summarize(ok),
+        'shed_503': shed,
+        'me_baseline': baseline,
+        'me_under_storm': under_storm,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""JSONシリアライズのマイクロベンチマーク
+
+  python benchmarks/serialization.py --friends 300 --conversations 100 --messages 50
+
+友達一覧・会話一覧・メッセージ一覧のペイロードを、従来の経路
+（to_dict() + Flask 標準の JSON）と、新しい経路（プロジェクション +
+FastJSONProvider）で生成し、1回あたりのCPU時間とバイト数（gzip後も）を比べる。
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+# src パッケージを import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from src.models.user import User
+from src.models.message import Message, Conversation
+from src.services.serialization import (
+    FastJSONProvider, orjson, project, MESSAGE_FIELDS, LAST_MESSAGE_FIELDS, USER_CARD_FIELDS,
+)
+
+
+def make_users(n):
+    now = datetime.utcnow()
+    return [
+        User(id=str(uuid.uuid4()), username=f'学生{i:05d}', email=f'student{i}@example.ac.jp',
+             created_at=now, updated_at=now)
+        for i in range(n)
+    ]
+
+
+def make_messages(me, other, n):
+    now = datetime.utcnow()
+    messages = []
+    for i in range(n):
+        sender, receiver = (me, other) if i % 2 else (other, me)
+        messages.append(Message(
+            id=i + 1, sender_id=sender.id, receiver_id=receiver.id, sender=sender, receiver=receiver,
+            content=f'明日の{i % 5 + 1}限、一緒に行こう！', created_at=now - timedelta(minutes=i), is_read=bool(i % 3),
+        ))
+    return messages
+
+
+def build_payloads(args):
+    me = make_users(1)[0]
+    friends = make_users(args.friends)
+    status = {'status': 'in_class', 'subject': '線形代数', 'location': 'A101', 'end_time': '10:15'}
+    conversations = []
+    for i, other in enumerate(friends[:args.conversations]):
+        last = make_messages(me, other, 1)[0]
+        conversations.append(Conversation(
+            id=i + 1, user1_id=me.id, user2_id=other.id, user1=me, user2=other,
+            last_message=last, updated_at=last.created_at,
+        ))
+    messages = make_messages(me, friends[0], args.messages)
+
+    legacy = {
+        'friends': lambda: {'friends': [
+            {'id': f.id, 'username': f.username, 'email': f.email, 'class_status': status, 'friendship_id': f.id}
+            for f in friends
+        ]},
+        'conversations': lambda: {'conversations': [c.to_dict(me.id) for c in conversations]},
+        'messages': lambda: {'messages': [m.to_dict() for m in messages]},
+    }
+    slim = {
+        'friends': lambda: {'friends': [
+            {'id': f.id, 'username': f.username, 'class_status': status, 'friendship_id': f.id}
+            for f in friends
+        ]},
+        'conversations': lambda: {'conversations': [
+            {
+                'id': c.id,
+                'other_user': project(c.user2, USER_CARD_FIELDS),
+                'last_message': project(c.last_message, LAST_MESSAGE_FIELDS),
+                'updated_at': c.updated_at,
+            }
+            for c in conversations
+        ]},
+        'messages': lambda: {'messages': [project(m, MESSAGE_FIELDS) for m in messages]},
+    }
+    return legacy, slim
+
+
+def measure(build, dumps, iterations):
+    started = time.process_time()
+    for _ in range(iterations):
+        body = dumps(build())
+    elapsed = (time.process_time() - started) / iterations
+    if isinstance(body, str):
+        body = body.encode()
+    return {
+        'cpu_ms': round(elapsed * 1000, 3),
+        'bytes': len(body),
+        'gzip_bytes': len(gzip.compress(body, compresslevel=6)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--friends', type=int, default=300)
+    parser.add_argument('--conversations', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=50)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    legacy_dumps = DefaultJSONProvider(app).dumps
+    fast_dumps = FastJSONProvider(app).dumps
+
+    legacy, slim = build_payloads(args)
+    print(json.dumps({'encoder': 'orjson' if orjson else 'json'}))
+    for name in legacy:
+        before = measure(legacy[name], legacy_dumps, args.iterations)
+        after = measure(slim[name], fast_dumps, args.iterations)
+        print(json.dumps({
+            'payload': name,
+            'before': before,
+            'after': after,
+            'cpu_speedup': round(before['cpu_ms'] / after['cpu_ms'], 1) if after['cpu_ms'] else None,
+            'bytes_saved_pct': round(100 * (1 - after['bytes'] / before['bytes']), 1),
+        }, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
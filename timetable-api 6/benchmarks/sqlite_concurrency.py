@@ -0,0 +1,135 @@
+"""複数ワーカーからのSQLite読み書きの同時実行ベンチマーク
+
+  python benchmarks/sqlite_concurrency.py --workers 4 --write-ratio 0.2
+  python benchmarks/sqlite_concurrency.py --profile default   # PRAGMAなし
+
+gunicornのワーカーを模して --workers 個のプロセスから同じDBファイルに
+アクセスし、読み取り（時間割の取得）と書き込み（時間割の更新）を
+--write-ratio の割合で混ぜて実行する。プロファイルごとのスループット、
+レイテンシ、ロックエラーの件数を表示する。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from harness import summarize
+from src.services.storage import DEFAULT_SQLITE_PRAGMAS, apply_sqlite_pragmas
+
+USERS = 200
+SCHEMA = """
+CREATE TABLE timetables (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    day_of_week INTEGER NOT NULL,
+    period INTEGER NOT NULL,
+    subject_name TEXT,
+    room TEXT,
+    updated_at TEXT
+);
+CREATE INDEX ix_timetables_user_day ON timetables (user_id, day_of_week);
+"""
+
+
+def connect(path, profile):
+    if profile == 'wal':
+        connection = sqlite3.connect(path, timeout=DEFAULT_SQLITE_PRAGMAS['busy_timeout'] / 1000)
+        apply_sqlite_pragmas(connection, DEFAULT_SQLITE_PRAGMAS)
+    else:
+        # sqlite3 の既定（ロールバックジャーナル、synchronous=FULL）
+        connection = sqlite3.connect(path)
+    return connection
+
+
+def setup(path, profile):
+    connection = connect(path, profile)
+    connection.executescript(SCHEMA)
+    connection.executemany(
+        'INSERT INTO timetables (user_id, day_of_week, period, subject_name, room) VALUES (?, ?, ?, ?, ?)',
+        [(u, d, p, f'subject-{u}-{d}-{p}', f'room-{p}') for u in range(USERS) for d in range(5) for p in range(1, 6)]
+    )
+    connection.commit()
+    connection.close()
+
+
+def worker(path, profile, seconds, write_ratio, seed, queue):
+    rng = random.Random(seed)
+    connection = connect(path, profile)
+    reads, writes, errors = [], [], 0
+
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        user_id = rng.randrange(USERS)
+        started = time.perf_counter()
+        try:
+            if rng.random() < write_ratio:
+                connection.execute(
+                    'UPDATE timetables SET room = ?, updated_at = ? WHERE user_id = ? AND day_of_week = ? AND period = ?',
+                    (f'room-{rng.randrange(100)}', time.time(), user_id, rng.randrange(5), rng.randrange(1, 6))
+                )
+                connection.commit()
+                writes.append(time.perf_counter() - started)
+            else:
+                connection.execute(
+                    'SELECT * FROM timetables WHERE user_id = ? AND day_of_week = ?',
+                    (user_id, rng.randrange(5))
+                ).fetchall()
+                reads.append(time.perf_counter() - started)
+        except sqlite3.OperationalError:
+            # database is locked
+            errors += 1
+            connection.rollback()
+
+    connection.close()
+    queue.put((reads, writes, errors))
+
+
+def run(profile, workers, seconds, write_ratio):
+    directory = tempfile.mkdtemp(prefix='bluelink-sqlite-')
+    path = os.path.join(directory, 'bench.db')
+    setup(path, profile)
+
+    queue = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=worker, args=(path, profile, seconds, write_ratio, i, queue))
+        for i in range(workers)
+    ]
+    for p in processes:
+        p.start()
+    results = [queue.get() for _ in processes]
+    for p in processes:
+        p.join()
+
+    reads = [s for r, _, _ in results for s in r]
+    writes = [s for _, w, _ in results for s in w]
+    return {
+        'profile': profile,
+        'workers': workers,
+        'write_ratio': write_ratio,
+        'ops_per_sec': round((len(reads) + len(writes)) / seconds, 1),
+        'reads': summarize(reads),
+        'writes': summarize(writes),
+        'lock_errors': sum(e for _, _, e in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profile', choices=['wal', 'default', 'both'], default='both')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--write-ratio', type=float, nargs='+', default=[0.05, 0.2, 0.5])
+    args = parser.parse_args()
+
+    profiles = ['default', 'wal'] if args.profile == 'both' else [args.profile]
+    for write_ratio in args.write_ratio:
+        for profile in profiles:
+            print(json.dumps(run(profile, args.workers, args.seconds, write_ratio)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""起動時間とワーカーごとのメモリ使用量の計測
+
+  python benchmarks/startup.py                 # import にかかる時間とRSS
+  python benchmarks/startup.py --gunicorn 4    # gunicorn のワーカーのRSS/PSS
+
+--eager は QR/画像ライブラリを起動時に読み込んでいた従来の構成を再現する。
+gunicorn の計測では --preload の有無を切り替えて、ワーカーの PSS
+（共有ページを按分したメモリ量）を比較する。Linux の /proc を使う。
+"""
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = """
+import resource, sys, time
+started = time.perf_counter()
+if {eager}:
+    import qrcode, qrcode.image.svg, PIL.Image
+from src.main import app
+elapsed = time.perf_counter() - started
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def measure_import(eager, runs, env):
+    times, rss = [], []
+    for _ in range(runs):
+        out = subprocess.check_output(
+            [sys.executable, '-c', IMPORT_PROBE.format(eager=eager)], cwd=ROOT, env=env, text=True
+        )
+        elapsed, maxrss = out.split()
+        times.append(float(elapsed))
+        rss.append(int(maxrss))
+    return {
+        'mode': 'eager' if eager else 'lazy',
+        'import_ms_median': round(statistics.median(times) * 1000, 1),
+        'max_rss_kb_median': int(statistics.median(rss)),
+    }
+
+
+def memory_of(pid):
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if key in ('Rss', 'Pss'):
+                values[key.lower() + '_kb'] = int(rest.split()[0])
+    return values
+
+
+def measure_gunicorn(workers, preload, env):
+    port = 18000 + os.getpid() % 1000
+    env = dict(env, PORT=str(port), WEB_CONCURRENCY=str(workers), GUNICORN_PRELOAD='1' if preload else '0')
+    if not preload:
+        # 起動フックで移行するとマスターがアプリを読み込んでしまうので、先に済ませておく
+        subprocess.check_call([sys.executable, '-m', 'flask', '--app', 'src.main', 'init-db'],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+        env['SKIP_MIGRATIONS'] = '1'
+    started = time.perf_counter()
+    master = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'src.main:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        # 全ワーカーが応答するまで待つ
+        while True:
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{port}/api/me', timeout=1)
+            except urllib.error.HTTPError:
+                break
+            except OSError:
+                time.sleep(0.05)
+        ready_ms = (time.perf_counter() - started) * 1000
+        time.sleep(1)
+
+        with open(f'/proc/{master.pid}/task/{master.pid}/children') as f:
+            children = [int(pid) for pid in f.read().split()]
+        per_worker = [memory_of(pid) for pid in children]
+        return {
+            'preload': preload,
+            'workers': len(children),
+            'ready_ms': round(ready_ms, 1),
+            'master': memory_of(master.pid),
+            'worker_rss_kb_avg': int(statistics.mean(w['rss_kb'] for w in per_worker)),
+            'worker_pss_kb_avg': int(statistics.mean(w['pss_kb'] for w in per_worker)),
+        }
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--gunicorn', type=int, default=0, metavar='WORKERS')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bluelink-startup-')
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(directory, 'bench.db'))
+
+    for eager in (True, False):
+        print(json.dumps(measure_import(eager, args.runs, env)))
+
+    if args.gunicorn:
+        for preload in (False, True):
+            print(json.dumps(measure_gunicorn(args.gunicorn, preload, env)))
+
+
+if __name__ == '__main__':
+    main()
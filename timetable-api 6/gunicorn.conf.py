@@ -0,0 +1,34 @@
+# gunicorn -c gunicorn.conf.py src.main:app
+#
+# preload_app でマスターが一度だけアプリを組み立て、ワーカーは fork で
+# コピーオンライトのメモリを共有する。スキーマ移行も fork 前に一度だけ行う。
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+
+def on_starting(server):
+    # 移行を別途 `flask --app src.main init-db` で行う場合は SKIP_MIGRATIONS=1
+    if os.environ.get('SKIP_MIGRATIONS'):
+        return
+
+    from src.main import app
+    from src.models.db import db
+    from src.models.migrations import migrate_app
+
+    migrate_app(app)
+
+    # マスターが開いた接続をワーカーに引き継がない
+    with app.app_context():
+        db.engine.dispose()
+
+
+def post_fork(server, worker):
+    from src.main import app
+    from src.models.db import db
+
+    # 親プロセスから複製された接続プールは使わず、ワーカーごとに作り直す
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,104 @@
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from src.models.migrations import migrate_app
+from src.services.static_assets import static_assets
+
+
+def register_commands(app):
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(compress_static_command)
+    app.cli.add_command(check_query_budgets_command)
+    app.cli.add_command(seed_command)
+    app.cli.add_command(outbox_worker_command)
+    app.cli.add_command(rebuild_suggestions_command)
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """スキーマ移行を実行する（デプロイ時に一度だけ）"""
+    result = migrate_app(current_app)
+    click.echo(
+        f"applied={result['applied']} version={result['current_version']} "
+        f"({result['duration_ms']} ms)"
+    )
+
+
+@click.command('compress-static')
+@click.option('--min-bytes', default=512, show_default=True, help='これより小さいファイルは圧縮しない')
+@with_appcontext
+def compress_static_command(min_bytes):
+    """静的ファイルの .gz / .br を事前に生成する（ビルド後に一度）"""
+    created = static_assets.compress_all(min_bytes=min_bytes)
+    click.echo(f'{created} files written to {static_assets.root}')
+
+
+@click.command('check-query-budgets')
+@click.option('--budgets', 'path', default=None, help='予算ファイル（既定は query_budgets.json）')
+@click.option('--repeat', default=3, show_default=True, help='ケースごとの実行回数（時間は最短値で判定）')
+@click.option('--update', is_flag=True, help='測ったSQL件数で予算ファイルを書き換える')
+def check_query_budgets_command(path, repeat, update):
+    """全エンドポイントのSQL件数・処理時間が予算内か確認する（超えたら終了コード1）"""
+    from src.devtools.query_budget import DEFAULT_BUDGET_PATH, check_budgets
+
+    if not check_budgets(path or DEFAULT_BUDGET_PATH, repeat=repeat, update=update, echo=click.echo):
+        raise SystemExit(1)
+
+
+@click.command('seed')
+@click.option('--users', default=100_000, show_default=True)
+@click.option('--avg-friends', default=20, show_default=True, help='友達の平均人数（べき分布）')
+@click.option('--messages', default=2_000_000, show_default=True)
+@click.option('--timetable-fill', default=0.6, show_default=True, help='時間割のコマが埋まっている割合')
+@click.option('--password', default='seed-password', show_default=True, help='全ユーザー共通のパスワード')
+@click.option('--prefix', default='user', show_default=True, help='ユーザー名の接頭辞')
+@click.option('--seed', 'random_seed', default=42, show_default=True)
+@click.option('--batch-size', default=5000, show_default=True)
+@with_appcontext
+def seed_command(users, avg_friends, messages, timetable_fill, password, prefix, random_seed, batch_size):
+    """負荷試験用の合成データをまとめて生成する"""
+    from src.devtools.seed import generate_dataset
+
+    migrate_app(current_app)
+    result = generate_dataset(
+        users=users, avg_friends=avg_friends, messages=messages, timetable_fill=timetable_fill,
+        password=password, prefix=prefix, seed=random_seed, batch_size=batch_size, echo=click.echo,
+    )
+    click.echo(f"done in {result['duration_s']} s")
+
+
+@click.command('outbox-worker')
+@click.option('--batch-size', default=100, show_default=True, help='1回に取り出す件数')
+@click.option('--poll-interval', default=1.0, show_default=True, help='空のときに待つ秒数')
+@click.option('--max-attempts', default=8, show_default=True, help='この回数失敗したら failed にする')
+@click.option('--once', is_flag=True, help='積まれている分を実行したら終わる（cron 用）')
+@with_appcontext
+def outbox_worker_command(batch_size, poll_interval, max_attempts, once):
+    """アウトボックスに積まれた副作用をバックグラウンドで実行する"""
+    import signal
+    import threading
+
+    from src.services.outbox import OutboxWorker
+    import src.services.outbox_handlers  # noqa: F401  処理を登録する
+
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    worker = OutboxWorker(batch_size=batch_size, max_attempts=max_attempts, echo=click.echo)
+    stats = worker.run(poll_interval=poll_interval, once=once, stop=stop)
+    click.echo(f"stopped: done={stats['done']} retried={stats['retried']} "
+               f"failed={stats['failed']} coalesced={stats['coalesced']}")
+
+
+@click.command('rebuild-suggestions')
+@click.option('--batch-size', default=500, show_default=True, help='1回のコミットで計算し直すユーザー数')
+@with_appcontext
+def rebuild_suggestions_command(batch_size):
+    """共通の友達数と友達候補を全件作り直す（差分更新がずれたときや導入時に）"""
+    from src.services.suggestions import rebuild_all
+
+    result = rebuild_all(batch_size=batch_size, echo=click.echo)
+    click.echo(f"done in {result['duration_s']} s")
@@ -0,0 +1,370 @@
+"""エンドポイントごとのSQL件数・処理時間の上限チェック
+
+一時ディレクトリのSQLiteに決まった内容のデータ（友達・時間割・会話など）を
+作り、query_budgets.json に書かれたリクエストを1件ずつ実行して、発行された
+SQLの件数と処理時間が上限を超えていないかを確かめる。友達ごとに問い合わせる
+ようなループ（N+1）が入ると件数が友達の人数分増えるので、ここで検出できる。
+
+- 各ケースの前にDBファイルをシード直後の状態に戻し、認証・レスポンスの
+  キャッシュと混雑度の集計も捨てる（件数はキャッシュが効かない場合の値）
+- 件数は1回目の値、時間は repeat 回のうち最短の値で判定する
+- アプリに登録されたルートのうち予算ファイルにないものがあれば失敗にする
+
+実行は ``flask --app src.main check-query-budgets``。意図して件数を変えたときは
+``--update`` で予算ファイルの件数を書き換え、差分をレビューに含めること。
+"""
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+BUDGET_FILE_VERSION = 1
+DEFAULT_BUDGET_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'query_budgets.json',
+)
+DEFAULT_MAX_MS = 250
+DEFAULT_REPEAT = 3
+
+# 予算の対象にしないエンドポイント（Flask組み込みの静的ファイルと計測用）
+IGNORED_ENDPOINTS = {'static', 'metrics'}
+
+VIEWER_USERNAME = 'budget_viewer'
+VIEWER_PASSWORD = 'budget-pass'
+ADMIN_TOKEN = 'budget-admin-token'
+
+# シードデータの規模（予算の件数はこの規模で測った値）
+SEED_FRIENDS = 20
+SEED_RECEIVED_REQUESTS = 5
+SEED_SENT_REQUESTS = 2
+SEED_STRANGERS = 3
+SEED_CONVERSATIONS = 10
+SEED_MESSAGES_PER_CONVERSATION = 6
+SEED_ROOMS = ('A101', 'A102', 'B201', 'B202', 'C301')
+
+
+@dataclass
+class CaseResult:
+    name: str
+    method: str
+    path: str
+    status: int
+    queries: int
+    elapsed_ms: float
+    max_queries: int
+    max_ms: float
+    errors: list = field(default_factory=list)
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+def load_budgets(path=DEFAULT_BUDGET_PATH):
+    with open(path, encoding='utf-8') as f:
+        budgets = json.load(f)
+    if budgets.get('version') != BUDGET_FILE_VERSION:
+        raise ValueError(f'unsupported budget file version: {budgets.get("version")}')
+    return budgets
+
+
+def save_budgets(budgets, path=DEFAULT_BUDGET_PATH):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(budgets, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+
+
+def seed_fixture():
+    """予算計測用のデータを作り、パスに埋め込む値を返す（アプリコンテキスト内で呼ぶ）"""
+    from src.models.db import db
+    from src.models.user import User
+    from src.models.friend import Friend
+    from src.models.timetable import Timetable
+    from src.models.message import Message, Conversation
+    from src.models.profile import Profile
+    from src.routes.qr import friend_qr_data
+    from src.routes.sync import encode_sync_token
+    from src.routes.timetable import TIME_SLOTS
+    from src.services.avatars import avatar_store
+    from src.services.qr_cache import qr_cache
+    from src.services.qr_tokens import issue_token
+    from src.services.suggestions import rebuild_all
+
+    viewer = User(username=VIEWER_USERNAME, email='viewer@example.com')
+    viewer.set_password(VIEWER_PASSWORD)
+    # 全員が同じハッシュでよい（ログインするのは viewer だけ）
+    password_hash = viewer.password_hash
+
+    others = []
+    total = SEED_FRIENDS + SEED_RECEIVED_REQUESTS + SEED_SENT_REQUESTS + SEED_STRANGERS
+    for i in range(total):
+        others.append(User(username=f'student{i:02d}', email=f'student{i:02d}@example.com',
+                           password_hash=password_hash))
+    db.session.add(viewer)
+    db.session.add_all(others)
+    db.session.flush()
+
+    friends = others[:SEED_FRIENDS]
+    received = others[SEED_FRIENDS:SEED_FRIENDS + SEED_RECEIVED_REQUESTS]
+    sent = others[SEED_FRIENDS + SEED_RECEIVED_REQUESTS:SEED_FRIENDS + SEED_RECEIVED_REQUESTS + SEED_SENT_REQUESTS]
+    strangers = others[-SEED_STRANGERS:]
+
+    for i, friend in enumerate(friends):
+        # 申請した側が viewer の場合と相手の場合を混ぜる
+        if i % 2:
+            db.session.add(Friend(user_id=viewer.id, friend_user_id=friend.id, status='accepted'))
+        else:
+            db.session.add(Friend(user_id=friend.id, friend_user_id=viewer.id, status='accepted'))
+    for i, stranger in enumerate(strangers):
+        # 友達の友達（候補の計算に使う）
+        for friend in friends[i * 2:i * 2 + 2]:
+            db.session.add(Friend(user_id=stranger.id, friend_user_id=friend.id, status='accepted'))
+    received_requests = [Friend(user_id=requester.id, friend_user_id=viewer.id, status='pending')
+                         for requester in received]
+    db.session.add_all(received_requests)
+    for target in sent:
+        db.session.add(Friend(user_id=viewer.id, friend_user_id=target.id, status='pending'))
+
+    for n, user in enumerate([viewer] + others):
+        for day in range(5):
+            for period in (1 + (n + day) % 2, 3 + (n + day) % 3):
+                db.session.add(Timetable(
+                    user_id=user.id, day_of_week=day, period=period,
+                    subject_name=f'Subject {day}-{period}',
+                    room=SEED_ROOMS[(n + day + period) % len(SEED_ROOMS)],
+                    start_time=TIME_SLOTS[period]['start'], end_time=TIME_SLOTS[period]['end'],
+                ))
+        db.session.add(Profile(user_id=user.id, bio=f'{user.username} です', grade='2年',
+                               department='工学部', is_public=n % 3 != 0))
+
+    started = datetime.utcnow() - timedelta(days=1)
+    conversations = []
+    for i, friend in enumerate(friends[:SEED_CONVERSATIONS]):
+        conversation = Conversation(user1_id=min(viewer.id, friend.id), user2_id=max(viewer.id, friend.id))
+        last = None
+        for m in range(SEED_MESSAGES_PER_CONVERSATION):
+            sender, receiver = (friend, viewer) if m % 2 == 0 else (viewer, friend)
+            last = Message(sender_id=sender.id, receiver_id=receiver.id, content=f'message {m}',
+                           created_at=started + timedelta(minutes=i * 10 + m),
+                           is_read=m < SEED_MESSAGES_PER_CONVERSATION - 2)
+            db.session.add(last)
+        db.session.flush()
+        conversation.last_message_id = last.id
+        conversation.updated_at = last.created_at
+        db.session.add(conversation)
+        conversations.append(conversation)
+    db.session.commit()
+
+    rebuild_all()
+
+    qr_key, _ = qr_cache.get_or_create(friend_qr_data(viewer), 'png')
+    avatar_key = avatar_store.save(io.BytesIO(seed_avatar_png()))
+    return {
+        'viewer_id': viewer.id,
+        'friend_id': friends[0].id,
+        'requester_id': received[0].id,
+        'request_id': received_requests[0].id,
+        'second_request_id': received_requests[1].id,
+        'stranger_id': strangers[0].id,
+        'stranger_qr_token': issue_token(strangers[0]),
+        'timetable_id': Timetable.query.filter_by(user_id=viewer.id).first().id,
+        'conversation_id': conversations[0].id,
+        'qr_key': qr_key,
+        'avatar_key': avatar_key,
+        'sync_token': encode_sync_token(datetime.utcnow()),
+        'missing_id': 999999,
+        'admin_token': ADMIN_TOKEN,
+    }
+
+
+def seed_avatar_png():
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (320, 240), (40, 120, 200)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class BudgetRunner:
+    """一時DBでアプリを組み立て、予算ファイルのケースを実行する"""
+
+    def __init__(self, budgets, repeat=DEFAULT_REPEAT):
+        self.budgets = budgets
+        self.repeat = max(1, repeat)
+        self.workdir = None
+        self.app = None
+        self.context = None
+        self._queries = None
+
+    def __enter__(self):
+        from src.main import create_app
+        from src.models.db import db
+
+        self.workdir = tempfile.mkdtemp(prefix='query-budget-')
+        db_path = os.path.join(self.workdir, 'budget.db')
+        self.template_path = os.path.join(self.workdir, 'seed.db')
+        self.app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path,
+            'AUTO_MIGRATE': True,
+            'METRICS_ENABLED': False,
+            'EVENT_BUS_POLL_INTERVAL': 0,  # 他のワーカーのイベントを読む問い合わせを数えない
+            'PASSWORD_HASH_WORKERS': 0,
+            'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+            'QR_CACHE_DIR': os.path.join(self.workdir, 'qr_cache'),
+            'AVATAR_DIR': os.path.join(self.workdir, 'avatars'),
+            'ADMIN_TOKEN': ADMIN_TOKEN,
+        })
+        with self.app.app_context():
+            self.context = seed_fixture()
+            self.engine = db.engine
+
+        connection = self.engine.raw_connection()
+        try:
+            with closing(sqlite3.connect(self.template_path)) as template:
+                connection.driver_connection.backup(template)
+        finally:
+            connection.close()
+
+        event.listen(self.engine, 'before_cursor_execute', self._count_query)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._count_query)
+        self.engine.dispose()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def _count_query(self, *args):
+        # /api/batch は別スレッドでも実行するので、リストへの追加で数える
+        if self._queries is not None:
+            self._queries.append(1)
+
+    def _restore(self):
+        from src.services.busyness import busyness
+        from src.services.identity import identity_cache
+        from src.services.response_cache import response_cache
+
+        # 開いている接続があっても安全なように、ファイルのコピーではなく
+        # SQLite のバックアップAPIで中身を丸ごと置き換える
+        self.engine.dispose()
+        connection = self.engine.raw_connection()
+        try:
+            with closing(sqlite3.connect(self.template_path)) as template:
+                template.backup(connection.driver_connection)
+        finally:
+            connection.close()
+        identity_cache.clear()
+        response_cache.clear()
+        busyness.reset()
+
+    def _fill(self, value):
+        if isinstance(value, str):
+            return value.format_map(self.context)
+        if isinstance(value, dict):
+            return {k: self._fill(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._fill(v) for v in value]
+        return value
+
+    def _request_once(self, case):
+        client = self.app.test_client()
+        if case.get('auth', True):
+            with client.session_transaction() as session:
+                session['user_id'] = self.context['viewer_id']
+
+        kwargs = {}
+        if 'json' in case:
+            kwargs['json'] = self._fill(case['json'])
+        if 'headers' in case:
+            kwargs['headers'] = self._fill(case['headers'])
+
+        self._queries = []
+        started = time.perf_counter()
+        response = client.open(self._fill(case['path']), method=case['method'], **kwargs)
+        response.get_data()
+        elapsed = time.perf_counter() - started
+        queries, self._queries = len(self._queries), None
+        return response.status_code, queries, elapsed * 1000
+
+    def run_case(self, case):
+        defaults = self.budgets.get('defaults', {})
+        max_queries = case.get('max_queries')
+        max_ms = case.get('max_ms', defaults.get('max_ms', DEFAULT_MAX_MS))
+
+        samples = []
+        for _ in range(self.repeat):
+            self._restore()
+            samples.append(self._request_once(case))
+        status, queries, _ = samples[0]
+        elapsed_ms = min(s[2] for s in samples)
+
+        result = CaseResult(case['name'], case['method'], case['path'], status, queries,
+                            elapsed_ms, max_queries, max_ms)
+        # 期待するステータスがないと、500 で失敗していても件数だけで通ってしまう
+        # （ビルドの有無で変わるものはリストで複数指定できる）
+        expected = case.get('status')
+        if expected is None:
+            result.errors.append('status is not set')
+        elif status not in (expected if isinstance(expected, list) else [expected]):
+            result.errors.append(f'status {status} != {expected}')
+        if max_queries is None:
+            result.errors.append('max_queries is not set')
+        elif queries > max_queries:
+            result.errors.append(f'{queries} queries > budget {max_queries}')
+        if elapsed_ms > max_ms:
+            result.errors.append(f'{elapsed_ms:.1f} ms > budget {max_ms} ms')
+        return result
+
+    def uncovered_routes(self):
+        """予算ファイルにケースがない (エンドポイント, メソッド) の一覧"""
+        covered = {(case['endpoint'], case['method']) for case in self.budgets['cases']}
+        missing = []
+        for rule in self.app.url_map.iter_rules():
+            if rule.endpoint in IGNORED_ENDPOINTS:
+                continue
+            for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+                if (rule.endpoint, method) not in covered:
+                    missing.append((rule.endpoint, method, rule.rule))
+        return missing
+
+    def run(self):
+        return [self.run_case(case) for case in self.budgets['cases']]
+
+
+def check_budgets(path=DEFAULT_BUDGET_PATH, repeat=DEFAULT_REPEAT, update=False, echo=print):
+    """すべてのケースを実行して結果を表示し、問題がなければ True を返す
+
+    update=True のときは測った件数で max_queries を書き換える（時間の上限はそのまま）。
+    """
+    budgets = load_budgets(path)
+    with BudgetRunner(budgets, repeat=repeat) as runner:
+        missing = runner.uncovered_routes()
+        results = runner.run()
+
+    for result in results:
+        mark = 'ok  ' if result.ok else 'FAIL'
+        echo(f'{mark} {result.method:6} {result.name:40} status={result.status} '
+             f'queries={result.queries}/{result.max_queries} '
+             f'time={result.elapsed_ms:.1f}/{result.max_ms} ms')
+        for error in result.errors:
+            echo(f'       {error}')
+    for endpoint, method, rule in missing:
+        echo(f'FAIL {method:6} {rule} ({endpoint}) has no budget')
+
+    if update:
+        for case, result in zip(budgets['cases'], results):
+            case['max_queries'] = result.queries
+        save_budgets(budgets, path)
+        echo(f'updated {path}')
+        return not missing
+
+    failed = [r for r in results if not r.ok]
+    echo(f'{len(results) - len(failed)}/{len(results)} cases within budget, {len(missing)} routes without budget')
+    return not failed and not missing
@@ -0,0 +1,217 @@
+"""本番規模の合成データの生成
+
+``flask --app src.main seed --users 100000 --messages 2000000`` のように実行する。
+ORM のオブジェクトは作らず、モデルのテーブルに executemany でまとめて INSERT
+する。パスワードハッシュは1回だけ計算して全ユーザーで共有する（ログインには
+--password の値を使う）。
+
+- 友達関係はべき分布（少数のユーザーに友達が集中する）になるように、次数を
+  パレート分布から引いて configuration model で組み合わせる
+- 時間割は曜日×時限のグリッドを --timetable-fill の割合で埋める
+- メッセージは承認済みの友達関係の一部に会話を作り、会話ごとの件数もべき分布にする
+
+同じ --seed なら同じデータになる。ユーザー名は ``{prefix}{連番}`` なので、
+既存のDBに追加する場合は --prefix を変えること。
+"""
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from src.models.db import db
+from src.models.user import User
+from src.models.friend import Friend
+from src.models.timetable import Timetable
+from src.models.message import Message, Conversation
+from src.models.profile import Profile
+from src.services.passwords import password_hasher
+
+DEFAULT_BATCH_SIZE = 5000
+PARETO_ALPHA = 1.6          # 小さいほど友達の多いユーザーが増える
+MAX_FRIENDS = 1000
+PENDING_RATIO = 0.05        # 友達関係のうち申請中のまま残す割合
+CONVERSATION_RATIO = 0.3    # 承認済みの友達関係のうち会話がある割合
+
+SUBJECTS = ('線形代数', '微分積分', '英語', 'プログラミング', '物理学', '統計学',
+            '経済学', '心理学', 'データベース', 'アルゴリズム', '化学', '哲学')
+ROOMS = tuple(f'{building}{floor}{room:02d}' for building in 'ABCDE' for floor in (1, 2, 3) for room in range(1, 11))
+GRADES = ('1年', '2年', '3年', '4年', '修士1年', '修士2年')
+DEPARTMENTS = ('工学部', '理学部', '経済学部', '文学部', '法学部', '情報学部')
+
+
+class Inserter:
+    """行をためておき、batch_size ごとに executemany で INSERT する"""
+
+    def __init__(self, table, batch_size=DEFAULT_BATCH_SIZE, depends_on=()):
+        self.table = table
+        self.batch_size = batch_size
+        self.depends_on = depends_on  # 外部キーの参照先。先に書き込む
+        self.rows = []
+        self.count = 0
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        for inserter in self.depends_on:
+            inserter.flush()
+        with db.engine.begin() as connection:
+            connection.execute(self.table.insert(), self.rows)
+        self.count += len(self.rows)
+        self.rows = []
+
+
+def power_law_degrees(rng, count, avg_degree):
+    """平均がおよそ avg_degree になるべき分布の次数列"""
+    # パレート分布（最小値1）の平均は alpha / (alpha - 1)
+    scale = avg_degree * (PARETO_ALPHA - 1) / PARETO_ALPHA
+    return [min(MAX_FRIENDS, max(1, int(scale * rng.paretovariate(PARETO_ALPHA)))) for _ in range(count)]
+
+
+def friend_pairs(rng, user_count, avg_friends):
+    """configuration model で重複・自己ループのない (i, j) の組を作る"""
+    stubs = []
+    for index, degree in enumerate(power_law_degrees(rng, user_count, avg_friends)):
+        stubs.extend([index] * degree)
+    rng.shuffle(stubs)
+
+    pairs = set()
+    for k in range(0, len(stubs) - 1, 2):
+        a, b = stubs[k], stubs[k + 1]
+        if a != b:
+            pairs.add((a, b) if a < b else (b, a))
+    return sorted(pairs)
+
+
+def generate_dataset(users=100_000, avg_friends=20, messages=2_000_000, timetable_fill=0.6,
+                     password='seed-password', prefix='user', seed=42,
+                     batch_size=DEFAULT_BATCH_SIZE, echo=print):
+    """合成データを生成し、テーブルごとの件数と所要時間を返す（アプリコンテキスト内で呼ぶ）"""
+    from src.routes.timetable import TIME_SLOTS
+
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    counts = {}
+
+    def done(name, inserter):
+        inserter.flush()
+        counts[name] = inserter.count
+        echo(f'{name}: {inserter.count} rows ({time.perf_counter() - started:.1f} s)')
+
+    # ユーザーとプロフィール
+    password_hash = password_hasher.hash(password)
+    user_ids = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(users)]
+    user_rows = Inserter(User.__table__, batch_size)
+    profile_rows = Inserter(Profile.__table__, batch_size)
+    for n, user_id in enumerate(user_ids):
+        created_at = now - timedelta(days=rng.randint(0, 720), seconds=rng.randint(0, 86400))
+        user_rows.add({
+            'id': user_id,
+            'username': f'{prefix}{n:06d}',
+            'email': f'{prefix}{n:06d}@example.com',
+            'password_hash': password_hash,
+            'qr_token_version': 0,
+            'created_at': created_at,
+            'updated_at': created_at,
+        })
+        profile_rows.add({
+            'user_id': user_id,
+            'bio': f'{prefix}{n:06d} です。よろしくお願いします',
+            'grade': rng.choice(GRADES),
+            'department': rng.choice(DEPARTMENTS),
+            'hobbies': None,
+            'avatar_url': None,
+            'is_public': rng.random() < 0.8,
+            'created_at': created_at,
+            'updated_at': created_at,
+        })
+    done('users', user_rows)
+    done('profiles', profile_rows)
+
+    # 友達関係（べき分布）
+    accepted = []
+    friend_rows = Inserter(Friend.__table__, batch_size)
+    for a, b in friend_pairs(rng, users, avg_friends):
+        if rng.random() < 0.5:
+            a, b = b, a
+        status = 'pending' if rng.random() < PENDING_RATIO else 'accepted'
+        created_at = now - timedelta(days=rng.randint(0, 365))
+        friend_rows.add({
+            'id': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            'user_id': user_ids[a],
+            'friend_user_id': user_ids[b],
+            'status': status,
+            'created_at': created_at,
+            'updated_at': created_at,
+        })
+        if status == 'accepted':
+            accepted.append((a, b))
+    done('friends', friend_rows)
+
+    # 時間割（曜日×時限のグリッド）
+    timetable_rows = Inserter(Timetable.__table__, batch_size)
+    for user_id in user_ids:
+        for day in range(5):
+            for period, slot in TIME_SLOTS.items():
+                if rng.random() >= timetable_fill:
+                    continue
+                timetable_rows.add({
+                    'id': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                    'user_id': user_id,
+                    'day_of_week': day,
+                    'period': period,
+                    'subject_name': rng.choice(SUBJECTS),
+                    'room': rng.choice(ROOMS),
+                    'start_time': slot['start'],
+                    'end_time': slot['end'],
+                    'created_at': now,
+                    'updated_at': now,
+                })
+    done('timetables', timetable_rows)
+
+    # 会話とメッセージ（会話ごとの件数もべき分布）
+    pairs = [pair for pair in accepted if rng.random() < CONVERSATION_RATIO][:messages]
+    if pairs and messages:
+        weights = power_law_degrees(rng, len(pairs), max(1, messages // len(pairs)))
+        total_weight = sum(weights)
+        next_message_id = (db.session.query(db.func.max(Message.id)).scalar() or 0) + 1
+        next_conversation_id = (db.session.query(db.func.max(Conversation.id)).scalar() or 0) + 1
+
+        message_rows = Inserter(Message.__table__, batch_size)
+        conversation_rows = Inserter(Conversation.__table__, batch_size, depends_on=(message_rows,))
+        for (a, b), weight in zip(pairs, weights):
+            count = max(1, round(messages * weight / total_weight))
+            # 間隔は最大2時間なので、最後のメッセージが現在より前になる
+            sent_at = now - timedelta(seconds=count * 7200 + rng.randint(0, 30 * 86400))
+            for m in range(count):
+                sent_at += timedelta(seconds=rng.randint(10, 7200))
+                sender, receiver = (a, b) if rng.random() < 0.5 else (b, a)
+                message_rows.add({
+                    'id': next_message_id,
+                    'sender_id': user_ids[sender],
+                    'receiver_id': user_ids[receiver],
+                    'content': f'メッセージ {m}',
+                    'created_at': sent_at,
+                    'is_read': m < count - 3 or rng.random() < 0.5,
+                })
+                next_message_id += 1
+            conversation_rows.add({
+                'id': next_conversation_id,
+                'user1_id': min(user_ids[a], user_ids[b]),
+                'user2_id': max(user_ids[a], user_ids[b]),
+                'last_message_id': next_message_id - 1,
+                'updated_at': sent_at,
+            })
+            next_conversation_id += 1
+        done('messages', message_rows)
+        done('conversations', conversation_rows)
+
+    return {
+        'counts': counts,
+        'duration_s': round(time.perf_counter() - started, 1),
+    }
@@ -3,9 +3,10 @@ import sys
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory
+from flask import Flask
 from flask_cors import CORS
-from src.models.user import db
+from src.models.db import db
+from src.models.migrations import migrate_app
 from src.routes.user import user_bp
 from src.routes.auth import auth_bp
 from src.routes.timetable import timetable_bp
@@ -13,57 +14,92 @@ from src.routes.friends import friends_bp
 from src.routes.qr import qr_bp
 from src.routes.messages import messages_bp
 from src.routes.profiles import profiles_bp
+from src.routes.stats import stats_bp
+from src.routes.dashboard import dashboard_bp
+from src.routes.batch import batch_bp
+from src.routes.sync import sync_bp
+from src.routes.admin import admin_bp
+from src.routes.frontend import frontend_bp
+from src.services.qr_cache import qr_cache
+from src.services.avatars import avatar_store
+from src.services.identity import identity_cache
+from src.services.passwords import password_hasher
+from src.services.storage import configure_storage, init_storage
+from src.services.serialization import init_json
+from src.services.static_assets import static_assets
+from src.services.metrics import metrics
+from src.services.batch import batch_dispatcher
+from src.services.response_cache import response_cache
+from src.services.events import events
+from src.services import invalidation
+from src.commands import register_commands
 
-app = Flask(__name__, static_folder=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static'))
-app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
+def create_app(config=None):
+    """アプリケーションを組み立てる
 
-# CORS設定
-CORS(app, supports_credentials=True)
+    スキーマの移行はここでは行わない（``flask --app src.main init-db`` か
+    gunicorn.conf.py の起動フックで一度だけ実行する）。開発時など、起動時に
+    実行したい場合は AUTO_MIGRATE を有効にする。
+    """
+    app = Flask(__name__, static_folder=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static'))
+    app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
+    app.config['AUTO_MIGRATE'] = bool(os.environ.get('AUTO_MIGRATE'))
+    # 管理用API（データの書き出し）のトークン。未設定なら無効
+    app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
+    if config:
+        app.config.update(config)
 
-# ブループリントの登録
-app.register_blueprint(user_bp, url_prefix='/api')
-app.register_blueprint(auth_bp, url_prefix='/api')
-app.register_blueprint(timetable_bp, url_prefix='/api')
-app.register_blueprint(friends_bp, url_prefix='/api')
-app.register_blueprint(qr_bp, url_prefix='/api')
-app.register_blueprint(messages_bp, url_prefix='/api')
-app.register_blueprint(profiles_bp, url_prefix='/api')
+    # CORS設定
+    CORS(app, supports_credentials=True)
 
-# データベース設定
-import os
-if os.environ.get('RENDER'):
-    # 本番環境用（メモリ内データベース）
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
-else:
-    # ローカル環境用
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database/timetable.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db.init_app(app)
-with app.app_context():
-    db.create_all()
+    # JSONエンコーダ（orjson）とレスポンスの gzip 圧縮
+    init_json(app)
+
+    # ブループリントの登録
+    app.register_blueprint(user_bp, url_prefix='/api')
+    app.register_blueprint(auth_bp, url_prefix='/api')
+    app.register_blueprint(timetable_bp, url_prefix='/api')
+    app.register_blueprint(friends_bp, url_prefix='/api')
+    app.register_blueprint(qr_bp, url_prefix='/api')
+    app.register_blueprint(messages_bp, url_prefix='/api')
+    app.register_blueprint(profiles_bp, url_prefix='/api')
+    app.register_blueprint(stats_bp, url_prefix='/api')
+    app.register_blueprint(dashboard_bp, url_prefix='/api')
+    app.register_blueprint(batch_bp, url_prefix='/api')
+    app.register_blueprint(sync_bp, url_prefix='/api')
+    app.register_blueprint(admin_bp, url_prefix='/api')
+
+    # データベース設定（接続先とSQLiteのPRAGMAは storage で決める）
+    configure_storage(app)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    init_storage(app, db)
+    # 認証の問い合わせも計測に含めるため、identity より先に登録する
+    metrics.init_app(app, db)
+    qr_cache.init_app(app)
+    avatar_store.init_app(app)
+    identity_cache.init_app(app)
+    password_hasher.init_app(app)
+    batch_dispatcher.init_app(app)
+    response_cache.init_app(app)
+    # 書き込みのイベントを全ワーカーに配り、キャッシュと集計を更新する
+    events.init_app(app, db)
+    invalidation.register(events)
+    register_commands(app)
 
-@app.route('/debug')
-def debug():
-    return f"Static folder: {app.static_folder}<br>Exists: {os.path.exists(app.static_folder) if app.static_folder else 'None'}<br>Contents: {os.listdir(app.static_folder) if app.static_folder and os.path.exists(app.static_folder) else 'None'}"
+    if app.config['AUTO_MIGRATE']:
+        migrate_app(app)
 
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
-def serve(path):
-    static_folder_path = app.static_folder
-    if static_folder_path is None:
-            return "Static folder not configured", 404
+    # 静的ファイルはマニフェストを作ってから、最後にキャッチオールで登録する
+    static_assets.init_app(app)
+    app.register_blueprint(frontend_bp)
+    return app
 
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
-    else:
-        index_path = os.path.join(static_folder_path, 'index.html')
-        if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
-        else:
-            return "index.html not found", 404
+# gunicorn src.main:app 用（--preload ならマスターで一度だけ組み立てて fork する）
+app = create_app()
 
 
 if __name__ == '__main__':
-    import os
+    migrate_app(app)
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,14 @@
+from src.models.db import db
+from datetime import datetime
+
+class ChangeEvent(db.Model):
+    """ワーカー間で配るドメインイベントの記録（各ワーカーが id のカーソルで読む）"""
+    __tablename__ = 'change_events'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    topic = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    origin = db.Column(db.String(50), nullable=False)  # 発行したワーカー
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (db.Index('ix_change_events_created_at', 'created_at'),)
@@ -0,0 +1,4 @@
+from flask_sqlalchemy import SQLAlchemy
+
+# すべてのモデルで共有する SQLAlchemy インスタンス（メタデータも1つにまとまる）
+db = SQLAlchemy()
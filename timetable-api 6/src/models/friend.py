@@ -1,9 +1,7 @@
-from flask_sqlalchemy import SQLAlchemy
+from src.models.db import db
 from datetime import datetime
 import uuid
 
-db = SQLAlchemy()
-
 class Friend(db.Model):
     __tablename__ = 'friends'
     
@@ -18,6 +16,14 @@ class Friend(db.Model):
     user = db.relationship('User', foreign_keys=[user_id], backref=db.backref('sent_requests', lazy=True))
     friend_user = db.relationship('User', foreign_keys=[friend_user_id], backref=db.backref('received_requests', lazy=True))
     
+    # 受信した申請・友達一覧の検索と差分同期で使うインデックス
+    # （友達一覧は申請した側・された側の両方向をそれぞれ引く）
+    __table_args__ = (
+        db.Index('ix_friends_friend_user_status', 'friend_user_id', 'status'),
+        db.Index('ix_friends_user_status', 'user_id', 'status'),
+        db.Index('ix_friends_updated_at', 'updated_at'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -1,14 +1,12 @@
-from flask_sqlalchemy import SQLAlchemy
+from src.models.db import db
 from datetime import datetime
 
-db = SQLAlchemy()
-
 class Message(db.Model):
     __tablename__ = 'messages'
     
     id = db.Column(db.Integer, primary_key=True)
-    sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    receiver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    sender_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    receiver_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_read = db.Column(db.Boolean, default=False)
@@ -17,6 +15,9 @@ class Message(db.Model):
     sender = db.relationship('User', foreign_keys=[sender_id], backref='sent_messages')
     receiver = db.relationship('User', foreign_keys=[receiver_id], backref='received_messages')
     
+    # 未読数の集計で使うインデックス
+    __table_args__ = (db.Index('ix_messages_receiver_read', 'receiver_id', 'is_read'),)
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -39,8 +40,8 @@ class Conversation(db.Model):
     __tablename__ = 'conversations'
     
     id = db.Column(db.Integer, primary_key=True)
-    user1_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    user2_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user1_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    user2_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
     last_message_id = db.Column(db.Integer, db.ForeignKey('messages.id'), nullable=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow)
     
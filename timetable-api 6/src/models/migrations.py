@@ -0,0 +1,137 @@
+"""バージョン付きのスキーマ移行
+
+適用済みのバージョンを schema_migrations テーブルに記録し、未適用の
+移行だけを順に実行する。各移行は何度実行しても結果が同じになるように
+書くこと（テーブル・インデックスは存在確認してから作成する）。
+"""
+import time
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from src.models.db import db
+# create_all の対象にするため、すべてのモデルを読み込んでおく
+from src.models.user import User
+from src.models.friend import Friend
+from src.models.timetable import Timetable
+from src.models.message import Message, Conversation
+from src.models.profile import Profile
+from src.models.tombstone import Tombstone
+from src.models.change_event import ChangeEvent
+from src.models.outbox import OutboxMessage
+from src.models.suggestion import MutualFriendCount, FriendSuggestion
+
+schema_migrations = db.Table(
+    'schema_migrations',
+    db.Column('version', db.Integer, primary_key=True),
+    db.Column('description', db.String(255), nullable=False),
+    db.Column('applied_at', db.DateTime, nullable=False),
+)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+def create_indexes(connection, *tables):
+    for table in tables:
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
+
+
+def add_column_if_missing(connection, table_name, column_sql):
+    column_name = column_sql.split()[0]
+    columns = {c['name'] for c in inspect(connection).get_columns(table_name)}
+    if column_name not in columns:
+        connection.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column_sql}'))
+
+
+@migration(1, 'create tables')
+def create_tables(connection):
+    db.metadata.create_all(bind=connection, checkfirst=True)
+
+
+@migration(2, 'indexes for timetable status, unread counts and friend requests')
+def create_hot_path_indexes(connection):
+    create_indexes(connection, Timetable.__table__, Message.__table__, Friend.__table__)
+
+
+@migration(3, 'users.qr_token_version')
+def add_qr_token_version(connection):
+    add_column_if_missing(connection, 'users', 'qr_token_version INTEGER NOT NULL DEFAULT 0')
+
+
+@migration(4, 'tombstones and updated_at indexes for delta sync')
+def create_sync_tables(connection):
+    Tombstone.__table__.create(bind=connection, checkfirst=True)
+    create_indexes(connection, Timetable.__table__, Friend.__table__, Profile.__table__, Tombstone.__table__)
+
+
+@migration(5, 'change_events for the cross-worker event bus')
+def create_change_events(connection):
+    ChangeEvent.__table__.create(bind=connection, checkfirst=True)
+    create_indexes(connection, ChangeEvent.__table__)
+
+
+@migration(6, 'outbox for background side effects')
+def create_outbox(connection):
+    OutboxMessage.__table__.create(bind=connection, checkfirst=True)
+    create_indexes(connection, OutboxMessage.__table__)
+
+
+@migration(7, 'mutual friend counts and friend suggestions')
+def create_suggestion_tables(connection):
+    MutualFriendCount.__table__.create(bind=connection, checkfirst=True)
+    FriendSuggestion.__table__.create(bind=connection, checkfirst=True)
+    create_indexes(connection, MutualFriendCount.__table__, FriendSuggestion.__table__, Timetable.__table__)
+
+
+@migration(8, 'friends(user_id, status) index for the paginated friends list')
+def create_friend_direction_index(connection):
+    create_indexes(connection, Friend.__table__)
+
+
+@migration(9, 'profiles.avatar_hash for uploaded avatars')
+def add_avatar_hash(connection):
+    add_column_if_missing(connection, 'profiles', 'avatar_hash VARCHAR(64)')
+
+
+def run_migrations(engine=None):
+    """未適用の移行を実行し、適用したバージョンと所要時間を返す"""
+    engine = engine or db.engine
+    started = time.perf_counter()
+    applied = []
+
+    with engine.begin() as connection:
+        schema_migrations.create(bind=connection, checkfirst=True)
+        done = {row[0] for row in connection.execute(db.select(schema_migrations.c.version))}
+
+        for version, description, func in MIGRATIONS:
+            if version in done:
+                continue
+            func(connection)
+            connection.execute(schema_migrations.insert().values(
+                version=version, description=description, applied_at=datetime.utcnow()
+            ))
+            applied.append(version)
+
+    return {
+        'applied': applied,
+        'current_version': MIGRATIONS[-1][0] if MIGRATIONS else 0,
+        'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+def migrate_app(app):
+    """アプリの設定で移行を実行し、結果をログに残す"""
+    with app.app_context():
+        result = run_migrations()
+    app.logger.info('schema migrations: applied=%s version=%s (%.1f ms)',
+                    result['applied'], result['current_version'], result['duration_ms'])
+    return result
@@ -0,0 +1,31 @@
+from src.models.db import db
+from datetime import datetime
+
+class OutboxMessage(db.Model):
+    """リクエストの外で実行する副作用（ドメインの変更と同じトランザクションで書く）"""
+    __tablename__ = 'outbox'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending / done / failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # 再試行までは待つ
+    locked_by = db.Column(db.String(50), nullable=True)  # 取得したワーカー
+    locked_until = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    processed_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (db.Index('ix_outbox_status_available_at', 'status', 'available_at'),)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'processed_at': self.processed_at.isoformat() if self.processed_at else None
+        }
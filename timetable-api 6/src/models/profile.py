@@ -1,18 +1,18 @@
-from flask_sqlalchemy import SQLAlchemy
+from src.models.db import db
+from src.services.avatars import avatar_image_url, DEFAULT_AVATAR_SIZE
 from datetime import datetime
 
-db = SQLAlchemy()
-
 class Profile(db.Model):
     __tablename__ = 'profiles'
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, unique=True)
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False, unique=True)
     bio = db.Column(db.Text, nullable=True)  # 自己紹介文
     grade = db.Column(db.String(50), nullable=True)  # 学年
     department = db.Column(db.String(100), nullable=True)  # 学部
     hobbies = db.Column(db.Text, nullable=True)  # 趣味・興味
-    avatar_url = db.Column(db.String(255), nullable=True)  # プロフィール画像URL
+    avatar_url = db.Column(db.String(255), nullable=True)  # プロフィール画像URL（外部の画像）
+    avatar_hash = db.Column(db.String(64), nullable=True)  # アップロードした画像の内容のハッシュ
     is_public = db.Column(db.Boolean, default=True)  # 公開/非公開設定
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -20,7 +20,16 @@ class Profile(db.Model):
     # リレーションシップ
     user = db.relationship('User', backref=db.backref('profile', uselist=False))
     
-    def to_dict(self, is_owner=False):
+    # 差分同期で使うインデックス
+    __table_args__ = (db.Index('ix_profiles_updated_at', 'updated_at'),)
+    
+    def avatar(self, size=DEFAULT_AVATAR_SIZE):
+        """表示するサイズのプロフィール画像のURL（アップロードした画像を優先）"""
+        if self.avatar_hash:
+            return avatar_image_url(self.avatar_hash, size)
+        return self.avatar_url
+    
+    def to_dict(self, is_owner=False, avatar_size=DEFAULT_AVATAR_SIZE):
         # プロフィールが非公開で、所有者でない場合は限定的な情報のみ返す
         if not self.is_public and not is_owner:
             return {
@@ -39,7 +48,7 @@ class Profile(db.Model):
             'grade': self.grade,
             'department': self.department,
             'hobbies': self.hobbies,
-            'avatar_url': self.avatar_url,
+            'avatar_url': self.avatar(avatar_size),
             'is_public': self.is_public,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
@@ -0,0 +1,38 @@
+from src.models.db import db
+from datetime import datetime
+
+class MutualFriendCount(db.Model):
+    """ユーザーと友達の友達の共通の友達数（友達関係の変更で差分更新する）"""
+    __tablename__ = 'mutual_friend_counts'
+    
+    user_id = db.Column(db.String(36), primary_key=True)
+    candidate_id = db.Column(db.String(36), primary_key=True)
+    mutual_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (db.Index('ix_mutual_friend_counts_user_count', 'user_id', 'mutual_count'),)
+
+class FriendSuggestion(db.Model):
+    """ユーザーごとの「知り合いかも」の上位N件（事前に計算しておく）"""
+    __tablename__ = 'friend_suggestions'
+    
+    user_id = db.Column(db.String(36), primary_key=True)
+    candidate_id = db.Column(db.String(36), db.ForeignKey('users.id'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+    mutual_count = db.Column(db.Integer, nullable=False, default=0)
+    shared_classes = db.Column(db.Integer, nullable=False, default=0)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    candidate = db.relationship('User', foreign_keys=[candidate_id])
+    
+    __table_args__ = (db.Index('ix_friend_suggestions_user_score', 'user_id', 'score'),)
+    
+    def to_dict(self, user):
+        return {
+            'user': {
+                'id': user.id,
+                'username': user.username
+            },
+            'mutual_friends': self.mutual_count,
+            'shared_classes': self.shared_classes,
+            'score': self.score
+        }
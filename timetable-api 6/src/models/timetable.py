@@ -1,9 +1,7 @@
-from flask_sqlalchemy import SQLAlchemy
+from src.models.db import db
 from datetime import datetime
 import uuid
 
-db = SQLAlchemy()
-
 class Timetable(db.Model):
     __tablename__ = 'timetables'
     
@@ -21,6 +19,13 @@ class Timetable(db.Model):
     # リレーション
     user = db.relationship('User', backref=db.backref('timetables', lazy=True))
     
+    # 授業状況の確認（ユーザー×曜日）、差分同期、同じ授業の検索で使うインデックス
+    __table_args__ = (
+        db.Index('ix_timetables_user_day', 'user_id', 'day_of_week'),
+        db.Index('ix_timetables_updated_at', 'updated_at'),
+        db.Index('ix_timetables_class', 'day_of_week', 'period', 'subject_name'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
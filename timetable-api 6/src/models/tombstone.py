@@ -0,0 +1,29 @@
+from src.models.db import db
+from datetime import datetime
+
+class Tombstone(db.Model):
+    """削除された行の記録（差分同期で削除をクライアントに伝えるため）"""
+    __tablename__ = 'tombstones'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)  # 'timetable' / 'friend'
+    entity_id = db.Column(db.String(36), nullable=False)
+    user_id = db.Column(db.String(36), nullable=False)  # 持ち主（友達関係は申請した側）
+    other_user_id = db.Column(db.String(36), nullable=True)  # 友達関係の相手
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (db.Index('ix_tombstones_deleted_at', 'deleted_at'),)
+    
+    @classmethod
+    def record(cls, entity, entity_id, user_id, other_user_id=None):
+        """削除と同じトランザクションで記録する（コミットは呼び出し側）"""
+        tombstone = cls(entity=entity, entity_id=entity_id, user_id=user_id, other_user_id=other_user_id)
+        db.session.add(tombstone)
+        return tombstone
+    
+    def to_dict(self):
+        return {
+            'entity': self.entity,
+            'id': self.entity_id,
+            'deleted_at': self.deleted_at.isoformat() if self.deleted_at else None
+        }
@@ -1,9 +1,7 @@
-from flask_sqlalchemy import SQLAlchemy
+from src.models.db import db
 from datetime import datetime
 import uuid
-from werkzeug.security import generate_password_hash, check_password_hash
-
-db = SQLAlchemy()
+from src.services.passwords import password_hasher
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -12,6 +10,7 @@ class User(db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
+    qr_token_version = db.Column(db.Integer, nullable=False, default=0)  # QRトークンの世代（上げると失効）
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -19,10 +18,13 @@ class User(db.Model):
         return f'<User {self.username}>'
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        return password_hasher.needs_rehash(self.password_hash)
 
     def to_dict(self):
         return {
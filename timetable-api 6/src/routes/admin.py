@@ -0,0 +1,51 @@
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from src.services.export import EXPORTS, export_rows, ndjson_chunks, gzip_chunks, parse_after
+import hmac
+
+admin_bp = Blueprint('admin', __name__)
+
+def admin_authorized():
+    """ADMIN_TOKEN が設定されていて、Authorization: Bearer <トークン> が一致するか"""
+    token = current_app.config.get('ADMIN_TOKEN')
+    if not token:
+        return False
+    return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+
+def wants_gzip():
+    # ?gzip=1 か、Accept-Encoding に gzip があればその場で圧縮する
+    return request.args.get('gzip') == '1' or 'gzip' in request.accept_encodings
+
+@admin_bp.route('/admin/export/<name>', methods=['GET'])
+def export_table(name):
+    """users / timetables / friendships / messages を NDJSON で書き出す
+
+    主キー順に1行ずつ返す。?after=<id> でその id より後から、?limit= で件数を
+    区切れる（途中で切れたら最後に受け取った行の id を after に渡す）。
+    """
+    if not current_app.config.get('ADMIN_TOKEN'):
+        return jsonify({'error': '管理用のAPIは無効です'}), 404
+    if not admin_authorized():
+        return jsonify({'error': '認証が必要です'}), 401
+    if name not in EXPORTS:
+        return jsonify({'error': '無効なテーブルです', 'allowed_tables': list(EXPORTS)}), 400
+
+    after = request.args.get('after')
+    try:
+        after = parse_after(name, after) if after else None
+    except ValueError:
+        return jsonify({'error': '無効なカーソルです'}), 400
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        return jsonify({'error': 'limit は1以上で指定してください'}), 400
+
+    chunks = ndjson_chunks(export_rows(name, after=after, limit=limit))
+    headers = {
+        'Content-Disposition': f'attachment; filename="{name}.ndjson"',
+        'Cache-Control': 'no-store',
+    }
+    if wants_gzip():
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+    # ジェネレータの中でもセッションを使えるよう、リクエストのコンテキストを保つ
+    return Response(stream_with_context(chunks), mimetype='application/x-ndjson', headers=headers)
@@ -1,8 +1,16 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, g
 from src.models.user import User, db
+from src.services.identity import login_required, identity_cache
+from src.services.passwords import HashingOverloaded
 
 auth_bp = Blueprint('auth', __name__)
 
+def overloaded_response(error):
+    """パスワード処理が混雑しているときの503レスポンス"""
+    response = jsonify({'error': 'ただいま混み合っています。しばらくしてから再度お試しください'})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
 @auth_bp.route('/login', methods=['POST'])
 def login():
     try:
@@ -16,6 +24,16 @@ def login():
         user = User.query.filter_by(username=username).first()
         
         if user and user.check_password(password):
+            # ハッシュの設定（方式・コスト）が変わっていれば、ここで計算し直す
+            # 混雑時は次回のログインに回す
+            if user.password_needs_rehash():
+                try:
+                    user.set_password(password)
+                    db.session.commit()
+                    identity_cache.invalidate(user.id)
+                except HashingOverloaded:
+                    db.session.rollback()
+            
             session['user_id'] = user.id
             return jsonify({
                 'message': 'ログインに成功しました',
@@ -24,7 +42,11 @@ def login():
         else:
             return jsonify({'error': 'ユーザー名またはパスワードが間違っています'}), 401
             
+    except HashingOverloaded as e:
+        db.session.rollback()
+        return overloaded_response(e)
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @auth_bp.route('/register', methods=['POST'])
@@ -60,6 +82,9 @@ def register():
             'user': user.to_dict()
         }), 201
         
+    except HashingOverloaded as e:
+        db.session.rollback()
+        return overloaded_response(e)
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -70,14 +95,7 @@ def logout():
     return jsonify({'message': 'ログアウトしました'}), 200
 
 @auth_bp.route('/me', methods=['GET'])
+@login_required
 def get_current_user():
-    user_id = session.get('user_id')
-    if not user_id:
-        return jsonify({'error': '認証が必要です'}), 401
-    
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'error': 'ユーザーが見つかりません'}), 404
-    
-    return jsonify({'user': user.to_dict()}), 200
+    return jsonify({'user': g.current_user.to_dict()}), 200
 
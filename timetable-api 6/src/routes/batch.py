@@ -0,0 +1,44 @@
+from flask import Blueprint, request, jsonify, current_app
+from src.services.batch import batch_dispatcher, InvalidBatch, BATCH_ENVIRON_KEY
+from src.services.request_cache import request_cache
+
+batch_bp = Blueprint('batch', __name__)
+
+@batch_bp.route('/batch', methods=['POST'])
+def batch():
+    """複数のAPI呼び出しを1回のリクエストでまとめて実行する
+
+    本文は ``{"requests": [{"id": "me", "method": "GET", "path": "/api/me"}, ...]}``
+    （配列だけでもよい）。``"parallel": false`` で読み取りも順番に実行する。
+    結果は同じ順番で ``{"responses": [{"id", "status", "headers", "body"}, ...]}``
+    として返す。サブリクエストの認証はそれぞれのエンドポイントで行う。
+    """
+    if request.environ.get(BATCH_ENVIRON_KEY):
+        return jsonify({'error': 'バッチを入れ子にすることはできません'}), 400
+
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        items = data.get('requests')
+        parallel = data.get('parallel', True) is not False
+    else:
+        items = data
+        parallel = True
+
+    try:
+        items = batch_dispatcher.validate(items, request.path)
+    except InvalidBatch as e:
+        return jsonify({'error': str(e)}), 400
+
+    results, set_cookies = batch_dispatcher.dispatch(
+        current_app._get_current_object(),
+        items,
+        cookies=request.cookies.to_dict(),
+        environ_base={'REMOTE_ADDR': request.remote_addr},
+        cache=request_cache(),
+        parallel=parallel,
+    )
+
+    response = jsonify({'responses': results})
+    for header in set_cookies:
+        response.headers.add('Set-Cookie', header)
+    return response, 200
@@ -0,0 +1,63 @@
+from flask import Blueprint, request, jsonify, g
+from src.services.identity import login_required
+from src.routes.friends import accepted_friends, pending_requests, friend_list, friend_request_entry
+from src.routes.timetable import timetable_list
+from src.routes.messages import conversation_list, unread_count
+from src.services.serialization import wants_full_view
+
+dashboard_bp = Blueprint('dashboard', __name__)
+
+# 起動時に画面が必要とする項目（既定ではすべて返す）
+DASHBOARD_SECTIONS = ('me', 'friends', 'friend_requests', 'unread_count', 'timetable', 'conversations')
+
+def requested_sections():
+    """?fields=friends,unread_count のように指定された項目。不明な項目があれば None"""
+    fields = request.args.get('fields')
+    if not fields:
+        return set(DASHBOARD_SECTIONS)
+
+    sections = {field.strip() for field in fields.split(',') if field.strip()}
+    if not sections or not sections <= set(DASHBOARD_SECTIONS):
+        return None
+    return sections
+
+@dashboard_bp.route('/dashboard', methods=['GET'])
+@login_required
+def get_dashboard():
+    """/me・/friends・/friend-requests・/unread-count・/timetable・/conversations をまとめて返す"""
+    user = g.current_user
+
+    sections = requested_sections()
+    if sections is None:
+        return jsonify({
+            'error': '無効な項目です',
+            'allowed_fields': list(DASHBOARD_SECTIONS)
+        }), 400
+
+    try:
+        result = {}
+        if 'me' in sections:
+            result['user'] = user.to_dict()
+
+        # 友達一覧と友達申請は /friends・/friend-requests と同じ問い合わせで作る
+        if 'friends' in sections:
+            result['friends'] = friend_list(accepted_friends(user.id), full_view=wants_full_view())
+
+        if 'friend_requests' in sections:
+            received, sent = pending_requests(user.id)
+            result['received_requests'] = [friend_request_entry(rel, other) for rel, other in received]
+            result['sent_requests'] = [friend_request_entry(rel, other) for rel, other in sent]
+
+        if 'unread_count' in sections:
+            result['unread_count'] = unread_count(user.id)
+
+        if 'timetable' in sections:
+            result['timetables'] = timetable_list(user.id)
+
+        if 'conversations' in sections:
+            result['conversations'] = conversation_list(user.id)
+
+        return jsonify(result), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -1,155 +1,285 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, g
 from src.models.user import User, db
+from src.services.identity import login_required
 from src.models.friend import Friend
 from src.models.timetable import Timetable
-from datetime import datetime, time
-import qrcode
-import io
+from src.models.tombstone import Tombstone
+from src.models.suggestion import FriendSuggestion
+from src.routes.qr import qr_code_fields, wants_inline_qr, resolve_qr_target
+from src.services.qr_tokens import issue_token
+from src.services.serialization import wants_full_view
+from src.services.response_cache import response_cache
+from src.services.events import events
+from src.services.outbox import outbox
+from src.services.suggestions import related_user_ids, SUGGESTIONS_PER_USER
+from sqlalchemy import case, exists, literal, select, tuple_, union_all
+from collections import Counter
+from datetime import datetime
 import base64
+import json
 
 friends_bp = Blueprint('friends', __name__)
 
-def require_auth():
-    user_id = session.get('user_id')
-    if not user_id:
-        return None
-    return User.query.get(user_id)
+FRIENDS_PAGE_DEFAULT = 50
+FRIENDS_PAGE_MAX = 200
+FRIEND_STATUS_FILTERS = ('free', 'in_class')
+BULK_FRIEND_REQUEST_LIMIT = 100
+RELATION_RANK = {'accepted': 2, 'pending': 1}
 
-def get_current_class_status(user_id):
-    """現在の授業状況を取得"""
+def get_class_statuses(user_ids):
+    """複数ユーザーの現在の授業状況を {user_id: 状況} で返す（時間割は1回の問い合わせ）"""
+    user_ids = list(user_ids)
+    statuses = {user_id: {'status': 'free'} for user_id in user_ids}
+    
     now = datetime.now()
+    current_day = now.weekday()  # 0=月 ... 6=日
+    if current_day > 4 or not user_ids:  # 土日は授業なし
+        return statuses
+    
+    # 現在時刻が授業時間内のコマだけを取得
     current_time = now.time()
-    current_day_name = now.strftime('%A').lower()  # monday, tuesday, etc.
+    current_classes = Timetable.query.filter(
+        Timetable.user_id.in_(user_ids),
+        Timetable.day_of_week == current_day,
+        Timetable.start_time <= current_time,
+        Timetable.end_time >= current_time
+    ).all()
     
-    # 曜日を整数に変換
-    day_map = {
-        'monday': 0,
-        'tuesday': 1,
-        'wednesday': 2,
-        'thursday': 3,
-        'friday': 4,
-        'saturday': 5,
-        'sunday': 6
+    for class_item in current_classes:
+        statuses[class_item.user_id] = {
+            'status': 'in_class',
+            'subject': class_item.subject_name,
+            'location': class_item.room,
+            'end_time': class_item.end_time.strftime('%H:%M')
+        }
+    
+    return statuses
+
+def get_current_class_status(user_id):
+    """現在の授業状況を取得"""
+    return get_class_statuses([user_id])[user_id]
+
+def friend_entry(friendship_id, friend_user, class_status, full_view=False):
+    friend_data = {
+        'id': friend_user.id,
+        'username': friend_user.username,
+        'class_status': class_status,
+        'friendship_id': friendship_id
     }
+    if full_view:
+        friend_data['email'] = friend_user.email
+    return friend_data
+
+def friend_list(friend_rows, full_view=False):
+    """(friendship_id, 相手ユーザー) の一覧から、空き時間の友達が先頭の一覧を作る"""
+    statuses = get_class_statuses(friend_user.id for _, friend_user in friend_rows)
     
-    current_day = day_map.get(current_day_name)
-    if current_day is None or current_day > 4:  # 土日は授業なし
-        return {'status': 'free'}
+    friends_list = [
+        friend_entry(friendship_id, friend_user, statuses[friend_user.id], full_view)
+        for friendship_id, friend_user in friend_rows
+    ]
     
-    # 時間割を取得
-    current_classes = Timetable.query.filter(
-        Timetable.user_id == user_id,
-        Timetable.day_of_week == current_day
+    # 空き時間の友達を上に表示（同じ状況の中はユーザー名順。/friends の並びと同じ）
+    friends_list.sort(key=lambda x: (x['class_status']['status'] != 'free', x['username']))
+    return friends_list
+
+def accepted_friendships(user_id):
+    """承認済みの友達関係を (friendship_id, friend_id) で返す副問い合わせ
+
+    OR で両方向を結合するとインデックスが使えないので、申請した側・された側を
+    それぞれインデックスで引いて UNION ALL にする。
+    """
+    return union_all(
+        select(Friend.id.label('friendship_id'), Friend.friend_user_id.label('friend_id'))
+        .where(Friend.user_id == user_id, Friend.status == 'accepted'),
+        select(Friend.id, Friend.user_id).where(Friend.friend_user_id == user_id, Friend.status == 'accepted'),
+    ).subquery('friendships')
+
+def accepted_friends(user_id):
+    """承認済みの友達を (friendship_id, 相手ユーザー) の一覧で返す"""
+    friendships = accepted_friendships(user_id)
+    return db.session.query(friendships.c.friendship_id, User).join(
+        User, User.id == friendships.c.friend_id
+    ).all()
+
+def pending_requests(user_id):
+    """(受信した申請, 送信した申請) をそれぞれ (友達関係, 相手ユーザー) の一覧で返す
+
+    受信は friend_user_id、送信は user_id のインデックスで別々に引く。
+    """
+    received = db.session.query(Friend, User).join(
+        User, Friend.user_id == User.id
+    ).filter(
+        Friend.friend_user_id == user_id,
+        Friend.status == 'pending'
     ).all()
     
-    # 現在時刻が授業時間内かチェック
-    for class_item in current_classes:
-        if class_item.start_time <= current_time <= class_item.end_time:
-            return {
-                'status': 'in_class',
-                'subject': class_item.subject_name,
-                'location': class_item.room,
-                'end_time': class_item.end_time.strftime('%H:%M')
-            }
-    
-    return {'status': 'free'}
+    sent = db.session.query(Friend, User).join(
+        User, Friend.friend_user_id == User.id
+    ).filter(
+        Friend.user_id == user_id,
+        Friend.status == 'pending'
+    ).all()
+    return received, sent
+
+def in_class_now(user_id_column):
+    """ユーザーが今授業中なら1、空きなら0になる式（時間割のインデックスで1行だけ確かめる）"""
+    now = datetime.now()
+    if now.weekday() > 4:  # 土日は授業なし
+        return literal(0)
+    current_time = now.time()
+    return case((exists().where(
+        Timetable.user_id == user_id_column,
+        Timetable.day_of_week == now.weekday(),
+        Timetable.start_time <= current_time,
+        Timetable.end_time >= current_time
+    ), 1), else_=0)
+
+def encode_friends_cursor(in_class, username, user_id):
+    raw = json.dumps([in_class, username, user_id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_friends_cursor(cursor):
+    """ページのカーソルから (授業中か, ユーザー名, ユーザーID) を取り出す。不正なら ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        in_class, username, user_id = json.loads(raw)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise ValueError('invalid cursor')
+    if in_class not in (0, 1) or not isinstance(username, str) or not isinstance(user_id, str):
+        raise ValueError('invalid cursor')
+    return in_class, username, user_id
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def friend_request_entry(friend_request, request_user):
+    return {
+        'id': friend_request.id,
+        'user': {
+            'id': request_user.id,
+            'username': request_user.username,
+            'email': request_user.email
+        },
+        'created_at': friend_request.created_at.isoformat()
+    }
 
 @friends_bp.route('/friends', methods=['GET'])
+@login_required
 def get_friends():
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+    """承認済みの友達一覧（空き時間の友達が先頭、同じ状況の中はユーザー名順）
+
+    ?limit= か ?cursor= を付けるとページに分け、next_cursor で続きを取る。
+    ?status=free|in_class で授業状況、?q= でユーザー名の前方一致で絞り込む。
+    並び替えと絞り込みはデータベースで行い、授業状況は返すページの分だけ引く。
+
+    授業中かどうかは時刻で変わるので保存せず、友達ごとに時間割のインデックスを
+    EXISTS で1回引いて並び替える（友達の数に比例する。並びまでインデックスで
+    済ませる非正規化は今回は見送った）。
+    """
+    user = g.current_user
+    
+    status_filter = request.args.get('status')
+    if status_filter is not None and status_filter not in FRIEND_STATUS_FILTERS:
+        return jsonify({'error': '無効な状況です', 'allowed_statuses': list(FRIEND_STATUS_FILTERS)}), 400
+    
+    after = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            after = decode_friends_cursor(cursor)
+        except ValueError:
+            return jsonify({'error': '無効なカーソルです'}), 400
+    
+    limit = request.args.get('limit', type=int)
+    if limit is None and cursor:
+        limit = FRIENDS_PAGE_DEFAULT
+    if limit is not None:
+        limit = max(1, min(limit, FRIENDS_PAGE_MAX))
+    prefix = request.args.get('q', '').strip()
     
     try:
-        # 承認済みの友達を取得
-        friends_query = db.session.query(Friend, User).join(
-            User, 
-            (Friend.friend_user_id == User.id) | (Friend.user_id == User.id)
-        ).filter(
-            ((Friend.user_id == user.id) | (Friend.friend_user_id == user.id)) &
-            (Friend.status == 'accepted') &
-            (User.id != user.id)
-        ).all()
-        
-        friends_list = []
-        for friend_rel, friend_user in friends_query:
-            # 現在の授業状況を取得
-            class_status = get_current_class_status(friend_user.id)
-            
-            friends_list.append({
-                'id': friend_user.id,
-                'username': friend_user.username,
-                'email': friend_user.email,
-                'class_status': class_status,
-                'friendship_id': friend_rel.id
-            })
-        
-        # 空き時間の友達を上に表示
-        friends_list.sort(key=lambda x: x['class_status']['status'] != 'free')
+        friendships = accepted_friendships(user.id)
+        in_class = in_class_now(friendships.c.friend_id)
+        friends_query = db.session.query(friendships.c.friendship_id, User, in_class).join(
+            User, User.id == friendships.c.friend_id
+        )
         
-        return jsonify({'friends': friends_list}), 200
+        if status_filter is not None:
+            friends_query = friends_query.filter(in_class == (1 if status_filter == 'in_class' else 0))
+        if prefix:
+            friends_query = friends_query.filter(User.username.like(escape_like(prefix) + '%', escape='\\'))
+        if after is not None:
+            friends_query = friends_query.filter(tuple_(in_class, User.username, User.id) > tuple_(*after))
+        
+        friends_query = friends_query.order_by(in_class, User.username, User.id)
+        if limit is not None:
+            friends_query = friends_query.limit(limit + 1)
+        rows = friends_query.all()
+        
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            _, last_user, last_in_class = rows[-1]
+            next_cursor = encode_friends_cursor(last_in_class, last_user.username, last_user.id)
+        
+        statuses = get_class_statuses(friend_user.id for _, friend_user, _ in rows)
+        full_view = wants_full_view()
+        friends = [
+            friend_entry(friendship_id, friend_user, statuses[friend_user.id], full_view)
+            for friendship_id, friend_user, _ in rows
+        ]
+        
+        return jsonify({'friends': friends, 'next_cursor': next_cursor}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @friends_bp.route('/friend-requests', methods=['GET'])
+@login_required
+@response_cache.cached(lambda: [('friends', g.current_user.id)])
 def get_friend_requests():
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+    user = g.current_user
     
     try:
-        # 受信した友達申請を取得
-        received_requests = db.session.query(Friend, User).join(
-            User, Friend.user_id == User.id
-        ).filter(
-            Friend.friend_user_id == user.id,
-            Friend.status == 'pending'
-        ).all()
+        received_requests, sent_requests = pending_requests(user.id)
         
-        # 送信した友達申請を取得
-        sent_requests = db.session.query(Friend, User).join(
-            User, Friend.friend_user_id == User.id
+        return jsonify({
+            'received_requests': [friend_request_entry(req, req_user) for req, req_user in received_requests],
+            'sent_requests': [friend_request_entry(req, req_user) for req, req_user in sent_requests]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@friends_bp.route('/friends/suggestions', methods=['GET'])
+@login_required
+def get_friend_suggestions():
+    """知り合いかもしれないユーザー（事前に計算した上位N件）"""
+    user = g.current_user
+    limit = max(1, min(request.args.get('limit', 20, type=int), SUGGESTIONS_PER_USER))
+    
+    try:
+        # 計算した後に友達・申請中になった相手は除く
+        rows = db.session.query(FriendSuggestion, User).join(
+            User, FriendSuggestion.candidate_id == User.id
         ).filter(
-            Friend.user_id == user.id,
-            Friend.status == 'pending'
-        ).all()
+            FriendSuggestion.user_id == user.id,
+            FriendSuggestion.candidate_id.notin_(related_user_ids(user.id))
+        ).order_by(FriendSuggestion.score.desc(), FriendSuggestion.candidate_id).limit(limit).all()
         
         return jsonify({
-            'received_requests': [
-                {
-                    'id': req.id,
-                    'user': {
-                        'id': req_user.id,
-                        'username': req_user.username,
-                        'email': req_user.email
-                    },
-                    'created_at': req.created_at.isoformat()
-                }
-                for req, req_user in received_requests
-            ],
-            'sent_requests': [
-                {
-                    'id': req.id,
-                    'user': {
-                        'id': req_user.id,
-                        'username': req_user.username,
-                        'email': req_user.email
-                    },
-                    'created_at': req.created_at.isoformat()
-                }
-                for req, req_user in sent_requests
-            ]
+            'suggestions': [suggestion.to_dict(candidate) for suggestion, candidate in rows],
+            'computed_at': max((s.computed_at for s, _ in rows), default=None)
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @friends_bp.route('/users/search', methods=['GET'])
+@login_required
 def search_users():
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+    user = g.current_user
     
     try:
         query = request.args.get('q', '').strip()
@@ -161,24 +291,29 @@ def search_users():
             (User.username.ilike(f'%{query}%')) | (User.email.ilike(f'%{query}%'))
         ).filter(User.id != user.id).limit(20).all()
         
-        # 既存の友達関係をチェック
+        # 検索結果との友達関係を1回で取得（両方向をそれぞれインデックスで引く）
+        result_ids = [search_user.id for search_user in users]
+        relations = {}
+        if result_ids:
+            for other_id, requester_id, status in db.session.execute(union_all(
+                select(Friend.friend_user_id, Friend.user_id, Friend.status).where(
+                    Friend.user_id == user.id, Friend.friend_user_id.in_(result_ids)),
+                select(Friend.user_id, Friend.user_id, Friend.status).where(
+                    Friend.friend_user_id == user.id, Friend.user_id.in_(result_ids)),
+            )):
+                # 同じ相手と複数の行があれば 承認済み > 申請中 > その他 の順に優先する
+                rank = RELATION_RANK.get(status, 0)
+                if other_id not in relations or rank > RELATION_RANK.get(relations[other_id][1], 0):
+                    relations[other_id] = (requester_id, status)
+        
         user_list = []
         for search_user in users:
-            # 友達関係の状態を確認
-            friendship = Friend.query.filter(
-                ((Friend.user_id == user.id) & (Friend.friend_user_id == search_user.id)) |
-                ((Friend.user_id == search_user.id) & (Friend.friend_user_id == user.id))
-            ).first()
-            
+            requester_id, status = relations.get(search_user.id, (None, None))
             friendship_status = 'none'
-            if friendship:
-                if friendship.status == 'accepted':
-                    friendship_status = 'friends'
-                elif friendship.status == 'pending':
-                    if friendship.user_id == user.id:
-                        friendship_status = 'sent'
-                    else:
-                        friendship_status = 'received'
+            if status == 'accepted':
+                friendship_status = 'friends'
+            elif status == 'pending':
+                friendship_status = 'sent' if requester_id == user.id else 'received'
             
             user_list.append({
                 'id': search_user.id,
@@ -193,10 +328,9 @@ def search_users():
         return jsonify({'error': str(e)}), 500
 
 @friends_bp.route('/friend-request', methods=['POST'])
+@login_required
 def send_friend_request():
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+    user = g.current_user
     
     try:
         data = request.get_json()
@@ -233,6 +367,7 @@ def send_friend_request():
         )
         
         db.session.add(friend_request)
+        events.publish('friendship.changed', user_ids=[user.id, friend_user_id])
         db.session.commit()
         
         return jsonify({'message': '友達申請を送信しました'}), 201
@@ -241,11 +376,10 @@ def send_friend_request():
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
-@friends_bp.route('/friend-request/<int:request_id>/accept', methods=['POST'])
+@friends_bp.route('/friend-request/<request_id>/accept', methods=['POST'])
+@login_required
 def accept_friend_request(request_id):
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+    user = g.current_user
     
     try:
         # 友達申請を取得
@@ -260,6 +394,8 @@ def accept_friend_request(request_id):
         
         # 申請を承認
         friend_request.status = 'accepted'
+        events.publish('friendship.changed', user_ids=[friend_request.user_id, user.id])
+        outbox.enqueue('friendship.accepted', user_ids=[friend_request.user_id, user.id])
         db.session.commit()
         
         return jsonify({'message': '友達申請を承認しました'}), 200
@@ -268,11 +404,10 @@ def accept_friend_request(request_id):
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
-@friends_bp.route('/friend-request/<int:request_id>/reject', methods=['POST'])
+@friends_bp.route('/friend-request/<request_id>/reject', methods=['POST'])
+@login_required
 def reject_friend_request(request_id):
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+    user = g.current_user
     
     try:
         # 友達申請を取得
@@ -287,6 +422,8 @@ def reject_friend_request(request_id):
         
         # 申請を削除
         db.session.delete(friend_request)
+        Tombstone.record('friend', friend_request.id, friend_request.user_id, friend_request.friend_user_id)
+        events.publish('friendship.changed', user_ids=[friend_request.user_id, user.id])
         db.session.commit()
         
         return jsonify({'message': '友達申請を拒否しました'}), 200
@@ -295,37 +432,174 @@ def reject_friend_request(request_id):
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
-@friends_bp.route('/qr-code', methods=['GET'])
-def generate_qr_code():
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+def bulk_ids(key):
+    """本文の key から重複を除いたIDの一覧を取り出す。不正ならエラーのレスポンスを返す"""
+    data = request.get_json(silent=True) or {}
+    ids = data.get(key)
+    if not isinstance(ids, list) or not ids or not all(isinstance(i, str) and i for i in ids):
+        return None, (jsonify({'error': f'{key} は1件以上のIDの配列で指定してください'}), 400)
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > BULK_FRIEND_REQUEST_LIMIT:
+        return None, (jsonify({'error': f'一度に処理できるのは{BULK_FRIEND_REQUEST_LIMIT}件までです'}), 400)
+    return ids, None
+
+def bulk_result(results):
+    return jsonify({'results': results, 'counts': dict(Counter(r['result'] for r in results))}), 200
+
+def received_requests_by_id(user_id, request_ids):
+    """自分宛ての申請中の友達申請のうち、指定したIDのものを {id: 申請} で返す（1回の問い合わせ）"""
+    return {
+        friend_request.id: friend_request
+        for friend_request in Friend.query.filter(
+            Friend.id.in_(request_ids),
+            Friend.friend_user_id == user_id,
+            Friend.status == 'pending'
+        )
+    }
+
+@friends_bp.route('/friend-requests/send', methods=['POST'])
+@login_required
+def send_friend_requests():
+    """複数のユーザーにまとめて友達申請する（グループでのQRコード読み取りなど）
+
+    本文は ``{"user_ids": [...]}``。検査はまとめて行い、送れる分だけを1回の
+    トランザクションで作る。結果は ID ごとに sent / self / not_found /
+    already_friends / already_requested のいずれかで返す。
+    """
+    user = g.current_user
+    user_ids, error = bulk_ids('user_ids')
+    if error:
+        return error
     
     try:
-        # QRコードのデータ（ユーザーIDを含むURL）
-        qr_data = f"https://bluelink-app-lx59.onrender.com/add-friend/{user.id}"
-        
-        # QRコードを生成
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(qr_data)
-        qr.make(fit=True)
+        existing_users = {row[0] for row in db.session.query(User.id).filter(User.id.in_(user_ids))}
+        
+        # 既存の友達関係（両方向をそれぞれインデックスで引く）
+        relations = {}
+        for other_id, status in db.session.execute(union_all(
+            select(Friend.friend_user_id, Friend.status).where(
+                Friend.user_id == user.id, Friend.friend_user_id.in_(user_ids),
+                Friend.status.in_(('pending', 'accepted'))),
+            select(Friend.user_id, Friend.status).where(
+                Friend.friend_user_id == user.id, Friend.user_id.in_(user_ids),
+                Friend.status.in_(('pending', 'accepted'))),
+        )):
+            if relations.get(other_id) != 'accepted':
+                relations[other_id] = status
+        
+        results = []
+        targets = []
+        for target_id in user_ids:
+            if target_id == user.id:
+                result = 'self'
+            elif target_id not in existing_users:
+                result = 'not_found'
+            elif relations.get(target_id) == 'accepted':
+                result = 'already_friends'
+            elif relations.get(target_id) == 'pending':
+                result = 'already_requested'
+            else:
+                result = 'sent'
+                targets.append(target_id)
+            results.append({'id': target_id, 'result': result})
+        
+        if targets:
+            db.session.add_all([
+                Friend(user_id=user.id, friend_user_id=target_id, status='pending') for target_id in targets
+            ])
+            events.publish('friendship.changed', user_ids=[user.id] + targets)
+            db.session.commit()
+        
+        return bulk_result(results)
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@friends_bp.route('/friend-requests/accept', methods=['POST'])
+@login_required
+def accept_friend_requests():
+    """受け取った友達申請をまとめて承認する
+
+    本文は ``{"request_ids": [...]}``。1回の UPDATE で承認し、結果は ID ごとに
+    accepted / not_found で返す。
+    """
+    user = g.current_user
+    request_ids, error = bulk_ids('request_ids')
+    if error:
+        return error
+    
+    try:
+        pending = received_requests_by_id(user.id, request_ids)
+        requester_ids = [friend_request.user_id for friend_request in pending.values()]
+        
+        if pending:
+            Friend.query.filter(
+                Friend.id.in_(list(pending)),
+                Friend.status == 'pending'
+            ).update({Friend.status: 'accepted'}, synchronize_session=False)
+            events.publish('friendship.changed', user_ids=[user.id] + requester_ids)
+            for requester_id in requester_ids:
+                outbox.enqueue('friendship.accepted', user_ids=[requester_id, user.id])
+            db.session.commit()
+        
+        return bulk_result([
+            {'id': request_id, 'result': 'accepted' if request_id in pending else 'not_found'}
+            for request_id in request_ids
+        ])
         
-        # 画像を生成
-        img = qr.make_image(fill_color="black", back_color="white")
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@friends_bp.route('/friend-requests/reject', methods=['POST'])
+@login_required
+def reject_friend_requests():
+    """受け取った友達申請をまとめて拒否する
+
+    本文は ``{"request_ids": [...]}``。1回の DELETE で削除し、結果は ID ごとに
+    rejected / not_found で返す。
+    """
+    user = g.current_user
+    request_ids, error = bulk_ids('request_ids')
+    if error:
+        return error
+    
+    try:
+        pending = received_requests_by_id(user.id, request_ids)
+        requester_ids = [friend_request.user_id for friend_request in pending.values()]
+        
+        if pending:
+            Friend.query.filter(
+                Friend.id.in_(list(pending)),
+                Friend.status == 'pending'
+            ).delete(synchronize_session=False)
+            for request_id, friend_request in pending.items():
+                Tombstone.record('friend', request_id, friend_request.user_id, user.id)
+            events.publish('friendship.changed', user_ids=[user.id] + requester_ids)
+            db.session.commit()
+        
+        return bulk_result([
+            {'id': request_id, 'result': 'rejected' if request_id in pending else 'not_found'}
+            for request_id in request_ids
+        ])
         
-        # Base64エンコード
-        buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        buffer.seek(0)
-        qr_code_base64 = base64.b64encode(buffer.getvalue()).decode()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@friends_bp.route('/qr-code', methods=['GET'])
+@login_required
+def generate_qr_code():
+    user = g.current_user
+    
+    try:
+        # QRコードのデータ（署名付きトークンを含むURL）
+        qr_data = f"https://bluelink-app-lx59.onrender.com/add-friend/{issue_token(user)}"
         
         return jsonify({
-            'qr_code': f"data:image/png;base64,{qr_code_base64}",
+            **qr_code_fields(qr_data, inline=wants_inline_qr()),
+            'qr_data': qr_data,
             'user_id': user.id,
             'username': user.username
         }), 200
@@ -333,21 +607,21 @@ def generate_qr_code():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@friends_bp.route('/add-friend/<int:user_id>', methods=['POST'])
-def add_friend_by_qr(user_id):
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+@friends_bp.route('/add-friend/<code>', methods=['POST'])
+@login_required
+def add_friend_by_qr(code):
+    user = g.current_user
     
     try:
+        # 対象ユーザーの存在確認（署名付きトークンまたはユーザーID）
+        friend_user, error = resolve_qr_target(code)
+        if error:
+            return error
+        user_id = friend_user.id
+        
         if user_id == user.id:
             return jsonify({'error': '自分自身を友達に追加することはできません'}), 400
         
-        # 対象ユーザーの存在確認
-        friend_user = User.query.get(user_id)
-        if not friend_user:
-            return jsonify({'error': 'ユーザーが見つかりません'}), 404
-        
         # 既存の友達関係をチェック
         existing_friendship = Friend.query.filter(
             ((Friend.user_id == user.id) & (Friend.friend_user_id == user_id)) |
@@ -368,6 +642,7 @@ def add_friend_by_qr(user_id):
         )
         
         db.session.add(friend_request)
+        events.publish('friendship.changed', user_ids=[user.id, user_id])
         db.session.commit()
         
         return jsonify({
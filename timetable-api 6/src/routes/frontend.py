@@ -0,0 +1,38 @@
+from flask import Blueprint, request, send_from_directory
+from src.services.static_assets import static_assets
+
+frontend_bp = Blueprint('frontend', __name__)
+
+@frontend_bp.route('/debug')
+def debug():
+    # 起動時に作ったマニフェストの内容を返す（リクエスト時にディレクトリを読まない）
+    return (
+        f"Static folder: {static_assets.root}<br>"
+        f"Files: {len(static_assets.manifest)}<br>"
+        f"Manifest built at: {static_assets.built_at}<br>"
+        f"Contents: {sorted(static_assets.manifest)}"
+    )
+
+@frontend_bp.route('/', defaults={'path': ''})
+@frontend_bp.route('/<path:path>')
+def serve(path):
+    if static_assets.root is None:
+        return "Static folder not configured", 404
+    
+    asset = static_assets.resolve(path)
+    if asset is None:
+        return "index.html not found", 404
+    
+    file_path, encoding, etag = static_assets.choose_variant(asset, request.accept_encodings)
+    response = send_from_directory(
+        static_assets.root, file_path,
+        mimetype=asset.mimetype, etag=etag, max_age=None,
+        download_name=asset.path.rsplit('/', 1)[-1]
+    )
+    
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if asset.variants:
+        response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = asset.cache_control
+    return response
@@ -1,17 +1,16 @@
-from flask import Blueprint, request, jsonify, session
-from src.models.user import User, db
+from flask import Blueprint, request, jsonify, g
+from src.models.db import db
+from src.services.identity import login_required
+from src.services.events import events
+from src.services.response_cache import response_cache
+from src.services.serialization import project, wants_full_view, MESSAGE_FIELDS, LAST_MESSAGE_FIELDS, USER_CARD_FIELDS
+from sqlalchemy.orm import joinedload
 from src.models.message import Message, Conversation
 from src.models.friend import Friend
 from datetime import datetime
 
 messages_bp = Blueprint('messages', __name__)
 
-def require_auth():
-    user_id = session.get('user_id')
-    if not user_id:
-        return None
-    return User.query.get(user_id)
-
 def are_friends(user1_id, user2_id):
     """2人のユーザーが友達かどうかを確認"""
     friendship = Friend.query.filter(
@@ -21,30 +20,59 @@ def are_friends(user1_id, user2_id):
     
     return friendship is not None
 
+def conversation_summary(conversation, user_id):
+    """会話一覧用の軽量な表現（相手と最新メッセージの必要な項目のみ）"""
+    if wants_full_view():
+        return conversation.to_dict(user_id)
+    
+    other_user = conversation.user2 if conversation.user1_id == user_id else conversation.user1
+    return {
+        'id': conversation.id,
+        'other_user': project(other_user, USER_CARD_FIELDS),
+        'last_message': project(conversation.last_message, LAST_MESSAGE_FIELDS),
+        'updated_at': conversation.updated_at
+    }
+
+def message_summary(message):
+    if wants_full_view():
+        return message.to_dict()
+    return project(message, MESSAGE_FIELDS)
+
+def conversation_list(user_id):
+    """ユーザーが参加している会話（新しい順）"""
+    conversations = Conversation.query.options(
+        joinedload(Conversation.user1),
+        joinedload(Conversation.user2),
+        joinedload(Conversation.last_message)
+    ).filter(
+        (Conversation.user1_id == user_id) | (Conversation.user2_id == user_id)
+    ).order_by(Conversation.updated_at.desc()).all()
+    
+    return [conversation_summary(conv, user_id) for conv in conversations]
+
+def unread_count(user_id):
+    """未読メッセージ数"""
+    return Message.query.filter(
+        Message.receiver_id == user_id,
+        Message.is_read == False
+    ).count()
+
 @messages_bp.route('/conversations', methods=['GET'])
+@login_required
+@response_cache.cached(lambda: [('conversations', g.current_user.id)])
 def get_conversations():
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+    user = g.current_user
     
     try:
-        # ユーザーが参加している会話を取得
-        conversations = Conversation.query.filter(
-            (Conversation.user1_id == user.id) | (Conversation.user2_id == user.id)
-        ).order_by(Conversation.updated_at.desc()).all()
-        
-        return jsonify({
-            'conversations': [conv.to_dict(user.id) for conv in conversations]
-        }), 200
+        return jsonify({'conversations': conversation_list(user.id)}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@messages_bp.route('/conversations/<int:user_id>', methods=['GET'])
+@messages_bp.route('/conversations/<user_id>', methods=['GET'])
+@login_required
 def get_or_create_conversation(user_id):
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+    user = g.current_user
     
     if user_id == user.id:
         return jsonify({'error': '自分自身との会話はできません'}), 400
@@ -55,7 +83,11 @@ def get_or_create_conversation(user_id):
     
     try:
         # 既存の会話を検索
-        conversation = Conversation.query.filter(
+        conversation = Conversation.query.options(
+            joinedload(Conversation.user1),
+            joinedload(Conversation.user2),
+            joinedload(Conversation.last_message)
+        ).filter(
             ((Conversation.user1_id == user.id) & (Conversation.user2_id == user_id)) |
             ((Conversation.user1_id == user_id) & (Conversation.user2_id == user.id))
         ).first()
@@ -71,6 +103,7 @@ def get_or_create_conversation(user_id):
                 user2_id=user2_id
             )
             db.session.add(conversation)
+            events.publish('conversation.changed', user_ids=[user1_id, user2_id])
             db.session.commit()
         
         return jsonify({'conversation': conversation.to_dict(user.id)}), 200
@@ -80,10 +113,9 @@ def get_or_create_conversation(user_id):
         return jsonify({'error': str(e)}), 500
 
 @messages_bp.route('/conversations/<int:conversation_id>/messages', methods=['GET'])
+@login_required
 def get_messages(conversation_id):
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+    user = g.current_user
     
     try:
         # 会話の存在確認とアクセス権限チェック
@@ -108,20 +140,17 @@ def get_messages(conversation_id):
             page=page, per_page=per_page, error_out=False
         )
         
-        # 未読メッセージを既読にする
-        unread_messages = Message.query.filter(
+        # 未読メッセージを1回の UPDATE で既読にする（読み込み済みのメッセージにも反映される）
+        other_user_id = conversation.user2_id if user.id == conversation.user1_id else conversation.user1_id
+        marked = Message.query.filter(
             Message.receiver_id == user.id,
-            Message.sender_id == (conversation.user2_id if user.id == conversation.user1_id else conversation.user1_id),
+            Message.sender_id == other_user_id,
             Message.is_read == False
-        ).all()
-        
-        for msg in unread_messages:
-            msg.is_read = True
+        ).update({Message.is_read: True}, synchronize_session='evaluate')
         
-        db.session.commit()
-        
-        return jsonify({
-            'messages': [msg.to_dict() for msg in reversed(messages.items)],  # 古い順に並び替え
+        # コミットすると読み込んだメッセージが失効して1件ずつ読み直すので、先に組み立てる
+        result = {
+            'messages': [message_summary(msg) for msg in reversed(messages.items)],  # 古い順に並び替え
             'pagination': {
                 'page': messages.page,
                 'pages': messages.pages,
@@ -130,17 +159,23 @@ def get_messages(conversation_id):
                 'has_next': messages.has_next,
                 'has_prev': messages.has_prev
             }
-        }), 200
+        }
+        
+        if marked:
+            # 会話一覧の最新メッセージの既読状態が変わる
+            events.publish('conversation.changed', user_ids=[user.id, other_user_id])
+        db.session.commit()
+        
+        return jsonify(result), 200
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @messages_bp.route('/conversations/<int:conversation_id>/messages', methods=['POST'])
+@login_required
 def send_message(conversation_id):
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+    user = g.current_user
     
     try:
         data = request.get_json()
@@ -174,11 +209,13 @@ def send_message(conversation_id):
         conversation.last_message_id = message.id
         conversation.updated_at = datetime.utcnow()
         
+        events.publish('message.sent', conversation_id=conversation.id, message_id=message.id,
+                       sender_id=user.id, receiver_id=receiver_id)
         db.session.commit()
         
         return jsonify({
-            'message': message.to_dict(),
-            'conversation': conversation.to_dict(user.id)
+            'message': message_summary(message),
+            'conversation': conversation_summary(conversation, user.id)
         }), 201
         
     except Exception as e:
@@ -186,19 +223,12 @@ def send_message(conversation_id):
         return jsonify({'error': str(e)}), 500
 
 @messages_bp.route('/unread-count', methods=['GET'])
+@login_required
 def get_unread_count():
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+    user = g.current_user
     
     try:
-        # 未読メッセージ数を取得
-        unread_count = Message.query.filter(
-            Message.receiver_id == user.id,
-            Message.is_read == False
-        ).count()
-        
-        return jsonify({'unread_count': unread_count}), 200
+        return jsonify({'unread_count': unread_count(user.id)}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
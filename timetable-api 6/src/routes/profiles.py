@@ -1,15 +1,27 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, g, send_file
 from src.models.user import User, db
+from src.services.identity import login_required
+from src.services.events import events
+from src.services.response_cache import response_cache
 from src.models.profile import Profile
 from src.models.friend import Friend
+from src.routes.auth import overloaded_response
+from src.services.avatars import (
+    avatar_store, AVATAR_SIZES, DEFAULT_AVATAR_SIZE, InvalidAvatar, AvatarTooLarge, AvatarBusy
+)
+from sqlalchemy import select, union_all
+import re
 
 profiles_bp = Blueprint('profiles', __name__)
 
-def require_auth():
-    user_id = session.get('user_id')
-    if not user_id:
-        return None
-    return User.query.get(user_id)
+AVATAR_KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+PROFILE_BATCH_LIMIT = 100
+CARD_AVATAR_SIZE = 64
+
+def requested_avatar_size(default=DEFAULT_AVATAR_SIZE):
+    # ?avatar_size=64 のように表示する大きさを指定すると、それに近いサムネイルのURLを返す
+    return request.args.get('avatar_size', default, type=int)
 
 def are_friends(user1_id, user2_id):
     """2人のユーザーが友達かどうかを確認"""
@@ -21,10 +33,9 @@ def are_friends(user1_id, user2_id):
     return friendship is not None
 
 @profiles_bp.route('/profile', methods=['GET'])
+@login_required
 def get_my_profile():
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+    user = g.current_user
     
     try:
         profile = Profile.query.filter_by(user_id=user.id).first()
@@ -35,16 +46,15 @@ def get_my_profile():
             db.session.add(profile)
             db.session.commit()
         
-        return jsonify({'profile': profile.to_dict(is_owner=True)}), 200
+        return jsonify({'profile': profile.to_dict(is_owner=True, avatar_size=requested_avatar_size())}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @profiles_bp.route('/profile', methods=['PUT'])
+@login_required
 def update_my_profile():
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+    user = g.current_user
     
     try:
         data = request.get_json()
@@ -66,25 +76,27 @@ def update_my_profile():
             profile.hobbies = data['hobbies']
         if 'avatar_url' in data:
             profile.avatar_url = data['avatar_url']
+            profile.avatar_hash = None
         if 'is_public' in data:
             profile.is_public = bool(data['is_public'])
         
+        events.publish('profile.changed', user_id=user.id)
         db.session.commit()
         
         return jsonify({
             'message': 'プロフィールを更新しました',
-            'profile': profile.to_dict(is_owner=True)
+            'profile': profile.to_dict(is_owner=True, avatar_size=requested_avatar_size())
         }), 200
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
-@profiles_bp.route('/profile/<int:user_id>', methods=['GET'])
+@profiles_bp.route('/profile/<user_id>', methods=['GET'])
+@login_required
+@response_cache.cached(lambda user_id: [('profile', user_id), ('friends', g.current_user.id)])
 def get_user_profile(user_id):
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+    user = g.current_user
     
     try:
         # 対象ユーザーの存在確認
@@ -99,7 +111,7 @@ def get_user_profile(user_id):
                 profile = Profile(user_id=user_id)
                 db.session.add(profile)
                 db.session.commit()
-            return jsonify({'profile': profile.to_dict(is_owner=True)}), 200
+            return jsonify({'profile': profile.to_dict(is_owner=True, avatar_size=requested_avatar_size())}), 200
         
         # 友達かどうかを確認
         is_friend = are_friends(user.id, user_id)
@@ -126,40 +138,143 @@ def get_user_profile(user_id):
                 }
             }), 200
         
-        return jsonify({'profile': profile.to_dict(is_owner=False)}), 200
+        # 見られるかどうかは上で判定済み（友達なら非公開のプロフィールも見られる）
+        return jsonify({'profile': profile.to_dict(is_owner=True, avatar_size=requested_avatar_size())}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def friend_ids_among(user_id, candidate_ids):
+    """candidate_ids のうち user_id と友達のIDの集合（両方向をそれぞれインデックスで引く）"""
+    query = union_all(
+        select(Friend.friend_user_id).where(
+            Friend.user_id == user_id, Friend.friend_user_id.in_(candidate_ids), Friend.status == 'accepted'),
+        select(Friend.user_id).where(
+            Friend.friend_user_id == user_id, Friend.user_id.in_(candidate_ids), Friend.status == 'accepted'),
+    )
+    return {row[0] for row in db.session.execute(query)}
+
+def profile_card(user_id, username, profile, visible, is_friend, avatar_size):
+    """一覧表示用の小さなプロフィール（非公開で見られない場合は名前だけ）"""
+    card = {
+        'user_id': user_id,
+        'username': username,
+        'is_friend': is_friend,
+        'is_public': profile.is_public if profile else True,
+    }
+    if profile is None or not visible:
+        card['avatar_url'] = None
+        return card
+    card.update({
+        'avatar_url': profile.avatar(avatar_size),
+        'grade': profile.grade,
+        'department': profile.department,
+    })
+    return card
+
+@profiles_bp.route('/profiles', methods=['GET'])
+@login_required
+def get_profiles():
+    """?user_ids=a,b,c の一覧表示用プロフィールをまとめて返す
+
+    ユーザー・プロフィール・閲覧者の友達関係をそれぞれ1回で引き、公開設定と
+    友達かどうかの判定はまとめてメモリ上で行う。見つからないIDは missing に入る。
+    """
+    user = g.current_user
+    
+    user_ids = list(dict.fromkeys(i.strip() for i in request.args.get('user_ids', '').split(',') if i.strip()))
+    if not user_ids:
+        return jsonify({'error': 'user_ids を指定してください'}), 400
+    if len(user_ids) > PROFILE_BATCH_LIMIT:
+        return jsonify({'error': f'一度に取得できるのは{PROFILE_BATCH_LIMIT}件までです'}), 400
+    
+    try:
+        usernames = dict(db.session.query(User.id, User.username).filter(User.id.in_(user_ids)))
+        profiles = {profile.user_id: profile for profile in Profile.query.filter(Profile.user_id.in_(usernames))}
+        friend_ids = friend_ids_among(user.id, [user_id for user_id in usernames if user_id != user.id])
+        avatar_size = requested_avatar_size(CARD_AVATAR_SIZE)
+        
+        cards = []
+        for user_id in user_ids:
+            if user_id not in usernames:
+                continue
+            profile = profiles.get(user_id)
+            is_friend = user_id in friend_ids
+            # 自分・友達・公開プロフィールなら見られる（get_user_profile と同じ規則）
+            visible = user_id == user.id or is_friend or (profile is not None and profile.is_public)
+            cards.append(profile_card(user_id, usernames[user_id], profile, visible, is_friend, avatar_size))
+        
+        return jsonify({
+            'profiles': cards,
+            'missing': [user_id for user_id in user_ids if user_id not in usernames]
+        }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @profiles_bp.route('/profile/avatar', methods=['POST'])
+@login_required
 def upload_avatar():
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+    """プロフィール画像をアップロードする
+
+    multipart の avatar 項目、または本文そのもの（Content-Type: image/*）で送る。
+    JSON で送った場合は従来どおり名前から作る画像を使う。
+    """
+    user = g.current_user
+    
+    if request.content_length and request.content_length > avatar_store.max_bytes + 64 * 1024:
+        return jsonify({'error': '画像が大きすぎます'}), 413
     
     try:
-        # 簡単なアバター生成（実際の実装では画像アップロード機能を追加）
-        data = request.get_json()
-        avatar_type = data.get('avatar_type', 'default')
-        
         # プロフィールを取得または作成
         profile = Profile.query.filter_by(user_id=user.id).first()
         if not profile:
             profile = Profile(user_id=user.id)
             db.session.add(profile)
         
-        # 簡単なアバターURL生成（実際の実装では画像ファイルを処理）
-        avatar_url = f"https://ui-avatars.com/api/?name={user.username}&background=random&size=200"
-        profile.avatar_url = avatar_url
+        if request.is_json:
+            # 簡単なアバターURL生成（名前から作る外部の画像）
+            profile.avatar_url = f"https://ui-avatars.com/api/?name={user.username}&background=random&size=200"
+            profile.avatar_hash = None
+        else:
+            upload = request.files.get('avatar')
+            # ファイルはメモリに読み込まず、少しずつディスクに書く
+            profile.avatar_hash = avatar_store.save(upload.stream if upload else request.stream)
         
+        avatar_urls = {str(size): profile.avatar(size) for size in AVATAR_SIZES}
+        avatar_url = profile.avatar(requested_avatar_size())
+        events.publish('profile.changed', user_id=user.id)
         db.session.commit()
         
         return jsonify({
             'message': 'アバターを更新しました',
-            'avatar_url': avatar_url
+            'avatar_url': avatar_url,
+            'avatar_urls': avatar_urls
         }), 200
         
+    except AvatarTooLarge:
+        db.session.rollback()
+        return jsonify({'error': '画像が大きすぎます'}), 413
+    except InvalidAvatar:
+        db.session.rollback()
+        return jsonify({'error': '画像を読み込めませんでした'}), 400
+    except AvatarBusy as e:
+        db.session.rollback()
+        return overloaded_response(e)
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@profiles_bp.route('/avatars/<key>-<int:size>.jpg', methods=['GET'])
+def get_avatar_image(key, size):
+    """アップロードされたプロフィール画像（URLは内容から決まるので変わらない）"""
+    if size not in AVATAR_SIZES or not AVATAR_KEY_PATTERN.match(key):
+        return jsonify({'error': '無効な画像です'}), 400
+    
+    path = avatar_store.path(key, size)
+    try:
+        response = send_file(path, mimetype='image/jpeg', etag=f'{key}-{size}', conditional=True, max_age=None)
+    except FileNotFoundError:
+        return jsonify({'error': '画像が見つかりません'}), 404
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
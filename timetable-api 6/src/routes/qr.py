@@ -1,49 +1,89 @@
-from flask import Blueprint, request, jsonify, session, url_for
+from flask import Blueprint, request, jsonify, g, url_for, Response, current_app
 from src.models.user import User, db
+from src.services.identity import login_required
 from src.models.friend import Friend
-import qrcode
-import io
+from src.services.qr_cache import qr_cache, FORMATS
+from src.services.events import events
+from src.services.outbox import outbox
+from src.services.qr_tokens import issue_token, verify_token, is_current, InvalidQRToken, ExpiredQRToken
 import base64
+import re
 
 qr_bp = Blueprint('qr', __name__)
 
-def require_auth():
-    user_id = session.get('user_id')
-    if not user_id:
-        return None
-    return User.query.get(user_id)
+QR_DATA_PREFIX = 'timetable-share://add-friend/'
+
+# キャッシュキーはSHA-256の16進表記
+QR_KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# 内容アドレスのURLは内容が変わらないので1年キャッシュさせる
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+def friend_qr_data(user):
+    """QRコードに埋め込む友達追加データ（署名付きトークン）"""
+    return f"{QR_DATA_PREFIX}{issue_token(user)}"
+
+def legacy_codes_enabled():
+    # 旧形式（ユーザーIDそのもの）のQRコードは署名も失効もないので、既定では受け付けない
+    return bool(current_app.config.get('QR_ACCEPT_LEGACY_CODES', False))
+
+def resolve_qr_target(code):
+    """QRコードの値から (対象ユーザー, エラーレスポンス) を返す
+
+    署名付きトークンだけを受け付ける。QR_ACCEPT_LEGACY_CODES を有効にした
+    場合に限り、旧形式のユーザーIDもそのまま受け付ける。
+    """
+    if '.' not in code:
+        if not legacy_codes_enabled():
+            return None, (jsonify({'error': '無効なQRコードです'}), 400)
+        target_user = User.query.get(code)
+        if not target_user:
+            return None, (jsonify({'error': 'ユーザーが見つかりません'}), 404)
+        return target_user, None
+    
+    try:
+        claims = verify_token(code)
+    except ExpiredQRToken:
+        return None, (jsonify({'error': 'QRコードの有効期限が切れています'}), 400)
+    except InvalidQRToken:
+        return None, (jsonify({'error': '無効なQRコードです'}), 400)
+    
+    target_user = User.query.get(claims['user_id'])
+    if not target_user:
+        return None, (jsonify({'error': 'ユーザーが見つかりません'}), 404)
+    if not is_current(claims, target_user):
+        return None, (jsonify({'error': 'このQRコードは無効になっています'}), 400)
+    return target_user, None
+
+def qr_code_fields(qr_data, inline=True):
+    """QRコードのレスポンス項目（画像URLと、互換用のdata URL）を作る"""
+    key, image = qr_cache.get_or_create(qr_data, 'png')
+    fields = {'qr_image_url': url_for('qr.get_qr_image_by_key', key=key, fmt='png')}
+    if inline:
+        fields['qr_code'] = f"data:image/png;base64,{base64.b64encode(image).decode()}"
+    return fields
+
+def qr_image_response(key, fmt, image, cache_control):
+    response = Response(image, mimetype=FORMATS[fmt])
+    response.set_etag(key)
+    response.headers['Cache-Control'] = cache_control
+    return response.make_conditional(request)
+
+def wants_inline_qr():
+    # ?inline=0 で base64 を省き、画像URLだけを返す
+    return request.args.get('inline', '1') != '0'
 
 @qr_bp.route('/qr/generate', methods=['GET'])
+@login_required
 def generate_qr_code():
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+    user = g.current_user
     
     try:
-        # QRコードに含めるデータ（ユーザーIDとユーザー名）
-        qr_data = f"timetable-share://add-friend/{user.id}"
-        
-        # QRコードを生成
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(qr_data)
-        qr.make(fit=True)
-        
-        # QRコード画像を生成
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # 画像をBase64エンコード
-        img_buffer = io.BytesIO()
-        img.save(img_buffer, format='PNG')
-        img_buffer.seek(0)
-        img_base64 = base64.b64encode(img_buffer.getvalue()).decode()
+        # QRコードに含めるデータ（ユーザーIDとユーザー名の署名付きトークン）
+        qr_data = friend_qr_data(user)
         
         return jsonify({
-            'qr_code': f"data:image/png;base64,{img_base64}",
+            **qr_code_fields(qr_data, inline=wants_inline_qr()),
             'qr_data': qr_data,
             'user_info': {
                 'id': user.id,
@@ -55,21 +95,73 @@ def generate_qr_code():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@qr_bp.route('/qr/add-friend/<user_id>', methods=['POST'])
-def add_friend_by_qr(user_id):
-    current_user = require_auth()
-    if not current_user:
-        return jsonify({'error': '認証が必要です'}), 401
+@qr_bp.route('/qr/image.<fmt>', methods=['GET'])
+@login_required
+def get_my_qr_image(fmt):
+    user = g.current_user
+    
+    if fmt not in FORMATS:
+        return jsonify({'error': '無効な画像形式です'}), 400
+    
+    try:
+        qr_data = friend_qr_data(user)
+        key, image = qr_cache.get_or_create(qr_data, fmt)
+        
+        # URLはユーザーごとに同じなので、ETagで再検証させる
+        return qr_image_response(key, fmt, image, 'private, max-age=86400')
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@qr_bp.route('/qr/images/<key>.<fmt>', methods=['GET'])
+def get_qr_image_by_key(key, fmt):
+    if fmt not in FORMATS or not QR_KEY_PATTERN.match(key):
+        return jsonify({'error': '無効なQRコードです'}), 400
+    
+    image = qr_cache.get(key, fmt)
+    if image is None:
+        return jsonify({'error': 'QRコードが見つかりません'}), 404
+    
+    return qr_image_response(key, fmt, image, IMMUTABLE_CACHE_CONTROL)
+
+@qr_bp.route('/qr/rotate', methods=['POST'])
+@login_required
+def rotate_qr_code():
+    try:
+        # 世代を上げて、発行済みのQRコードをすべて無効にする
+        user = User.query.get(g.current_user.id)
+        user.qr_token_version = (user.qr_token_version or 0) + 1
+        events.publish('user.changed', user_id=user.id)
+        # PNG はレスポンスで返すので描画する。他の形式は後で描いておく
+        outbox.enqueue('qr.render', user_id=user.id)
+        db.session.commit()
+        
+        qr_data = friend_qr_data(user)
+        return jsonify({
+            'message': 'QRコードを更新しました',
+            **qr_code_fields(qr_data, inline=wants_inline_qr()),
+            'qr_data': qr_data
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@qr_bp.route('/qr/add-friend/<code>', methods=['POST'])
+@login_required
+def add_friend_by_qr(code):
+    current_user = g.current_user
     
     try:
+        # 対象ユーザーの存在確認（トークンの世代もここで確認する）
+        target_user, error = resolve_qr_target(code)
+        if error:
+            return error
+        user_id = target_user.id
+        
         if user_id == current_user.id:
             return jsonify({'error': '自分自身に友達申請はできません'}), 400
         
-        # 対象ユーザーの存在確認
-        target_user = User.query.get(user_id)
-        if not target_user:
-            return jsonify({'error': 'ユーザーが見つかりません'}), 404
-        
         # 既存の関係をチェック
         existing = Friend.query.filter(
             ((Friend.user_id == current_user.id) & (Friend.friend_user_id == user_id)) |
@@ -90,6 +182,7 @@ def add_friend_by_qr(user_id):
         )
         
         db.session.add(friend_request)
+        events.publish('friendship.changed', user_ids=[current_user.id, user_id])
         db.session.commit()
         
         return jsonify({
@@ -102,31 +195,53 @@ def add_friend_by_qr(user_id):
         return jsonify({'error': str(e)}), 500
 
 @qr_bp.route('/qr/parse', methods=['POST'])
+@login_required
 def parse_qr_data():
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
-    
     try:
         data = request.get_json()
         qr_data = data.get('qr_data', '')
         
         # QRコードデータの解析
-        if qr_data.startswith('timetable-share://add-friend/'):
-            user_id = qr_data.replace('timetable-share://add-friend/', '')
+        if not qr_data.startswith(QR_DATA_PREFIX):
+            return jsonify({'error': '無効なQRコードです'}), 400
+        
+        code = qr_data[len(QR_DATA_PREFIX):]
+        
+        # 署名付きトークンは署名だけで検証できるのでDBは参照しない
+        if '.' in code:
+            try:
+                claims = verify_token(code)
+            except ExpiredQRToken:
+                return jsonify({'error': 'QRコードの有効期限が切れています'}), 400
+            except InvalidQRToken:
+                return jsonify({'error': '無効なQRコードです'}), 400
             
-            # ユーザー情報を取得
-            target_user = User.query.get(user_id)
+            return jsonify({
+                'type': 'add_friend',
+                'user_id': claims['user_id'],
+                'token': code,
+                'user_info': {
+                    'id': claims['user_id'],
+                    'username': claims['username']
+                }
+            }), 200
+        else:
+            # 旧形式（ユーザーIDそのもの）。有効にした場合だけ、名前までを返す
+            if not legacy_codes_enabled():
+                return jsonify({'error': '無効なQRコードです'}), 400
+            target_user = User.query.get(code)
             if not target_user:
                 return jsonify({'error': 'ユーザーが見つかりません'}), 404
             
             return jsonify({
                 'type': 'add_friend',
-                'user_id': user_id,
-                'user_info': target_user.to_dict()
+                'user_id': target_user.id,
+                'token': code,
+                'user_info': {
+                    'id': target_user.id,
+                    'username': target_user.username
+                }
             }), 200
-        else:
-            return jsonify({'error': '無効なQRコードです'}), 400
             
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -0,0 +1,70 @@
+from flask import Blueprint, request, jsonify
+from src.services.identity import login_required
+from src.routes.timetable import TIME_SLOTS, DAY_MAP, DAY_REVERSE_MAP
+from src.services.busyness import busyness
+from datetime import datetime
+
+stats_bp = Blueprint('stats', __name__)
+
+def get_current_slot():
+    """現在の (曜日, 時限) を返す。授業時間外は時限が None"""
+    now = datetime.now()
+    current_day = now.weekday()
+    if current_day > 4:  # 土日は授業なし
+        return None, None
+    
+    current_time = now.time()
+    for period, slot in TIME_SLOTS.items():
+        if slot['start'] <= current_time <= slot['end']:
+            return current_day, period
+    return current_day, None
+
+@stats_bp.route('/stats/busyness', methods=['GET'])
+@login_required
+def get_busyness():
+    try:
+        heatmap = busyness.heatmap()
+        current_day, current_period = get_current_slot()
+        
+        return jsonify({
+            'days': [DAY_REVERSE_MAP[day] for day in range(len(heatmap))],
+            'periods': sorted(TIME_SLOTS.keys()),
+            'counts': heatmap,
+            'now': {
+                'day_of_week': DAY_REVERSE_MAP.get(current_day),
+                'period': current_period
+            }
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@stats_bp.route('/rooms/occupied', methods=['GET'])
+@login_required
+def get_occupied_rooms():
+    try:
+        day_of_week_str = request.args.get('day_of_week')
+        period = request.args.get('period', type=int)
+        
+        # 指定がなければ現在の時限
+        if day_of_week_str is None and period is None:
+            day_of_week, period = get_current_slot()
+        else:
+            day_of_week = DAY_MAP.get((day_of_week_str or '').lower())
+            if day_of_week is None:
+                return jsonify({'error': '無効な曜日です'}), 400
+            if period not in TIME_SLOTS:
+                return jsonify({'error': '無効な時限です'}), 400
+        
+        rooms = []
+        if day_of_week is not None and period is not None:
+            rooms = busyness.occupied_rooms(day_of_week, period)
+        
+        return jsonify({
+            'day_of_week': DAY_REVERSE_MAP.get(day_of_week),
+            'period': period,
+            'rooms': rooms
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,127 @@
+from flask import Blueprint, request, jsonify, g
+from sqlalchemy.orm import joinedload
+from src.models.user import User, db
+from src.services.identity import login_required
+from src.models.friend import Friend
+from src.models.timetable import Timetable
+from src.models.profile import Profile
+from src.models.tombstone import Tombstone
+from src.routes.timetable import DAY_REVERSE_MAP
+from datetime import datetime, timedelta
+import base64
+
+sync_bp = Blueprint('sync', __name__)
+
+SYNC_TOKEN_PREFIX = 'v1:'
+
+# 更新時刻はコミットより前に決まるので、前回の同期と少し重ねて取りこぼしを防ぐ
+# （重なった分は同じ行が再送されるだけなので、クライアントは id で上書きする）
+SYNC_OVERLAP = timedelta(seconds=5)
+
+def encode_sync_token(timestamp):
+    raw = SYNC_TOKEN_PREFIX + timestamp.isoformat()
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_sync_token(token):
+    """同期トークンから時刻を取り出す。不正なら ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('invalid sync token')
+    if not raw.startswith(SYNC_TOKEN_PREFIX):
+        raise ValueError('invalid sync token')
+    return datetime.fromisoformat(raw[len(SYNC_TOKEN_PREFIX):])
+
+def friendship_entry(friendship, other_user, user_id):
+    return {
+        'id': friendship.id,
+        'status': friendship.status,
+        'direction': 'sent' if friendship.user_id == user_id else 'received',
+        'user': {
+            'id': other_user.id,
+            'username': other_user.username
+        },
+        'updated_at': friendship.updated_at
+    }
+
+def timetable_entry(timetable):
+    data = timetable.to_dict()
+    data['day_of_week'] = DAY_REVERSE_MAP.get(timetable.day_of_week, timetable.day_of_week)
+    return data
+
+@sync_bp.route('/sync', methods=['GET'])
+@login_required
+def get_sync():
+    """?since=<トークン> 以降に変わった時間割・友達関係・プロフィールと、削除された行を返す
+
+    since を省略すると全件を返す。レスポンスの next を次回の since に使う。
+    """
+    user = g.current_user
+
+    since = None
+    since_token = request.args.get('since')
+    if since_token:
+        try:
+            since = decode_sync_token(since_token) - SYNC_OVERLAP
+        except ValueError:
+            return jsonify({'error': '無効な同期トークンです'}), 400
+
+    try:
+        synced_at = datetime.utcnow()
+        involves_user = (Friend.user_id == user.id) | (Friend.friend_user_id == user.id)
+
+        # 現在の友達（時間割・プロフィールを見せる範囲）
+        friend_ids = set()
+        for requester_id, receiver_id in db.session.query(Friend.user_id, Friend.friend_user_id).filter(
+            involves_user, Friend.status == 'accepted'
+        ):
+            friend_ids.add(receiver_id if requester_id == user.id else requester_id)
+        visible_ids = friend_ids | {user.id}
+
+        # 変更された友達関係（相手のユーザー名とあわせて取得）
+        friendships_query = db.session.query(Friend, User).join(
+            User,
+            (Friend.friend_user_id == User.id) | (Friend.user_id == User.id)
+        ).filter(involves_user, User.id != user.id)
+        if since is not None:
+            friendships_query = friendships_query.filter(Friend.updated_at > since)
+        friendships = friendships_query.all()
+
+        # 新しく友達になった相手は、時間割とプロフィールを全件送る
+        new_friend_ids = {
+            other.id for friendship, other in friendships
+            if friendship.status == 'accepted' and other.id in friend_ids
+        } if since is not None else set()
+
+        def changed(model):
+            condition = model.user_id.in_(visible_ids)
+            if since is None:
+                return condition
+            changed_rows = condition & (model.updated_at > since)
+            if new_friend_ids:
+                return changed_rows | model.user_id.in_(new_friend_ids)
+            return changed_rows
+
+        timetables = Timetable.query.filter(changed(Timetable)).all()
+        profiles = Profile.query.options(joinedload(Profile.user)).filter(changed(Profile)).all()
+
+        deleted = []
+        if since is not None:
+            deleted = Tombstone.query.filter(
+                Tombstone.deleted_at > since,
+                ((Tombstone.entity == 'timetable') & Tombstone.user_id.in_(visible_ids)) |
+                ((Tombstone.entity == 'friend') &
+                 ((Tombstone.user_id == user.id) | (Tombstone.other_user_id == user.id)))
+            ).all()
+
+        return jsonify({
+            'full': since is None,
+            'timetables': [timetable_entry(t) for t in timetables],
+            'friendships': [friendship_entry(f, other, user.id) for f, other in friendships],
+            'profiles': [p.to_dict(is_owner=p.user_id == user.id) for p in profiles],
+            'deleted': [t.to_dict() for t in deleted],
+            'next': encode_sync_token(synced_at)
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -1,6 +1,12 @@
-from flask import Blueprint, request, jsonify, session
-from src.models.user import User, db
+from flask import Blueprint, request, jsonify, g
+from src.models.db import db
+from src.services.identity import login_required
 from src.models.timetable import Timetable
+from src.models.tombstone import Tombstone
+from src.services.busyness import cell_key
+from src.services.events import events
+from src.services.outbox import outbox
+from src.services.response_cache import response_cache
 from datetime import time
 
 timetable_bp = Blueprint('timetable', __name__)
@@ -31,19 +37,9 @@ DAY_REVERSE_MAP = {
     4: 'friday'
 }
 
-def require_auth():
-    user_id = session.get('user_id')
-    if not user_id:
-        return None
-    return User.query.get(user_id)
-
-@timetable_bp.route('/timetable', methods=['GET'])
-def get_timetable():
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
-    
-    timetables = Timetable.query.filter_by(user_id=user.id).all()
+def timetable_list(user_id):
+    """ユーザーの時間割（曜日は文字列）"""
+    timetables = Timetable.query.filter_by(user_id=user_id).all()
     
     # 曜日を文字列に変換してレスポンス
     timetable_data = []
@@ -51,14 +47,19 @@ def get_timetable():
         data = t.to_dict()
         data['day_of_week'] = DAY_REVERSE_MAP.get(t.day_of_week, t.day_of_week)
         timetable_data.append(data)
+    return timetable_data
+
+@timetable_bp.route('/timetable', methods=['GET'])
+@login_required
+def get_timetable():
+    user = g.current_user
     
-    return jsonify({'timetables': timetable_data}), 200
+    return jsonify({'timetables': timetable_list(user.id)}), 200
 
 @timetable_bp.route('/timetable', methods=['POST'])
+@login_required
 def create_timetable():
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+    user = g.current_user
     
     try:
         data = request.get_json()
@@ -87,13 +88,19 @@ def create_timetable():
         
         if existing:
             # 更新（空の場合は削除）
+            before = cell_key(existing)
             if not subject_name and not room:
                 db.session.delete(existing)
+                Tombstone.record('timetable', existing.id, user.id)
+                events.publish('timetable.changed', user_id=user.id, before=before, after=None)
+                outbox.enqueue('timetable.changed', user_id=user.id)
                 db.session.commit()
                 return jsonify({'message': '時間割を削除しました'}), 200
             else:
                 existing.subject_name = subject_name
                 existing.room = room
+                events.publish('timetable.changed', user_id=user.id, before=before, after=cell_key(existing))
+                outbox.enqueue('timetable.changed', user_id=user.id)
                 db.session.commit()
                 
                 # レスポンス用に曜日を文字列に変換
@@ -117,6 +124,8 @@ def create_timetable():
             )
             
             db.session.add(timetable)
+            events.publish('timetable.changed', user_id=user.id, before=None, after=cell_key(timetable))
+            outbox.enqueue('timetable.changed', user_id=user.id)
             db.session.commit()
             
             # レスポンス用に曜日を文字列に変換
@@ -129,10 +138,9 @@ def create_timetable():
         return jsonify({'error': str(e)}), 500
 
 @timetable_bp.route('/timetable/<timetable_id>', methods=['DELETE'])
+@login_required
 def delete_timetable(timetable_id):
-    user = require_auth()
-    if not user:
-        return jsonify({'error': '認証が必要です'}), 401
+    user = g.current_user
     
     try:
         timetable = Timetable.query.filter_by(id=timetable_id, user_id=user.id).first()
@@ -140,7 +148,11 @@ def delete_timetable(timetable_id):
         if not timetable:
             return jsonify({'error': '時間割が見つかりません'}), 404
         
+        before = cell_key(timetable)
         db.session.delete(timetable)
+        Tombstone.record('timetable', timetable.id, user.id)
+        events.publish('timetable.changed', user_id=user.id, before=before, after=None)
+        outbox.enqueue('timetable.changed', user_id=user.id)
         db.session.commit()
         
         return jsonify({'message': '時間割を削除しました'}), 200
@@ -150,11 +162,9 @@ def delete_timetable(timetable_id):
         return jsonify({'error': str(e)}), 500
 
 @timetable_bp.route('/timetable/user/<user_id>', methods=['GET'])
+@login_required
+@response_cache.cached(lambda user_id: [('timetable', user_id)])
 def get_user_timetable(user_id):
-    current_user = require_auth()
-    if not current_user:
-        return jsonify({'error': '認証が必要です'}), 401
-    
     # 友達関係をチェック（簡略化のため、ここでは省略）
     timetables = Timetable.query.filter_by(user_id=user_id).all()
     return jsonify({'timetables': [t.to_dict() for t in timetables]}), 200
@@ -1,39 +1,143 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, url_for
 from src.models.user import User, db
+from src.models.friend import Friend
+from src.models.message import Conversation, Message
+from src.models.profile import Profile
+from src.models.suggestion import FriendSuggestion, MutualFriendCount
+from src.models.timetable import Timetable
+from src.models.tombstone import Tombstone
+from src.services.busyness import cell_key
+from src.services.events import events
+from src.services.outbox import outbox
 
 user_bp = Blueprint('user', __name__)
 
+USERS_PAGE_DEFAULT = 100
+USERS_PAGE_MAX = 1000
+
+def username_viewers(user_id):
+    """ユーザー名がキャッシュされた一覧に載る相手（友達・申請の相手と会話の相手）"""
+    friend_rows = db.session.execute(
+        db.select(Friend.user_id, Friend.friend_user_id).where(
+            (Friend.user_id == user_id) | (Friend.friend_user_id == user_id)
+        )
+    ).all()
+    conversation_rows = db.session.execute(
+        db.select(Conversation.user1_id, Conversation.user2_id).where(
+            (Conversation.user1_id == user_id) | (Conversation.user2_id == user_id)
+        )
+    ).all()
+    friend_ids = {user_id} | {uid for row in friend_rows for uid in row}
+    partner_ids = {user_id} | {uid for row in conversation_rows for uid in row}
+    return sorted(friend_ids), sorted(partner_ids)
+
 @user_bp.route('/users', methods=['GET'])
 def get_users():
-    users = User.query.all()
-    return jsonify([user.to_dict() for user in users])
+    """ユーザーを id 順に返す
+
+    ?limit= か ?after= を付けたときだけページに分け、続きは Link ヘッダーの next に入れる
+    （付けなければ従来どおり全件。大きな表は /admin/export/users）。
+    """
+    limit = request.args.get('limit', type=int)
+    after = request.args.get('after')
+    query = User.query.order_by(User.id)
+    if limit is None and not after:
+        return jsonify([user.to_dict() for user in query.all()])
+
+    limit = max(1, min(limit or USERS_PAGE_DEFAULT, USERS_PAGE_MAX))
+    if after:
+        query = query.filter(User.id > after)
+    users = query.limit(limit).all()
+    
+    response = jsonify([user.to_dict() for user in users])
+    if len(users) == limit:
+        response.headers['Link'] = f'<{url_for("user.get_users", after=users[-1].id, limit=limit)}>; rel="next"'
+    return response
 
 @user_bp.route('/users', methods=['POST'])
 def create_user():
     
-    data = request.json
+    data = request.get_json(silent=True) or {}
+    if not data.get('username') or not data.get('email') or not data.get('password'):
+        return jsonify({'error': 'ユーザー名、メールアドレス、パスワードが必要です'}), 400
     user = User(username=data['username'], email=data['email'])
+    user.set_password(data['password'])
     db.session.add(user)
     db.session.commit()
     return jsonify(user.to_dict()), 201
 
-@user_bp.route('/users/<int:user_id>', methods=['GET'])
+@user_bp.route('/users/<user_id>', methods=['GET'])
 def get_user(user_id):
     user = User.query.get_or_404(user_id)
     return jsonify(user.to_dict())
 
-@user_bp.route('/users/<int:user_id>', methods=['PUT'])
+@user_bp.route('/users/<user_id>', methods=['PUT'])
 def update_user(user_id):
     user = User.query.get_or_404(user_id)
     data = request.json
-    user.username = data.get('username', user.username)
+    new_username = data.get('username', user.username)
+    if new_username != user.username:
+        # 申請一覧と会話一覧には相手のユーザー名が入るので、相手側のキャッシュも無効にする
+        friend_ids, partner_ids = username_viewers(user.id)
+        events.publish('friendship.changed', user_ids=friend_ids)
+        events.publish('conversation.changed', user_ids=partner_ids)
+    user.username = new_username
     user.email = data.get('email', user.email)
+    events.publish('user.changed', user_id=user.id)
+    # ユーザー名はQRコードのトークンに入るので、新しい画像を描いておく
+    outbox.enqueue('qr.render', user_id=user.id)
     db.session.commit()
     return jsonify(user.to_dict())
 
-@user_bp.route('/users/<int:user_id>', methods=['DELETE'])
+@user_bp.route('/users/<user_id>', methods=['DELETE'])
 def delete_user(user_id):
     user = User.query.get_or_404(user_id)
-    db.session.delete(user)
-    db.session.commit()
-    return '', 204
+    user_id = user.id
+    friend_ids, partner_ids = username_viewers(user_id)
+    try:
+        # ユーザーを参照している行を先にまとめて消す（相手側の一覧からも消えるので相手のキャッシュも無効にする）
+        friendships = db.session.execute(
+            db.select(Friend.id, Friend.user_id, Friend.friend_user_id).where(
+                (Friend.user_id == user_id) | (Friend.friend_user_id == user_id)
+            )
+        ).all()
+        timetables = db.session.execute(
+            db.select(Timetable.id, Timetable.day_of_week, Timetable.period, Timetable.room)
+            .where(Timetable.user_id == user_id)
+        ).all()
+        tombstones = [
+            {'entity': 'friend', 'entity_id': row.id, 'user_id': row.user_id, 'other_user_id': row.friend_user_id}
+            for row in friendships
+        ] + [
+            {'entity': 'timetable', 'entity_id': row.id, 'user_id': user_id, 'other_user_id': None}
+            for row in timetables
+        ]
+        if tombstones:
+            db.session.execute(db.insert(Tombstone), tombstones)
+
+        db.session.execute(db.delete(Friend).where((Friend.user_id == user_id) | (Friend.friend_user_id == user_id)))
+        db.session.execute(db.delete(Timetable).where(Timetable.user_id == user_id))
+        db.session.execute(db.delete(Conversation).where(
+            (Conversation.user1_id == user_id) | (Conversation.user2_id == user_id)
+        ))
+        db.session.execute(db.delete(Message).where((Message.sender_id == user_id) | (Message.receiver_id == user_id)))
+        db.session.execute(db.delete(Profile).where(Profile.user_id == user_id))
+        db.session.execute(db.delete(FriendSuggestion).where(
+            (FriendSuggestion.user_id == user_id) | (FriendSuggestion.candidate_id == user_id)
+        ))
+        db.session.execute(db.delete(MutualFriendCount).where(
+            (MutualFriendCount.user_id == user_id) | (MutualFriendCount.candidate_id == user_id)
+        ))
+        # ORM の削除だと関連（送った申請・メッセージなど）を読み込むので、行を直接消す
+        db.session.execute(db.delete(User).where(User.id == user_id))
+
+        for row in timetables:
+            events.publish('timetable.changed', user_id=user_id, before=cell_key(row), after=None)
+        events.publish('friendship.changed', user_ids=friend_ids)
+        events.publish('conversation.changed', user_ids=partner_ids)
+        events.publish('user.changed', user_id=user_id)
+        db.session.commit()
+        return '', 204
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
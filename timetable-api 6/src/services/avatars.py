@@ -0,0 +1,176 @@
+"""プロフィール画像の保存とサムネイル生成
+
+アップロードはメモリに溜めずに一時ファイルへ少しずつ書き、同時に SHA-256 を
+計算する。画像の内容のハッシュをキーにして、正方形に切り抜いた
+AVATAR_SIZES の各サイズの JPEG を ``<ディレクトリ>/<ハッシュ先頭2文字>/<ハッシュ>-<サイズ>.jpg``
+に保存する（同じ画像は一度しか処理しない）。ファイル名は内容から決まるので、
+配信は immutable でキャッシュさせる。
+
+Pillow のデコードと縮小はCPUを使うので、リクエストのスレッドでは行わず
+サイズ固定のスレッドプールに投げる（Pillow は処理中に GIL を手放す）。
+同時に受け付ける件数には上限を設け、超えた分は AvatarBusy で即座に断る
+（呼び出し側で503）。AVATAR_WORKERS=0 の場合はプールを使わずその場で処理する。
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.services.worker_pool import BoundedPool
+
+AVATAR_SIZES = (64, 128, 256)
+DEFAULT_AVATAR_SIZE = 128
+ALLOWED_FORMATS = frozenset(('JPEG', 'PNG', 'GIF', 'WEBP'))
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_MAX_PIXELS = 40_000_000   # 展開すると巨大になる画像（圧縮爆弾）を断る
+DEFAULT_TIMEOUT = 30              # 秒
+DEFAULT_RETRY_AFTER = 2           # 秒
+JPEG_QUALITY = 85
+CHUNK_SIZE = 64 * 1024
+
+
+class InvalidAvatar(ValueError):
+    """画像として読めない・大きすぎる（400/413で返す）"""
+
+
+class AvatarTooLarge(InvalidAvatar):
+    pass
+
+
+class AvatarBusy(Exception):
+    """サムネイル生成の待ち行列が上限に達している"""
+
+    def __init__(self, retry_after=DEFAULT_RETRY_AFTER):
+        super().__init__('avatar processing queue is full')
+        self.retry_after = retry_after
+
+
+def nearest_size(size):
+    """要求されたサイズ以上で一番小さい（なければ一番大きい）サムネイルのサイズ"""
+    for candidate in AVATAR_SIZES:
+        if candidate >= size:
+            return candidate
+    return AVATAR_SIZES[-1]
+
+
+def render_variants(source_path, directory, key, max_pixels=DEFAULT_MAX_PIXELS):
+    """元画像を正方形に切り抜き、各サイズの JPEG を書き出す（プールで実行する）"""
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        with Image.open(source_path) as image:
+            if image.format not in ALLOWED_FORMATS:
+                raise InvalidAvatar(f'unsupported image format: {image.format}')
+            if image.width * image.height > max_pixels:
+                raise AvatarTooLarge('image has too many pixels')
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ('RGBA', 'LA', 'P'):
+                # 透過部分は白で塗る（JPEG は透過を持てない）
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            else:
+                image = image.convert('RGB')
+
+            largest = ImageOps.fit(image, (AVATAR_SIZES[-1],) * 2, Image.Resampling.LANCZOS)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+        raise InvalidAvatar(f'cannot read image: {e}')
+
+    os.makedirs(os.path.join(directory, key[:2]), exist_ok=True)
+    for size in AVATAR_SIZES:
+        variant = largest if size == AVATAR_SIZES[-1] else largest.resize((size, size), Image.Resampling.LANCZOS)
+        path = variant_path(directory, key, size)
+        # 書きかけのファイルを配信しないよう一時ファイル経由で置き換える
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        variant.save(tmp_path, format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        os.replace(tmp_path, path)
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def avatar_image_url(key, size=DEFAULT_AVATAR_SIZE):
+    """保存した画像の指定サイズ（に近いもの）のURL"""
+    from flask import url_for
+    return url_for('profiles.get_avatar_image', key=key, size=nearest_size(size))
+
+
+def variant_path(directory, key, size):
+    return os.path.join(directory, key[:2], f'{key}-{size}.jpg')
+
+
+class AvatarStore:
+    def __init__(self):
+        self.directory = None
+        self.max_bytes = DEFAULT_MAX_BYTES
+        self.max_pixels = DEFAULT_MAX_PIXELS
+        self.pool = BoundedPool(
+            lambda workers: ThreadPoolExecutor(max_workers=workers, thread_name_prefix='avatar'), AvatarBusy,
+            workers=min(os.cpu_count() or 1, 4), timeout=DEFAULT_TIMEOUT, retry_after=DEFAULT_RETRY_AFTER,
+        )
+
+    def init_app(self, app):
+        self.directory = app.config.get('AVATAR_DIR', os.path.join(app.instance_path, 'avatars'))
+        self.max_bytes = app.config.get('AVATAR_MAX_BYTES', self.max_bytes)
+        self.max_pixels = app.config.get('AVATAR_MAX_PIXELS', self.max_pixels)
+        self.pool.configure(
+            app.config.get('AVATAR_WORKERS', self.pool.workers),
+            app.config.get('AVATAR_QUEUE_LIMIT'),
+            app.config.get('AVATAR_TIMEOUT', self.pool.timeout),
+            app.config.get('AVATAR_RETRY_AFTER', self.pool.retry_after),
+        )
+        os.makedirs(os.path.join(self.directory, 'tmp'), exist_ok=True)
+
+    def save(self, stream):
+        """アップロードされた画像を保存し、内容のハッシュ（キー）を返す
+
+        stream は read(n) できるもの。max_bytes を超えたら AvatarTooLarge、
+        画像として読めなければ InvalidAvatar。
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.directory, 'tmp'), suffix='.upload')
+        handed_off = False
+        try:
+            digest = hashlib.sha256()
+            size = 0
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise AvatarTooLarge(f'image is larger than {self.max_bytes} bytes')
+                    digest.update(chunk)
+                    f.write(chunk)
+            if not size:
+                raise InvalidAvatar('empty upload')
+
+            key = digest.hexdigest()
+            if not self.exists(key):
+                # 待ちきれずに返っても処理は続くので、一時ファイルは処理が終わってからプールが消す
+                handed_off = True
+                self.pool.run(render_variants, tmp_path, self.directory, key, self.max_pixels,
+                              cleanup=lambda: remove_quietly(tmp_path))
+            return key
+        finally:
+            if not handed_off:
+                remove_quietly(tmp_path)
+
+    def exists(self, key):
+        return all(os.path.exists(self.path(key, size)) for size in AVATAR_SIZES)
+
+    def path(self, key, size):
+        return variant_path(self.directory, key, size)
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+avatar_store = AvatarStore()
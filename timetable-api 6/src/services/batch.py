@@ -0,0 +1,191 @@
+"""/api/batch のサブリクエストの実行
+
+サブリクエストは HTTP を経由せず、WSGI の environ を組み立ててこのプロセスの
+アプリに直接渡す（Flask のテストクライアントと同じ仕組み）。親リクエストの
+Cookie（セッション）とリクエスト単位のキャッシュを引き継ぐ。
+
+- 連続する読み取り専用（GET/HEAD）のサブリクエストはスレッドプールで同時に
+  実行する。書き込みはその前の読み取りがすべて終わってから1件ずつ実行する
+- サブリクエストが Set-Cookie を返した場合（ログインなど）は、以降の
+  サブリクエストと親のレスポンスにも反映する
+- BATCH_MAX_REQUESTS で1回のバッチの件数、BATCH_WORKERS で同時実行数を制限する
+  （0 なら同時実行しない）
+"""
+import base64
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Response
+
+from src.services.request_cache import ENVIRON_KEY as REQUEST_CACHE_KEY
+
+DEFAULT_MAX_REQUESTS = 20
+DEFAULT_WORKERS = 4
+
+READ_ONLY_METHODS = frozenset(('GET', 'HEAD'))
+ALLOWED_METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE'))
+
+# サブリクエストであることを示す environ のキー（バッチの入れ子を防ぐ）
+BATCH_ENVIRON_KEY = 'bluelink.batch'
+
+# サブレスポンスから引き継ぐヘッダー
+FORWARDED_RESPONSE_HEADERS = ('Content-Type', 'ETag', 'Cache-Control', 'Retry-After', 'Location')
+
+
+class InvalidBatch(ValueError):
+    """バッチの内容が不正（400で返す）"""
+
+
+class BatchDispatcher:
+    def __init__(self, max_requests=DEFAULT_MAX_REQUESTS, workers=DEFAULT_WORKERS):
+        self.max_requests = max_requests
+        self.workers = workers
+        self.path_prefix = '/api/'
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_requests = app.config.get('BATCH_MAX_REQUESTS', self.max_requests)
+        self.workers = app.config.get('BATCH_WORKERS', self.workers)
+
+    def validate(self, items, batch_path):
+        """サブリクエストの一覧を検査し、正規化したものを返す"""
+        if not isinstance(items, list) or not items:
+            raise InvalidBatch('requests は1件以上の配列で指定してください')
+        if len(items) > self.max_requests:
+            raise InvalidBatch(f'1回のバッチは{self.max_requests}件までです')
+
+        normalized = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                raise InvalidBatch(f'{index}番目のリクエストが不正です')
+            path = item.get('path')
+            method = str(item.get('method', 'GET')).upper()
+            headers = item.get('headers') or {}
+            if not isinstance(path, str) or not path.startswith(self.path_prefix):
+                raise InvalidBatch(f'{index}番目のパスは {self.path_prefix} で始まる必要があります')
+            if path.split('?', 1)[0].rstrip('/') == batch_path.rstrip('/'):
+                raise InvalidBatch('バッチを入れ子にすることはできません')
+            if method not in ALLOWED_METHODS:
+                raise InvalidBatch(f'{index}番目のメソッドが不正です')
+            if not isinstance(headers, dict):
+                raise InvalidBatch(f'{index}番目のヘッダーが不正です')
+            normalized.append({
+                'id': item.get('id', index),
+                'method': method,
+                'path': path,
+                'body': item.get('body'),
+                'headers': {
+                    str(k): str(v) for k, v in headers.items()
+                    if str(k).lower() not in ('cookie', 'host', 'content-length')
+                },
+            })
+        return normalized
+
+    def dispatch(self, app, items, cookies, environ_base, cache, parallel=True):
+        """サブリクエストを実行し、(結果の一覧, 親に返す Set-Cookie の一覧) を返す"""
+        cookies = dict(cookies)
+        set_cookies = []
+        results = [None] * len(items)
+
+        def run(index):
+            response = self._run_one(app, items[index], cookies, environ_base, cache)
+            results[index] = response
+            return response
+
+        def absorb(response):
+            for header in response.headers.getlist('Set-Cookie'):
+                set_cookies.append(header)
+                _apply_set_cookie(cookies, header)
+
+        group = []
+        for index, item in enumerate(items + [None]):
+            if item is not None and item['method'] in READ_ONLY_METHODS and parallel:
+                group.append(index)
+                continue
+
+            # 読み取りのまとまりを同時に実行してから、書き込みを1件実行する
+            if group:
+                if len(group) > 1 and self.workers:
+                    responses = list(self._get_pool().map(run, group))
+                else:
+                    responses = [run(i) for i in group]
+                for response in responses:
+                    absorb(response)
+                group = []
+            if item is not None:
+                absorb(run(index))
+
+        return [_result(item, response) for item, response in zip(items, results)], set_cookies
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=False)
+            self._pool = None
+            self._pool_pid = None
+
+    def _run_one(self, app, item, cookies, environ_base, cache):
+        headers = dict(item['headers'])
+        if cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in cookies.items())
+
+        builder = EnvironBuilder(
+            path=item['path'],
+            method=item['method'],
+            headers=headers,
+            json=item['body'] if item['body'] is not None else None,
+            environ_base=environ_base,
+        )
+        try:
+            environ = builder.get_environ()
+        finally:
+            builder.close()
+        environ[REQUEST_CACHE_KEY] = cache
+        environ[BATCH_ENVIRON_KEY] = True
+        return Response.from_app(app, environ, buffered=True)
+
+    def _get_pool(self):
+        # fork 後の子プロセスでは作り直す（スレッドは fork で引き継がれない）
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='batch')
+                self._pool_pid = os.getpid()
+            return self._pool
+
+
+def _apply_set_cookie(cookies, header):
+    parsed = SimpleCookie()
+    parsed.load(header)
+    for name, morsel in parsed.items():
+        if morsel['max-age'] == '0' or morsel['expires'].startswith('Thu, 01 Jan 1970'):
+            cookies.pop(name, None)
+        else:
+            cookies[name] = morsel.value
+
+
+def _result(item, response):
+    result = {
+        'id': item['id'],
+        'status': response.status_code,
+        'headers': {
+            name: response.headers[name] for name in FORWARDED_RESPONSE_HEADERS if name in response.headers
+        },
+    }
+    data = response.get_data()
+    if response.is_json:
+        result['body'] = response.get_json(silent=True)
+    elif response.mimetype.startswith('text/'):
+        result['body'] = data.decode(response.charset or 'utf-8', 'replace')
+    elif data:
+        result['body_base64'] = base64.b64encode(data).decode()
+    else:
+        result['body'] = None
+    return result
+
+
+batch_dispatcher = BatchDispatcher()
@@ -0,0 +1,111 @@
+"""キャンパス全体の混雑度・教室使用状況の集計
+
+リクエストごとに Timetable を全件走査しないよう、曜日×時限ごとの
+カウンタをプロセス内に保持し、時間割の書き込み時に差分で更新する。
+初回の読み取り時に一度だけ DB から再構築する。
+"""
+import threading
+from collections import Counter
+from datetime import datetime
+
+from src.models.user import db
+from src.models.timetable import Timetable
+
+DAYS = 5     # 0=月 ... 4=金
+PERIODS = 5  # 1限 ... 5限
+
+
+def cell_key(timetable):
+    """集計に使うキー (曜日, 時限, 教室) を返す"""
+    if timetable is None:
+        return None
+    return (timetable.day_of_week, timetable.period, (timetable.room or '').strip())
+
+
+class BusynessAggregate:
+    """曜日×時限の在席人数と教室ごとの使用数を保持するカウンタ"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._heatmap = [[0] * PERIODS for _ in range(DAYS)]
+        self._rooms = {}  # (day, period) -> Counter({room: 件数})
+        self.rebuilt_at = None
+
+    def rebuild(self):
+        """Timetable から集計を作り直す（起動直後・不整合時のみ）"""
+        rows = db.session.query(
+            Timetable.day_of_week, Timetable.period, Timetable.room
+        ).all()
+
+        heatmap = [[0] * PERIODS for _ in range(DAYS)]
+        rooms = {}
+        for day, period, room in rows:
+            self._add(heatmap, rooms, (day, period, (room or '').strip()), 1)
+
+        with self._lock:
+            self._heatmap = heatmap
+            self._rooms = rooms
+            self._loaded = True
+            self.rebuilt_at = datetime.utcnow()
+
+    def record_change(self, before, after):
+        """コミット済みの変更を反映する
+
+        before / after は cell_key() の戻り値（作成時は before=None、
+        削除時は after=None）。
+        """
+        if before == after:
+            return
+        with self._lock:
+            # 未構築なら次回の rebuild() で反映されるので何もしない
+            if not self._loaded:
+                return
+            if before is not None:
+                self._add(self._heatmap, self._rooms, before, -1)
+            if after is not None:
+                self._add(self._heatmap, self._rooms, after, 1)
+
+    def heatmap(self):
+        self._ensure_loaded()
+        with self._lock:
+            return [list(row) for row in self._heatmap]
+
+    def occupied_rooms(self, day, period):
+        self._ensure_loaded()
+        with self._lock:
+            counter = self._rooms.get((day, period))
+            if not counter:
+                return []
+            return [
+                {'room': room, 'count': count}
+                for room, count in sorted(counter.items())
+            ]
+
+    def reset(self):
+        """集計を破棄し、次の読み取りで DB から作り直させる"""
+        with self._lock:
+            self._loaded = False
+            self._heatmap = [[0] * PERIODS for _ in range(DAYS)]
+            self._rooms = {}
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.rebuild()
+
+    @staticmethod
+    def _add(heatmap, rooms, key, delta):
+        day, period, room = key
+        if not (0 <= day < DAYS and 1 <= period <= PERIODS):
+            return
+        heatmap[day][period - 1] += delta
+
+        if not room:
+            return
+        counter = rooms.setdefault((day, period), Counter())
+        counter[room] += delta
+        if counter[room] <= 0:
+            del counter[room]
+
+
+busyness = BusynessAggregate()
@@ -0,0 +1,337 @@
+"""ワーカー間のイベントバス
+
+書き込みのルートはコミットの前に ``events.publish(topic, **payload)`` を呼ぶ。
+イベントはトランザクションがコミットされたときだけ配られ（ロールバックなら
+捨てる）、このワーカーの購読者にはコミット直後に同じスレッドで、他の
+ワーカーにはバックエンド経由で届く。購読者は ``@events.subscribe(topic)``
+で登録する（``'*'`` ならすべてのイベント）。
+
+バックエンド（設定か環境変数の EVENT_BUS_BACKEND）:
+
+- ``'database'``（既定）: change_events テーブルにドメインの変更と同じ
+  トランザクションで書き、各ワーカーのスレッドが id のカーソルで
+  EVENT_BUS_POLL_INTERVAL 秒ごとに読む（0 なら読まない）。外部のサービスは
+  不要。PostgreSQL などでは id が採番順にコミットされるとは限らないので、
+  カーソルより前で抜けていた id を EVENT_BUS_LOOKBACK 秒のあいだ読み直す
+- ``'redis://...'``: Redis の pub/sub で配る（redis パッケージが必要）
+- ``'local'``: このワーカーの購読者にだけ配る（1ワーカーの場合）
+
+他のワーカーのイベントは受信用のスレッドで処理されるので、購読者は
+スレッドセーフに書き、リクエストのコンテキストに依存しないこと。
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import event as sa_event, select as db_select
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 1.0       # 秒
+DEFAULT_RETENTION = 3600          # 秒（change_events を残す期間）
+DEFAULT_LOOKBACK = 60             # 秒（抜けていた id を読み直す期間）
+MAX_GAPS = 10000                  # 覚えておく抜けた id の上限
+POLL_BATCH_SIZE = 500
+PENDING_KEY = 'bluelink.pending_events'
+
+
+class Event:
+    __slots__ = ('topic', 'payload', 'origin', 'remote')
+
+    def __init__(self, topic, payload, origin, remote=False):
+        self.topic = topic
+        self.payload = payload
+        self.origin = origin
+        self.remote = remote
+
+    def __repr__(self):
+        return f'<Event {self.topic} {self.payload}>'
+
+    def to_json(self):
+        return json.dumps({'topic': self.topic, 'payload': self.payload, 'origin': self.origin})
+
+    @classmethod
+    def from_json(cls, raw):
+        data = json.loads(raw)
+        return cls(data['topic'], data['payload'], data['origin'], remote=True)
+
+
+class LocalBackend:
+    """このワーカーの中だけで配る"""
+
+    def stage(self, session, events):
+        pass
+
+    def publish(self, events):
+        pass
+
+    def start(self, bus, app):
+        pass
+
+    def stop(self):
+        pass
+
+
+def _table():
+    from src.models.change_event import ChangeEvent
+    return ChangeEvent.__table__
+
+
+class DatabaseBackend:
+    """change_events テーブルをカーソルで読むバックエンド
+
+    id は採番した順にコミットされるとは限らない（小さい id のトランザクションが
+    後からコミットされる）。カーソルを進めるときに飛ばした id を覚えておき、
+    lookback 秒のあいだ毎回読み直して、後からコミットされたものも一度だけ配る。
+    ロールバックされた id は期限が来たら忘れる。
+    """
+
+    def __init__(self, poll_interval=DEFAULT_POLL_INTERVAL, retention=DEFAULT_RETENTION,
+                 lookback=DEFAULT_LOOKBACK):
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.lookback = lookback
+        self._stop = threading.Event()
+        self._thread = None
+
+    def stage(self, session, events):
+        # ドメインの変更と同じトランザクションで、コミットの直前にまとめて1回で書く
+        session.execute(_table().insert(), [
+            {'topic': event.topic, 'payload': json.dumps(event.payload), 'origin': event.origin,
+             'created_at': datetime.utcnow()}
+            for event in events
+        ])
+
+    def publish(self, events):
+        pass
+
+    def start(self, bus, app):
+        if not self.poll_interval:
+            return
+        with app.app_context():
+            from src.models.db import db
+            engine = db.engine
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(bus, engine), name='event-bus-poller', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, bus, engine):
+        cursor = None
+        gaps = {}  # 抜けていた id -> 読み直しをやめる時刻
+        next_prune = 0.0
+        while not self._stop.is_set():
+            count = 0
+            try:
+                with engine.connect() as connection:
+                    if cursor is None:
+                        cursor = self._latest_id(connection)  # 起動より前のイベントは配らない
+                    cursor, count = self._poll(connection, bus, cursor, gaps)
+                    if time.monotonic() >= next_prune:
+                        self._prune(connection)
+                        next_prune = time.monotonic() + 60
+            except Exception:
+                logger.exception('event bus poll failed')
+            # 取りきれなかったときは待たずに続きを読む
+            if count < POLL_BATCH_SIZE:
+                self._stop.wait(self.poll_interval)
+
+    def _latest_id(self, connection):
+        table = _table()
+        return connection.execute(db_select(table.c.id).order_by(table.c.id.desc()).limit(1)).scalar() or 0
+
+    def _poll(self, connection, bus, cursor, gaps):
+        table = _table()
+        condition = table.c.id > cursor
+        if gaps:
+            condition = condition | table.c.id.in_(list(gaps))
+        rows = connection.execute(
+            table.select().where(condition).order_by(table.c.id).limit(POLL_BATCH_SIZE)
+        ).all()
+
+        now = time.monotonic()
+        for row in rows:
+            if row.id > cursor:
+                self._remember_gaps(gaps, range(cursor + 1, row.id), now + self.lookback)
+                cursor = row.id
+            elif gaps.pop(row.id, None) is None:
+                continue
+            bus.receive(Event(row.topic, json.loads(row.payload), row.origin, remote=True))
+
+        for event_id, deadline in list(gaps.items()):
+            if deadline <= now:
+                del gaps[event_id]
+        return cursor, len(rows)
+
+    def _remember_gaps(self, gaps, missing, deadline):
+        if len(gaps) + len(missing) > MAX_GAPS:
+            logger.warning('event bus skipped %d ids; not waiting for them', len(missing))
+            return
+        for event_id in missing:
+            gaps[event_id] = deadline
+
+    def _prune(self, connection):
+        table = _table()
+        connection.execute(table.delete().where(
+            table.c.created_at < datetime.utcnow() - timedelta(seconds=self.retention)
+        ))
+        connection.commit()
+
+
+class RedisBackend:
+    """Redis の pub/sub で全ワーカーに配るバックエンド"""
+
+    def __init__(self, url, channel='bluelink:events'):
+        import redis  # 任意の依存なので使うときだけ読み込む
+
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        self._pubsub = None
+        self._thread = None
+
+    def stage(self, session, events):
+        pass
+
+    def publish(self, events):
+        for event in events:
+            self.client.publish(self.channel, event.to_json())
+
+    def start(self, bus, app):
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{self.channel: lambda message: bus.receive(Event.from_json(message['data']))})
+        self._thread = self._pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread = None
+
+
+class EventBus:
+    def __init__(self):
+        self.backend = LocalBackend()
+        self._handlers = defaultdict(list)
+        self._lock = threading.Lock()
+        self._app = None
+        self._origin = None
+        self._started_pid = None
+        self.stats = {'published': 0, 'received': 0, 'handler_errors': 0}
+
+    def init_app(self, app, db):
+        backend = app.config.get('EVENT_BUS_BACKEND') or os.environ.get('EVENT_BUS_BACKEND', 'database')
+        if isinstance(backend, str):
+            if backend == 'database':
+                backend = DatabaseBackend(
+                    app.config.get('EVENT_BUS_POLL_INTERVAL', DEFAULT_POLL_INTERVAL),
+                    app.config.get('EVENT_BUS_RETENTION', DEFAULT_RETENTION),
+                    app.config.get('EVENT_BUS_LOOKBACK', DEFAULT_LOOKBACK),
+                )
+            elif backend == 'local':
+                backend = LocalBackend()
+            elif backend.startswith(('redis://', 'rediss://', 'unix://')):
+                backend = RedisBackend(backend)
+            else:
+                raise ValueError(f'unknown EVENT_BUS_BACKEND: {backend}')
+        self.backend = backend
+        self._app = app
+
+        # db.session は共有なので、アプリを何度組み立てても登録は1回だけにする
+        for name, listener in (('before_commit', self._before_commit), ('after_commit', self._after_commit),
+                               ('after_soft_rollback', self._after_rollback)):
+            if not sa_event.contains(db.session, name, listener):
+                sa_event.listen(db.session, name, listener)
+        # 受信は最初のリクエストで始める（fork 前のマスターでスレッドを作らない）
+        app.before_request(self._ensure_started)
+
+    @property
+    def origin(self):
+        """このワーカーの識別子（fork した子では作り直す）"""
+        pid = os.getpid()
+        if self._origin is None or not self._origin.startswith(f'{pid}-'):
+            self._origin = f'{pid}-{uuid.uuid4().hex[:12]}'
+        return self._origin
+
+    def subscribe(self, topic, handler=None):
+        """購読者を登録する。デコレータとしても使える"""
+        def register(func):
+            with self._lock:
+                self._handlers[topic].append(func)
+            return func
+        return register(handler) if handler is not None else register
+
+    def handlers(self, topic):
+        with self._lock:
+            return list(self._handlers.get(topic, ()))
+
+    def publish(self, topic, **payload):
+        """イベントを現在のトランザクションに積む（コミットされたら配る）"""
+        from src.models.db import db
+
+        event = Event(topic, payload, self.origin)
+        session = db.session()
+        session.info.setdefault(PENDING_KEY, []).append(event)
+        return event
+
+    def receive(self, event):
+        """他のワーカーからのイベント（自分が出したものは配信済みなので無視する）"""
+        if event.origin == self.origin:
+            return
+        self.stats['received'] += 1
+        self._dispatch(event)
+
+    def stop(self):
+        self.backend.stop()
+        self._started_pid = None
+
+    def _before_commit(self, session):
+        events = session.info.get(PENDING_KEY)
+        if events:
+            self.backend.stage(session, events)
+
+    def _after_commit(self, session):
+        events = session.info.pop(PENDING_KEY, None)
+        if not events:
+            return
+        self.stats['published'] += len(events)
+        for event in events:
+            self._dispatch(event)
+        try:
+            self.backend.publish(events)
+        except Exception:
+            logger.exception('event bus publish failed')
+
+    def _after_rollback(self, session, previous_transaction):
+        if previous_transaction.parent is None:
+            session.info.pop(PENDING_KEY, None)
+
+    def _dispatch(self, event):
+        with self._lock:
+            handlers = self._handlers.get(event.topic, []) + self._handlers.get('*', [])
+        for handler in handlers:
+            try:
+                handler(event)
+            except Exception:
+                self.stats['handler_errors'] += 1
+                logger.exception('event handler failed: %r', event)
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._started_pid == pid:
+            return
+        with self._lock:
+            if self._started_pid == pid:
+                return
+            self._started_pid = pid
+        self.backend.start(self, self._app)
+
+
+events = EventBus()
@@ -0,0 +1,92 @@
+"""管理用のデータ書き出し（NDJSON）
+
+テーブルを主キー順に PAGE_SIZE 行ずつキーセットで読み（``WHERE id > 前のページの最後``）、
+1行を1つの JSON として書き出すジェネレータ。ORM のオブジェクトは作らず
+テーブルの行をそのまま読むので、セッションに溜まらずメモリは表の大きさに
+よらず一定になる。
+
+各行には id が入っているので、途中で切れたら最後に受け取った行の id を
+after に渡せば続きから書き出せる。
+"""
+import json
+import zlib
+from datetime import date, datetime, time
+
+from src.models.db import db
+from src.models.friend import Friend
+from src.models.message import Message
+from src.models.timetable import Timetable
+from src.models.user import User
+
+PAGE_SIZE = 1000
+FETCH_SIZE = 100  # 1ページの結果をカーソルから読む単位
+
+# 書き出すテーブルと列（パスワードのハッシュなどは書き出さない）
+EXPORTS = {
+    'users': (User.__table__, ('id', 'username', 'email', 'created_at', 'updated_at')),
+    'timetables': (Timetable.__table__, ('id', 'user_id', 'day_of_week', 'period', 'subject_name', 'room',
+                                          'start_time', 'end_time', 'created_at', 'updated_at')),
+    'friendships': (Friend.__table__, ('id', 'user_id', 'friend_user_id', 'status', 'created_at', 'updated_at')),
+    'messages': (Message.__table__, ('id', 'sender_id', 'receiver_id', 'content', 'is_read', 'created_at')),
+}
+
+
+def parse_after(name, value):
+    """after の値を主キーの型に合わせる。不正なら ValueError"""
+    table, _ = EXPORTS[name]
+    if table.c.id.type.python_type is int:
+        return int(value)
+    return value
+
+
+def export_rows(name, after=None, limit=None, page_size=PAGE_SIZE):
+    """テーブルの行を主キー順に dict で返すジェネレータ
+
+    1ページの結果も yield_per で FETCH_SIZE 行ずつカーソルから読む。
+    """
+    table, columns = EXPORTS[name]
+    selected = [table.c[column] for column in columns]
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        query = db.select(*selected).order_by(table.c.id).limit(size)
+        if after is not None:
+            query = query.where(table.c.id > after)
+
+        count = 0
+        for row in db.session.execute(query.execution_options(yield_per=FETCH_SIZE)).mappings():
+            count += 1
+            after = row['id']
+            yield dict(row)
+        if count < size:
+            return
+        if remaining is not None:
+            remaining -= count
+
+
+def ndjson_chunks(rows, page_size=PAGE_SIZE):
+    """行を NDJSON にして、page_size 行ずつまとめたバイト列で返す"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, ensure_ascii=False, default=_json_default))
+        if len(lines) >= page_size:
+            yield ('\n'.join(lines) + '\n').encode()
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode()
+
+
+def gzip_chunks(chunks, level=6):
+    """バイト列をその場で gzip 圧縮する（チャンクごとに flush して少しずつ送る）"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    raise TypeError(f'cannot serialize {type(value).__name__}')
@@ -0,0 +1,136 @@
+"""リクエスト単位の認証レイヤー
+
+before_request でセッションのユーザーを一度だけ解決して ``g.current_user``
+に置く。ユーザー情報は短いTTLでプロセス内にキャッシュし、更新・削除時に
+invalidate() で破棄する。ルートには login_required デコレータを付ける。
+"""
+import threading
+import time
+from functools import wraps
+
+from flask import g, jsonify, request, session
+
+from src.models.user import User
+from src.services.request_cache import cached, request_cache
+
+DEFAULT_TTL = 30           # 秒
+DEFAULT_MAX_ENTRIES = 10000
+
+# セッションを読まないブループリント（静的ファイルに Vary: Cookie を付けないため）
+DEFAULT_EXEMPT_BLUEPRINTS = ('frontend',)
+
+
+class Identity:
+    """認証済みユーザーの軽量スナップショット（セッションに依存しない）"""
+
+    __slots__ = ('id', 'username', 'email', 'qr_token_version', 'created_at', 'updated_at')
+
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.email = user.email
+        self.qr_token_version = user.qr_token_version
+        self.created_at = user.created_at
+        self.updated_at = user.updated_at
+
+    def __repr__(self):
+        return f'<Identity {self.username}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'username': self.username,
+            'email': self.email,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class IdentityCache:
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.exempt_blueprints = DEFAULT_EXEMPT_BLUEPRINTS
+        self._entries = {}  # user_id -> (期限, Identity)
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'requests': 0, 'total_ms': 0.0}
+
+    def init_app(self, app):
+        self.ttl = app.config.get('IDENTITY_CACHE_TTL', self.ttl)
+        self.max_entries = app.config.get('IDENTITY_CACHE_MAX_ENTRIES', self.max_entries)
+        self.exempt_blueprints = app.config.get('IDENTITY_EXEMPT_BLUEPRINTS', self.exempt_blueprints)
+        app.before_request(self.load_current_user)
+        app.after_request(self._add_server_timing)
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                self.stats['hits'] += 1
+                return entry[1]
+            self.stats['misses'] += 1
+
+        user = User.query.get(user_id)
+        if user is None:
+            self.invalidate(user_id)
+            return None
+
+        identity = Identity(user)
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._evict_expired(now)
+            if len(self._entries) < self.max_entries:
+                self._entries[user_id] = (now + self.ttl, identity)
+        return identity
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+        cache = request_cache()
+        if cache is not None:
+            cache.pop(('identity', user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def load_current_user(self):
+        """before_request: セッションのユーザーを g.current_user に解決する"""
+        if request.blueprint in self.exempt_blueprints:
+            g.current_user = None
+            return
+
+        started = time.perf_counter()
+        user_id = session.get('user_id')
+        # バッチのサブリクエストでは、親と同じキャッシュで一度だけ解決する
+        g.current_user = cached(('identity', user_id), lambda: self.get(user_id)) if user_id else None
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        g.auth_ms = elapsed_ms
+        # スレッドで動くワーカーやバッチのサブリクエストから同時に更新される
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['total_ms'] += elapsed_ms
+
+    def _add_server_timing(self, response):
+        if 'auth_ms' in g:
+            response.headers.add('Server-Timing', f'auth;dur={g.auth_ms:.2f}')
+        return response
+
+    def _evict_expired(self, now):
+        for user_id in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+            del self._entries[user_id]
+
+
+identity_cache = IdentityCache()
+
+
+def login_required(view):
+    """未ログインなら401を返すデコレータ。ユーザーは g.current_user で参照する"""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if g.get('current_user') is None:
+            return jsonify({'error': '認証が必要です'}), 401
+        return view(*args, **kwargs)
+    return wrapped
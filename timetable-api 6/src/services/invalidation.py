@@ -0,0 +1,70 @@
+"""ドメインイベントからプロセス内のキャッシュと集計を更新する購読者
+
+書き込みのルートはキャッシュを直接触らずにイベントを出す。このワーカーの
+イベントはコミット直後に、他のワーカーのイベントはイベントバス経由で届く
+ので、どのワーカーのキャッシュも同じように無効化される。
+
+- ``friendship.changed`` (user_ids): 友達申請の一覧
+- ``timetable.changed`` (user_id, before, after): 時間割と混雑度の集計
+- ``message.sent`` (sender_id, receiver_id) / ``conversation.changed`` (user_ids): 会話一覧
+- ``profile.changed`` (user_id): プロフィール
+- ``user.changed`` (user_id): 認証ユーザーのスナップショットとプロフィール
+"""
+from src.services.busyness import busyness
+from src.services.identity import identity_cache
+from src.services.response_cache import response_cache
+
+
+def bump(event, *resources):
+    # レスポンスキャッシュを共有している場合は、発行したワーカーの更新だけで足りる
+    if event.remote and response_cache.shared:
+        return
+    response_cache.bump(*resources)
+
+
+def on_friendship_changed(event):
+    bump(event, *[('friends', user_id) for user_id in event.payload['user_ids']])
+
+
+def on_timetable_changed(event):
+    bump(event, ('timetable', event.payload['user_id']))
+    # 集計はワーカーごとなので、他のワーカーの変更も差分で反映する
+    busyness.record_change(cell(event.payload.get('before')), cell(event.payload.get('after')))
+
+
+def cell(key):
+    # JSON を経由すると cell_key() のタプルがリストになる
+    return tuple(key) if key is not None else None
+
+
+def on_message_sent(event):
+    bump(event, ('conversations', event.payload['sender_id']), ('conversations', event.payload['receiver_id']))
+
+
+def on_conversation_changed(event):
+    bump(event, *[('conversations', user_id) for user_id in event.payload['user_ids']])
+
+
+def on_profile_changed(event):
+    bump(event, ('profile', event.payload['user_id']))
+
+
+def on_user_changed(event):
+    identity_cache.invalidate(event.payload['user_id'])
+    bump(event, ('profile', event.payload['user_id']))
+
+
+HANDLERS = {
+    'friendship.changed': on_friendship_changed,
+    'timetable.changed': on_timetable_changed,
+    'message.sent': on_message_sent,
+    'conversation.changed': on_conversation_changed,
+    'profile.changed': on_profile_changed,
+    'user.changed': on_user_changed,
+}
+
+
+def register(bus):
+    for topic, handler in HANDLERS.items():
+        if handler not in bus.handlers(topic):
+            bus.subscribe(topic, handler)
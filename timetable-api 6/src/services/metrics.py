@@ -0,0 +1,207 @@
+"""ルートごとのレイテンシ・SQL・レスポンスサイズの計測
+
+METRICS_ENABLED が有効なときだけフックを登録する（無効ならオーバーヘッドなし）。
+集計は Prometheus のテキスト形式で /metrics から取得できる。値はワーカー
+プロセスごとなので、複数ワーカーの場合は収集側で合算する。
+
+SLOW_REQUEST_MS を設定すると、それを超えたリクエストを実行した SQL と
+あわせてログに出す。
+"""
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, current_app, g, has_app_context, request, request_finished
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+MAX_TRACED_STATEMENTS = 50
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{_labels(labels, le=_format(bound))} {cumulative}'
+        yield f'{name}_bucket{_labels(labels, le="+Inf")} {self.count}'
+        yield f'{name}_sum{_labels(labels)} {_format(self.sum)}'
+        yield f'{name}_count{_labels(labels)} {self.count}'
+
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.slow_request_ms = None
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.requests = defaultdict(int)          # (route, method, status) -> 件数
+        self.latency = {}                         # (route, method) -> Histogram（秒）
+        self.queries = {}                         # (route, method) -> Histogram（件数）
+        self.query_seconds = defaultdict(float)   # (route, method) -> SQL合計時間
+        self.response_bytes = defaultdict(int)    # (route, method) -> 合計バイト数
+
+    def init_app(self, app, db):
+        self.enabled = app.config.get('METRICS_ENABLED', False)
+        if not self.enabled:
+            return
+
+        self.slow_request_ms = app.config.get('SLOW_REQUEST_MS')
+        app.before_request(self._start_request)
+        # after_request（gzip など）がすべて終わった後の最終的なレスポンスで計測する
+        request_finished.connect(self._finish_request, app)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _start_request(self):
+        g.metrics = {
+            'started': time.perf_counter(),
+            'queries': 0,
+            'query_seconds': 0.0,
+            'statements': [] if self.slow_request_ms is not None else None,
+        }
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_app_context() and 'metrics' in g:
+            conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not (has_app_context() and 'metrics' in g):
+            return
+        started = conn.info.get('metrics_query_started')
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+
+        state = g.metrics
+        state['queries'] += 1
+        state['query_seconds'] += elapsed
+        if state['statements'] is not None and len(state['statements']) < MAX_TRACED_STATEMENTS:
+            state['statements'].append((elapsed, statement))
+
+    def _finish_request(self, sender, response, **extra):
+        state = g.pop('metrics', None)
+        if state is None:
+            return
+
+        elapsed = time.perf_counter() - state['started']
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        key = (route, request.method)
+        size = response.content_length or 0
+
+        with self._lock:
+            self.requests[(route, request.method, response.status_code)] += 1
+            self.latency.setdefault(key, Histogram(DEFAULT_BUCKETS)).observe(elapsed)
+            self.queries.setdefault(key, Histogram(QUERY_BUCKETS)).observe(state['queries'])
+            self.query_seconds[key] += state['query_seconds']
+            self.response_bytes[key] += size
+
+        if self.slow_request_ms is not None and elapsed * 1000 >= self.slow_request_ms:
+            self._log_slow_request(route, elapsed, state, size)
+
+    def _log_slow_request(self, route, elapsed, state, size):
+        lines = [
+            f'slow request {request.method} {route} {elapsed * 1000:.1f} ms '
+            f'queries={state["queries"]} sql={state["query_seconds"] * 1000:.1f} ms bytes={size}'
+        ]
+        for query_elapsed, statement in state['statements'] or []:
+            lines.append(f'  {query_elapsed * 1000:7.2f} ms  {" ".join(statement.split())[:200]}')
+        current_app.logger.warning('\n'.join(lines))
+
+    def metrics_view(self):
+        token = current_app.config.get('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return Response('unauthorized\n', status=401, mimetype='text/plain')
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+    def render(self):
+        from src.services.identity import identity_cache
+        from src.services.response_cache import response_cache
+        from src.services.events import events
+
+        out = []
+        with self._lock:
+            out.append('# HELP http_requests_total Requests by route, method and status.')
+            out.append('# TYPE http_requests_total counter')
+            for (route, method, status), count in sorted(self.requests.items()):
+                out.append(f'http_requests_total{_labels({"route": route, "method": method, "status": status})} {count}')
+
+            out.append('# HELP http_request_duration_seconds Request latency by route.')
+            out.append('# TYPE http_request_duration_seconds histogram')
+            for (route, method), histogram in sorted(self.latency.items()):
+                out.extend(histogram.lines('http_request_duration_seconds', {'route': route, 'method': method}))
+
+            out.append('# HELP db_queries_per_request SQL statements executed per request.')
+            out.append('# TYPE db_queries_per_request histogram')
+            for (route, method), histogram in sorted(self.queries.items()):
+                out.extend(histogram.lines('db_queries_per_request', {'route': route, 'method': method}))
+
+            out.append('# HELP db_query_duration_seconds_total Time spent in SQL by route.')
+            out.append('# TYPE db_query_duration_seconds_total counter')
+            for (route, method), seconds in sorted(self.query_seconds.items()):
+                out.append(f'db_query_duration_seconds_total{_labels({"route": route, "method": method})} {_format(seconds)}')
+
+            out.append('# HELP http_response_size_bytes_total Response body bytes by route.')
+            out.append('# TYPE http_response_size_bytes_total counter')
+            for (route, method), size in sorted(self.response_bytes.items()):
+                out.append(f'http_response_size_bytes_total{_labels({"route": route, "method": method})} {size}')
+
+        out.append('# HELP identity_cache_lookups_total Identity cache lookups by result.')
+        out.append('# TYPE identity_cache_lookups_total counter')
+        out.append(f'identity_cache_lookups_total{{result="hit"}} {identity_cache.stats["hits"]}')
+        out.append(f'identity_cache_lookups_total{{result="miss"}} {identity_cache.stats["misses"]}')
+
+        out.append('# HELP response_cache_lookups_total Response cache lookups by route and result.')
+        out.append('# TYPE response_cache_lookups_total counter')
+        for route, counts in sorted(response_cache.snapshot().items()):
+            out.append(f'response_cache_lookups_total{_labels({"route": route, "result": "hit"})} {counts["hits"]}')
+            out.append(f'response_cache_lookups_total{_labels({"route": route, "result": "miss"})} {counts["misses"]}')
+
+        out.append('# HELP event_bus_events_total Domain events published by this worker and received from others.')
+        out.append('# TYPE event_bus_events_total counter')
+        out.append(f'event_bus_events_total{{direction="published"}} {events.stats["published"]}')
+        out.append(f'event_bus_events_total{{direction="received"}} {events.stats["received"]}')
+        out.append('# HELP event_bus_handler_errors_total Event handlers that raised.')
+        out.append('# TYPE event_bus_handler_errors_total counter')
+        out.append(f'event_bus_handler_errors_total {events.stats["handler_errors"]}')
+        return '\n'.join(out) + '\n'
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    items = {**labels, **extra}
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in items.items()) + '}'
+
+
+metrics = Metrics()
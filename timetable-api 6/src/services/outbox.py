@@ -0,0 +1,200 @@
+"""トランザクショナル・アウトボックス
+
+リクエストの中で実行しなくてよい副作用（会話の事前作成、友達への通知、
+QRコード画像の描画など）は、ルートでコミットの前に
+``outbox.enqueue(kind, **payload)`` を呼んで outbox テーブルに積む。kind は
+「何が起きたか」（'friendship.accepted' など）で、副作用ごとの処理を登録する。
+ドメインの変更と同じトランザクションなので、コミットされた変更の副作用
+だけが必ず残る。
+
+積んだ処理は ``flask --app src.main outbox-worker`` の別プロセスがまとめて
+取り出して実行する:
+
+- 取り出しは locked_by / locked_until のリースで行うので、ワーカーを
+  複数動かしても同じ行を同時に実行しない（落ちたワーカーの行はリースが
+  切れたら再実行される）
+- 処理と完了の記録は同じトランザクションでコミットする
+- 失敗したら指数バックオフ（ジッター付き）で再試行し、max_attempts 回で
+  failed にする
+- 同じバッチの中の同じ種類・同じ内容の処理は1回だけ実行する
+
+処理は ``@outbox.handler(kind)`` で登録する（src.services.outbox_handlers）。
+処理は何度実行されても結果が同じになるように書くこと。
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from src.models.db import db
+from src.models.outbox import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_ATTEMPTS = 8
+DEFAULT_BASE_DELAY = 2.0     # 秒（1回目の再試行までの待ち）
+DEFAULT_MAX_DELAY = 600.0    # 秒
+DEFAULT_LEASE = 300          # 秒（取り出した行を他のワーカーに渡さない期間）
+DEFAULT_RETENTION = 86400    # 秒（完了した行を残す期間）
+
+
+class Outbox:
+    def __init__(self):
+        self._handlers = defaultdict(list)
+
+    def handler(self, kind):
+        """副作用の処理を登録するデコレータ。処理は payload を受け取る
+
+        1つの種類に複数の処理を登録できる（副作用が増えてもリクエストで積む
+        行は1つのまま）。同じ行の処理は同じトランザクションで実行される。
+        """
+        def register(func):
+            if func not in self._handlers[kind]:
+                self._handlers[kind].append(func)
+            return func
+        return register
+
+    def get_handlers(self, kind):
+        return list(self._handlers.get(kind, ()))
+
+    def enqueue(self, kind, **payload):
+        """現在のトランザクションに副作用を積む（コミットは呼び出し側）"""
+        message = OutboxMessage(kind=kind, payload=json.dumps(payload, sort_keys=True))
+        db.session.add(message)
+        return message
+
+
+outbox = Outbox()
+
+
+class OutboxWorker:
+    """outbox テーブルを取り出して実行する（アプリのコンテキストの中で使う）"""
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY,
+                 lease=DEFAULT_LEASE, retention=DEFAULT_RETENTION, echo=None):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease = lease
+        self.retention = retention
+        self.echo = echo or (lambda message: None)
+        self.worker_id = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.stats = {'done': 0, 'retried': 0, 'failed': 0, 'coalesced': 0}
+
+    def run(self, poll_interval=1.0, once=False, stop=None):
+        """積まれた処理を実行し続ける。once なら空になったところで終わる"""
+        stop = stop or threading.Event()
+        next_prune = 0.0
+        while not stop.is_set():
+            count = self.run_batch()
+            if time.monotonic() >= next_prune:
+                self.prune()
+                next_prune = time.monotonic() + 3600
+            if count:
+                self.echo(f"outbox: done={self.stats['done']} retried={self.stats['retried']} "
+                          f"failed={self.stats['failed']}")
+            elif once:
+                break
+            # バッチが埋まっていれば待たずに続きを取り出す
+            if count < self.batch_size:
+                stop.wait(poll_interval)
+        return self.stats
+
+    def run_batch(self):
+        """1バッチを取り出して実行し、取り出した件数を返す"""
+        messages = self._claim()
+        seen = {}
+        for message in messages:
+            signature = (message.kind, message.payload)
+            if signature in seen and seen[signature]:
+                # 同じバッチで成功した処理と同じ内容なら実行済みとして扱う
+                self._complete(message)
+                self.stats['coalesced'] += 1
+                continue
+            seen[signature] = self._process(message)
+        return len(messages)
+
+    def prune(self):
+        """完了してから retention 秒を過ぎた行を消す"""
+        threshold = datetime.utcnow() - timedelta(seconds=self.retention)
+        OutboxMessage.query.filter(
+            OutboxMessage.status == 'done', OutboxMessage.processed_at < threshold
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+    def _claim(self):
+        now = datetime.utcnow()
+        ids = db.session.query(OutboxMessage.id).filter(
+            OutboxMessage.status == 'pending',
+            OutboxMessage.available_at <= now,
+            (OutboxMessage.locked_until.is_(None)) | (OutboxMessage.locked_until < now)
+        ).order_by(OutboxMessage.id).limit(self.batch_size).subquery()
+
+        # 条件つきの UPDATE で取るので、他のワーカーと同じ行を取り合わない
+        OutboxMessage.query.filter(
+            OutboxMessage.id.in_(db.select(ids.c.id)),
+            OutboxMessage.status == 'pending',
+            (OutboxMessage.locked_until.is_(None)) | (OutboxMessage.locked_until < now)
+        ).update({
+            OutboxMessage.locked_by: self.worker_id,
+            OutboxMessage.locked_until: now + timedelta(seconds=self.lease),
+        }, synchronize_session=False)
+        db.session.commit()
+
+        return OutboxMessage.query.filter(
+            OutboxMessage.locked_by == self.worker_id,
+            OutboxMessage.status == 'pending',
+            OutboxMessage.locked_until > now
+        ).order_by(OutboxMessage.id).all()
+
+    def _process(self, message):
+        handlers = outbox.get_handlers(message.kind)
+        try:
+            if not handlers:
+                raise LookupError(f'no handler for {message.kind}')
+            payload = json.loads(message.payload)
+            for handler in handlers:
+                handler(payload)
+            self._complete(message)
+            return True
+        except Exception as e:
+            db.session.rollback()
+            self._fail(message, e)
+            return False
+
+    def _complete(self, message):
+        # 処理の書き込みと同じトランザクションで完了にする
+        message.status = 'done'
+        message.processed_at = datetime.utcnow()
+        message.locked_by = None
+        message.locked_until = None
+        db.session.commit()
+        self.stats['done'] += 1
+
+    def _fail(self, message, error):
+        message.attempts += 1
+        message.last_error = f'{type(error).__name__}: {error}'[:2000]
+        message.locked_by = None
+        message.locked_until = None
+        if message.attempts >= self.max_attempts:
+            message.status = 'failed'
+            self.stats['failed'] += 1
+            logger.error('outbox message %s (%s) failed permanently: %s', message.id, message.kind, error)
+        else:
+            message.available_at = datetime.utcnow() + timedelta(seconds=self.retry_delay(message.attempts))
+            self.stats['retried'] += 1
+            logger.warning('outbox message %s (%s) failed, retrying: %s', message.id, message.kind, error)
+        db.session.commit()
+
+    def retry_delay(self, attempts):
+        """attempts 回失敗した後の待ち時間（秒）。同時に失敗した処理が揃って再実行されないようずらす"""
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
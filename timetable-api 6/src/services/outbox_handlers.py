@@ -0,0 +1,60 @@
+"""アウトボックスの処理（outbox-worker が実行する）
+
+- friendship.accepted (user_ids): 会話の事前作成、共通の友達数と友達候補の更新
+- timetable.changed (user_id): 同じ授業の友達候補の更新
+- qr.render (user_id): QRコード画像の描画
+
+どれも何度実行しても結果が同じになるように書いてある。
+"""
+from src.models.db import db
+from src.models.message import Conversation
+from src.models.user import User
+from src.services.events import events
+from src.services.outbox import outbox
+from src.services.qr_cache import qr_cache, FORMATS
+from src.services.suggestions import apply_friendship_change, refresh_suggestions, update_suggestions
+
+
+@outbox.handler('friendship.accepted')
+def precreate_conversation(payload):
+    """友達になった2人の会話を作っておく（最初のメッセージ画面で作らずに済む）"""
+    user1_id, user2_id = sorted(payload['user_ids'])
+    exists = db.session.query(Conversation.id).filter_by(user1_id=user1_id, user2_id=user2_id).first()
+    if exists:
+        return
+    # 同時にリクエスト側で作られて一意制約に当たった場合は、再試行で上の確認に引っかかる
+    db.session.add(Conversation(user1_id=user1_id, user2_id=user2_id))
+    events.publish('conversation.changed', user_ids=[user1_id, user2_id])
+
+
+@outbox.handler('qr.render')
+def render_qr_images(payload):
+    """ユーザーの現在のQRコード画像を全形式で描画してキャッシュに入れておく"""
+    from src.routes.qr import friend_qr_data
+
+    user = User.query.get(payload['user_id'])
+    if user is None:
+        return
+    qr_data = friend_qr_data(user)
+    for fmt in FORMATS:
+        qr_cache.get_or_create(qr_data, fmt)
+
+
+@outbox.handler('friendship.accepted')
+def update_mutual_friends(payload):
+    """2人の共通の友達数を数え直し、数が変わったユーザーの候補を更新する
+
+    2人は候補の多くが変わるので計算し直し、相手の友達は変わった候補の行だけ直す。
+    """
+    user_a, user_b = payload['user_ids']
+    for user_id, mutual_counts in apply_friendship_change(user_a, user_b).items():
+        if user_id in (user_a, user_b):
+            refresh_suggestions(user_id)
+        else:
+            update_suggestions(user_id, mutual_counts)
+
+
+@outbox.handler('timetable.changed')
+def refresh_user_suggestions(payload):
+    """時間割が変わったユーザーの候補（同じ授業の相手）を計算し直す"""
+    refresh_suggestions(payload['user_id'])
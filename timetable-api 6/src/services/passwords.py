@@ -0,0 +1,67 @@
+"""パスワードハッシュのオフロード
+
+PBKDF2/scrypt はCPUを長時間占有するため、リクエストを処理するワーカーでは
+実行せず、サイズ固定のプロセスプールに投げる。同時に受け付ける件数には
+上限を設け、超えた分は HashingOverloaded で即座に断る（呼び出し側で503）。
+PASSWORD_HASH_WORKERS=0 の場合はプールを使わずその場で計算する。
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from src.services.worker_pool import BoundedPool
+
+DEFAULT_METHOD = 'scrypt'
+DEFAULT_TIMEOUT = 10      # 秒
+DEFAULT_RETRY_AFTER = 2   # 秒
+
+
+class HashingOverloaded(Exception):
+    """ハッシュ計算の待ち行列が上限に達している"""
+
+    def __init__(self, retry_after=DEFAULT_RETRY_AFTER):
+        super().__init__('password hashing queue is full')
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    def __init__(self):
+        self.method = DEFAULT_METHOD
+        self.pool = BoundedPool(
+            lambda workers: ProcessPoolExecutor(max_workers=workers), HashingOverloaded,
+            workers=min(os.cpu_count() or 1, 4), timeout=DEFAULT_TIMEOUT, retry_after=DEFAULT_RETRY_AFTER,
+        )
+        self._method_prefix = None
+
+    def init_app(self, app):
+        self.method = app.config.get('PASSWORD_HASH_METHOD', self.method)
+        self.pool.configure(
+            app.config.get('PASSWORD_HASH_WORKERS', self.pool.workers),
+            app.config.get('PASSWORD_HASH_QUEUE_LIMIT'),
+            app.config.get('PASSWORD_HASH_TIMEOUT', self.pool.timeout),
+            app.config.get('PASSWORD_HASH_RETRY_AFTER', self.pool.retry_after),
+        )
+        self._method_prefix = None
+
+    def hash(self, password):
+        return self.pool.run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self.pool.run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """保存済みハッシュが現在の設定（方式・コスト）と異なるか"""
+        return pwhash.split('$', 1)[0] != self._configured_prefix()
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+    def _configured_prefix(self):
+        # 'scrypt' のような省略形を 'scrypt:32768:8:1' のような完全な形にする
+        if self._method_prefix is None:
+            self._method_prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return self._method_prefix
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,157 @@
+"""QRコード画像のキャッシュ
+
+QRコードの内容はユーザーごとに固定なので、毎回 qrcode + PIL で描画せず、
+内容のハッシュをキーにしてメモリ(LRU)とディスクの2段で画像を保持する。
+qrcode / PIL は読み込みが重いので、初めて描画するときに import する。
+
+トークンは日ごとに変わるので、ディスクのファイルは QR_CACHE_MAX_AGE
+（既定はトークンの有効期間）を過ぎたら消す。書き込みのついでに、
+PRUNE_INTERVAL 秒に一度だけディレクトリを走査する。
+"""
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from src.services.qr_tokens import DEFAULT_TTL as TOKEN_TTL, EXPIRY_BUCKET
+
+FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+DEFAULT_MEMORY_ENTRIES = 256
+# 同じ日のトークンは最長で「1日 + 有効期間」使われる
+DEFAULT_MAX_AGE = TOKEN_TTL + EXPIRY_BUCKET  # 秒
+PRUNE_INTERVAL = 3600                         # 秒
+
+
+class QRCodeCache:
+    def __init__(self, directory=None, max_entries=DEFAULT_MEMORY_ENTRIES, max_age=DEFAULT_MAX_AGE):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._memory = OrderedDict()  # key -> bytes
+        self._lock = threading.Lock()
+        self._next_prune = 0.0
+
+    def init_app(self, app):
+        self.directory = app.config.get(
+            'QR_CACHE_DIR', os.path.join(app.instance_path, 'qr_cache')
+        )
+        self.max_entries = app.config.get('QR_CACHE_MEMORY_ENTRIES', self.max_entries)
+        self.max_age = app.config.get(
+            'QR_CACHE_MAX_AGE', app.config.get('QR_TOKEN_TTL', TOKEN_TTL) + EXPIRY_BUCKET
+        )
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key_for(data, fmt='png'):
+        """内容から決まるキャッシュキー（ETag としても使う）"""
+        return hashlib.sha256(f'{fmt}:{data}'.encode()).hexdigest()
+
+    def get_or_create(self, data, fmt='png'):
+        """(キー, 画像バイト列) を返す。なければ描画して保存する"""
+        if fmt not in FORMATS:
+            raise ValueError(f'unsupported format: {fmt}')
+
+        key = self.key_for(data, fmt)
+        image = self.get(key, fmt)
+        if image is None:
+            image = self._render(data, fmt)
+            self._store_disk(key, fmt, image)
+            self._store_memory(key, image)
+        return key, image
+
+    def get(self, key, fmt='png'):
+        """キーから画像を引く（メモリ → ディスクの順）。なければ None"""
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+                return image
+
+        path = self._path(key, fmt)
+        if path is None or not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            image = f.read()
+        self._store_memory(key, image)
+        return image
+
+    def _render(self, data, fmt):
+        import qrcode
+        import qrcode.image.svg
+
+        qr = qrcode.QRCode(
+            version=1,
+            error_correction=qrcode.constants.ERROR_CORRECT_L,
+            box_size=10,
+            border=4,
+        )
+        qr.add_data(data)
+        qr.make(fit=True)
+
+        buffer = io.BytesIO()
+        if fmt == 'svg':
+            img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+            img.save(buffer)
+        else:
+            img = qr.make_image(fill_color="black", back_color="white")
+            img.save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    def _store_memory(self, key, image):
+        with self._lock:
+            self._memory[key] = image
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _store_disk(self, key, fmt, image):
+        path = self._path(key, fmt)
+        if path is None:
+            return
+        # 書きかけのファイルを読まれないよう一時ファイル経由で置き換える
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(image)
+        os.replace(tmp_path, path)
+        self._maybe_prune()
+
+    def prune(self, now=None):
+        """作成から max_age 秒を過ぎたファイル（期限切れのトークンの画像）を消し、消した数を返す"""
+        if not self.directory or not os.path.isdir(self.directory):
+            return 0
+        threshold = (now if now is not None else time.time()) - self.max_age
+        removed = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                try:
+                    if entry.stat().st_mtime < threshold:
+                        os.remove(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    # 他のワーカーが同時に消した
+                    continue
+        return removed
+
+    def _maybe_prune(self):
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_prune:
+                return
+            self._next_prune = now + PRUNE_INTERVAL
+        self.prune()
+
+    def _path(self, key, fmt):
+        if not self.directory:
+            return None
+        return os.path.join(self.directory, f'{key}.{fmt}')
+
+
+qr_cache = QRCodeCache()
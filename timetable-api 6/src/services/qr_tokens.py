@@ -0,0 +1,120 @@
+"""QRコード用の署名付き友達追加トークン
+
+トークンは ``<鍵ID>.<ペイロード>.<署名>`` の形式で、ペイロードには
+ユーザーID・ユーザー名・有効期限・トークン世代を含む。署名はアプリの
+秘密鍵から導出した鍵による HMAC-SHA256 なので、検証に DB は不要。
+
+- 鍵のローテーション: ``QR_TOKEN_KEYS`` に新しい鍵IDを追加し
+  ``QR_TOKEN_KEY_ID`` を切り替える（古い鍵で署名済みのトークンも検証できる）
+- 失効: ``User.qr_token_version`` を上げると、それ以前のトークンは
+  友達申請の作成時に拒否される
+"""
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+from flask import current_app
+
+TOKEN_SALT = b'qr-friend-token'
+SIGNATURE_BYTES = 16
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+# 有効期限を丸める単位。同じ日の間はトークンが変わらないので
+# QRコード画像のキャッシュがそのまま使える
+EXPIRY_BUCKET = 24 * 60 * 60
+
+
+class InvalidQRToken(Exception):
+    """署名・形式が不正なトークン"""
+
+
+class ExpiredQRToken(InvalidQRToken):
+    """有効期限切れのトークン"""
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _signing_keys():
+    config = current_app.config
+    keys = config.get('QR_TOKEN_KEYS') or {'1': config['SECRET_KEY']}
+    key_id = str(config.get('QR_TOKEN_KEY_ID') or next(iter(keys)))
+    return key_id, keys
+
+
+def _derive_key(secret):
+    if isinstance(secret, str):
+        secret = secret.encode()
+    return hmac.new(secret, TOKEN_SALT, hashlib.sha256).digest()
+
+
+def _sign(key_id, secret, payload):
+    message = f'{key_id}.{payload}'.encode()
+    digest = hmac.new(_derive_key(secret), message, hashlib.sha256).digest()
+    return _b64encode(digest[:SIGNATURE_BYTES])
+
+
+def issue_token(user, now=None):
+    """ユーザーの友達追加トークンを発行する"""
+    now = int(now if now is not None else time.time())
+    ttl = current_app.config.get('QR_TOKEN_TTL', DEFAULT_TTL)
+    expires_at = (now // EXPIRY_BUCKET + 1) * EXPIRY_BUCKET + ttl
+
+    claims = {
+        'u': user.id,
+        'n': user.username,
+        'e': expires_at,
+        'v': user.qr_token_version or 0,
+    }
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode())
+
+    key_id, keys = _signing_keys()
+    return f'{key_id}.{payload}.{_sign(key_id, keys[key_id], payload)}'
+
+
+def verify_token(token, now=None):
+    """トークンを検証してクレームを返す（DBにはアクセスしない）
+
+    戻り値は ``{'user_id', 'username', 'expires_at', 'version'}``。
+    """
+    try:
+        key_id, payload, signature = token.split('.')
+    except (AttributeError, ValueError):
+        raise InvalidQRToken('malformed token')
+
+    _, keys = _signing_keys()
+    secret = keys.get(key_id)
+    if secret is None:
+        raise InvalidQRToken('unknown key')
+    # str のまま比べると ASCII 以外の文字で TypeError になるのでバイト列で比べる
+    expected = _sign(key_id, secret, payload).encode()
+    if not hmac.compare_digest(signature.encode('utf-8', 'surrogatepass'), expected):
+        raise InvalidQRToken('bad signature')
+
+    try:
+        claims = json.loads(_b64decode(payload))
+        result = {
+            'user_id': claims['u'],
+            'username': claims['n'],
+            'expires_at': int(claims['e']),
+            'version': int(claims['v']),
+        }
+    except (ValueError, KeyError, TypeError):
+        raise InvalidQRToken('malformed payload')
+
+    now = int(now if now is not None else time.time())
+    if result['expires_at'] < now:
+        raise ExpiredQRToken('token expired')
+    return result
+
+
+def is_current(claims, user):
+    """トークン世代がユーザーの現在の世代と一致するか"""
+    return claims['version'] == (user.qr_token_version or 0)
@@ -0,0 +1,29 @@
+"""リクエスト単位のキャッシュ
+
+同じリクエストの中で同じ値を何度も計算しないための dict。通常のリクエスト
+ではそのリクエストだけで使われるが、/api/batch のサブリクエストには親の
+キャッシュが WSGI environ 経由で渡されるので、バッチ全体で共有される
+（例えば、認証済みユーザーの解決はバッチで一度だけ行われる）。
+"""
+from flask import has_request_context, request
+
+ENVIRON_KEY = 'bluelink.request_cache'
+
+
+def request_cache():
+    """現在のリクエスト（バッチ中ならバッチ全体）のキャッシュ。リクエスト外では None"""
+    if not has_request_context():
+        return None
+    return request.environ.setdefault(ENVIRON_KEY, {})
+
+
+def cached(key, factory):
+    """key の値がキャッシュになければ factory() で作って保存する"""
+    cache = request_cache()
+    if cache is None:
+        return factory()
+    try:
+        return cache[key]
+    except KeyError:
+        value = cache[key] = factory()
+        return value
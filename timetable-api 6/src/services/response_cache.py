@@ -0,0 +1,201 @@
+"""読み取りの多い GET のレスポンスキャッシュ
+
+キーは (エンドポイント, 閲覧者, リソースのバージョン, クエリ文字列)。リソース
+（例: ``('profile', user_id)``）ごとにバージョンの番号を持ち、書き込みのイベントで
+bump() して番号を上げると、そのリソースを含むキャッシュは参照されなくなる
+（古いエントリは LRU / TTL で消える）。
+
+バックエンド（設定か環境変数の RESPONSE_CACHE_BACKEND）:
+
+- ``'memory'``（既定）: プロセス内の LRU。件数は RESPONSE_CACHE_MAX_ENTRIES まで
+- ``'redis://...'``: Redis を全ワーカーで共有する（redis パッケージが必要）
+- get / set / get_versions / bump / clear を持つオブジェクトを直接渡してもよい
+
+メモリのバックエンドはワーカーごとなので、他のワーカーの書き込みはイベントバスで
+届いてから無効化される（src.services.invalidation）。ルートごとのヒット率は stats に記録し、
+/metrics に出力する。
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from functools import wraps
+
+from flask import g, make_response, request
+
+DEFAULT_MAX_ENTRIES = 2048
+DEFAULT_TTL = 300  # 秒
+
+
+class MemoryBackend:
+    """プロセス内の LRU。バージョン番号は追い出さないように別に持つ"""
+
+    shared = False
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (期限, 値)
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_versions(self, names):
+        with self._lock:
+            return [self._versions.get(name, 0) for name in names]
+
+    def bump(self, names):
+        with self._lock:
+            for name in names:
+                self._versions[name] = self._versions.get(name, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+
+class RedisBackend:
+    """全ワーカーで共有する Redis のバックエンド"""
+
+    shared = True
+
+    def __init__(self, url, prefix='bluelink:cache:'):
+        import redis  # 任意の依存なので使うときだけ読み込む
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + 'r:' + key)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + 'r:' + key, value, ex=int(ttl))
+
+    def get_versions(self, names):
+        if not names:
+            return []
+        values = self.client.mget([self.prefix + 'v:' + name for name in names])
+        return [int(v) if v is not None else 0 for v in values]
+
+    def bump(self, names):
+        pipeline = self.client.pipeline()
+        for name in names:
+            pipeline.incr(self.prefix + 'v:' + name)
+        pipeline.execute()
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+def resource_name(resource):
+    """('profile', user_id) -> 'profile:<user_id>'"""
+    return ':'.join(str(part) for part in resource)
+
+
+class ResponseCache:
+    def __init__(self):
+        self.enabled = True
+        self.ttl = DEFAULT_TTL
+        self.backend = MemoryBackend()
+        self._lock = threading.Lock()
+        self.stats = defaultdict(lambda: {'hits': 0, 'misses': 0})  # エンドポイント -> 件数
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RESPONSE_CACHE_ENABLED', True)
+        self.ttl = app.config.get('RESPONSE_CACHE_TTL', self.ttl)
+
+        # 設定がなければ環境変数（デプロイ先で Redis を指定する）
+        backend = app.config.get('RESPONSE_CACHE_BACKEND') or os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')
+        if isinstance(backend, str):
+            if backend == 'memory':
+                backend = MemoryBackend(app.config.get('RESPONSE_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+            elif backend.startswith(('redis://', 'rediss://', 'unix://')):
+                backend = RedisBackend(backend)
+            else:
+                raise ValueError(f'unknown RESPONSE_CACHE_BACKEND: {backend}')
+        self.backend = backend
+
+    def cached(self, resources):
+        """GET ビューのレスポンスをキャッシュするデコレータ
+
+        resources はビューの引数を受け取り、レスポンスが依存するリソースの
+        一覧（``[('profile', user_id)]`` など）を返す関数。閲覧者は
+        g.current_user なので、login_required の内側に付けること。
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapped(*args, **kwargs):
+                if not self.enabled or request.method != 'GET':
+                    return view(*args, **kwargs)
+
+                viewer = g.current_user.id if g.get('current_user') is not None else '-'
+                names = [resource_name(r) for r in resources(*args, **kwargs)]
+                versions = self.backend.get_versions(names)
+                key = '|'.join([
+                    request.endpoint, viewer,
+                    ','.join(f'{n}={v}' for n, v in zip(names, versions)),
+                    request.query_string.decode('latin-1'),
+                ])
+
+                value = self.backend.get(key)
+                if value is not None:
+                    self._record(request.endpoint, 'hits')
+                    content_type, _, body = value.partition(b'\n')
+                    response = make_response(body)
+                    response.content_type = content_type.decode()
+                    response.headers['X-Cache'] = 'hit'
+                    return response
+
+                self._record(request.endpoint, 'misses')
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.direct_passthrough:
+                    self.backend.set(key, response.content_type.encode() + b'\n' + response.get_data(), self.ttl)
+                response.headers['X-Cache'] = 'miss'
+                return response
+            return wrapped
+        return decorator
+
+    @property
+    def shared(self):
+        """全ワーカーで共有するバックエンドか（直接渡したオブジェクトは shared 属性で示す）"""
+        return getattr(self.backend, 'shared', False)
+
+    def bump(self, *resources):
+        """リソースのバージョンを上げる（書き込みのコミット後に呼ぶ）"""
+        if resources:
+            self.backend.bump([resource_name(r) for r in resources])
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.stats.clear()
+
+    def snapshot(self):
+        """エンドポイントごとのヒット・ミス件数の写し"""
+        with self._lock:
+            return {endpoint: dict(counts) for endpoint, counts in self.stats.items()}
+
+    def _record(self, endpoint, result):
+        with self._lock:
+            self.stats[endpoint][result] += 1
+
+
+response_cache = ResponseCache()
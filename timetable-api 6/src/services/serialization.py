@@ -0,0 +1,101 @@
+"""JSONシリアライズ層
+
+- orjson がインストールされていれば Flask の JSON エンコーダとして使う
+  （なければ標準の json）。datetime は to_dict() で文字列にせず、そのまま
+  渡せば ISO 8601 で出力される
+- エンドポイントごとのプロジェクション（クライアントが使う項目だけ）
+- しきい値を超える JSON レスポンスの gzip 圧縮
+"""
+import gzip
+import json
+from datetime import date, datetime, time
+
+from flask import current_app, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson は任意
+    orjson = None
+
+DEFAULT_GZIP_MIN_BYTES = 1024
+DEFAULT_GZIP_LEVEL = 6
+
+# エンドポイントごとのプロジェクション（モデルの属性名）
+MESSAGE_FIELDS = ('id', 'sender_id', 'receiver_id', 'content', 'created_at', 'is_read')
+LAST_MESSAGE_FIELDS = ('id', 'sender_id', 'content', 'created_at', 'is_read')
+USER_CARD_FIELDS = ('id', 'username')
+
+
+def _default(obj):
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """orjson があればそれを使う JSON プロバイダ"""
+
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode()
+        kwargs.setdefault('default', _default)
+        kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+        kwargs.setdefault('separators', (',', ':'))
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if orjson is not None:
+            body = orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+        else:
+            body = self.dumps(obj)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def project(obj, fields):
+    """モデルから指定の属性だけを取り出した dict を作る"""
+    if obj is None:
+        return None
+    return {field: getattr(obj, field) for field in fields}
+
+
+def wants_full_view():
+    """?view=full で従来の（すべての項目を含む）レスポンスを返す"""
+    return request.args.get('view') == 'full'
+
+
+def init_json(app):
+    app.json = FastJSONProvider(app)
+    app.after_request(_compress_response)
+
+
+def _compress_response(response):
+    min_bytes = current_app.config.get('JSON_GZIP_MIN_BYTES', DEFAULT_GZIP_MIN_BYTES)
+    if (
+        min_bytes is None
+        or response.mimetype != 'application/json'
+        or response.direct_passthrough
+        or response.status_code < 200 or response.status_code >= 300
+        or 'Content-Encoding' in response.headers
+        or 'gzip' not in request.headers.get('Accept-Encoding', '').lower()
+    ):
+        return response
+
+    body = response.get_data()
+    if len(body) < min_bytes:
+        return response
+
+    level = current_app.config.get('JSON_GZIP_LEVEL', DEFAULT_GZIP_LEVEL)
+    response.set_data(gzip.compress(body, compresslevel=level))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,131 @@
+"""静的ファイル（フロントエンドのビルド成果物）の配信
+
+起動時に静的フォルダを一度だけ走査してマニフェストを作り、リクエスト時は
+ファイルシステムを確認せずにマニフェストだけで配信するファイルを決める。
+
+- ``foo.js.br`` / ``foo.js.gz`` があれば Accept-Encoding に応じて配信する
+  （``flask --app src.main compress-static`` で生成できる）
+- ``assets/index-<hash>.js`` のようなハッシュ付きファイルは内容が変わらない
+  ので ``Cache-Control: immutable`` を付ける
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from datetime import datetime
+
+# Vite のハッシュ付きファイル名（例: assets/index-CQyu_bOH.js）
+HASHED_ASSET_PATTERN = re.compile(r'(^|/)assets/.+-[A-Za-z0-9_-]{8,}\.[A-Za-z0-9]+$')
+
+# 配信時の優先順（Content-Encoding 名, 拡張子）
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# 事前圧縮の対象
+COMPRESSIBLE_EXTENSIONS = {'.js', '.css', '.html', '.svg', '.json', '.txt', '.map', '.ico'}
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+
+class Asset:
+    __slots__ = ('path', 'size', 'etag', 'mimetype', 'immutable', 'variants')
+
+    def __init__(self, path, size, etag, mimetype, immutable):
+        self.path = path
+        self.size = size
+        self.etag = etag
+        self.mimetype = mimetype
+        self.immutable = immutable
+        self.variants = {}  # Content-Encoding -> (相対パス, ETag)
+
+    @property
+    def cache_control(self):
+        return IMMUTABLE_CACHE_CONTROL if self.immutable else REVALIDATE_CACHE_CONTROL
+
+
+class StaticAssets:
+    def __init__(self):
+        self.root = None
+        self.manifest = {}
+        self.built_at = None
+
+    def init_app(self, app):
+        self.root = app.static_folder
+        self.build_manifest()
+
+    def build_manifest(self):
+        manifest = {}
+        if self.root and os.path.isdir(self.root):
+            files = {}
+            for directory, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    full_path = os.path.join(directory, filename)
+                    rel_path = os.path.relpath(full_path, self.root).replace(os.sep, '/')
+                    files[rel_path] = os.stat(full_path)
+
+            for rel_path, stat in files.items():
+                if rel_path.endswith(tuple(ext for _, ext in ENCODINGS)):
+                    continue
+                asset = Asset(
+                    path=rel_path,
+                    size=stat.st_size,
+                    etag=_etag(rel_path, stat),
+                    mimetype=mimetypes.guess_type(rel_path)[0] or 'application/octet-stream',
+                    immutable=bool(HASHED_ASSET_PATTERN.search(rel_path)),
+                )
+                for encoding, ext in ENCODINGS:
+                    variant = rel_path + ext
+                    if variant in files:
+                        asset.variants[encoding] = (variant, f'{asset.etag}-{encoding}')
+                manifest[rel_path] = asset
+
+        self.manifest = manifest
+        self.built_at = datetime.utcnow()
+
+    def resolve(self, path):
+        """パスに対応するアセットを返す。なければ index.html（SPAのルーティング）"""
+        return self.manifest.get(path) or self.manifest.get('index.html')
+
+    def choose_variant(self, asset, accept_encodings):
+        """(配信する相対パス, Content-Encoding, ETag) を返す"""
+        for encoding, _ in ENCODINGS:
+            if encoding in asset.variants and accept_encodings[encoding]:
+                variant_path, etag = asset.variants[encoding]
+                return variant_path, encoding, etag
+        return asset.path, None, asset.etag
+
+    def compress_all(self, min_bytes=512):
+        """圧縮版（.gz と、brotli があれば .br）を生成し、生成した数を返す"""
+        try:
+            import brotli
+        except ImportError:
+            brotli = None
+
+        created = 0
+        for asset in self.manifest.values():
+            if os.path.splitext(asset.path)[1] not in COMPRESSIBLE_EXTENSIONS or asset.size < min_bytes:
+                continue
+            with open(os.path.join(self.root, asset.path), 'rb') as f:
+                data = f.read()
+
+            outputs = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                outputs.append(('.br', brotli.compress(data, quality=11)))
+            for ext, compressed in outputs:
+                # 小さくならないものは置かない
+                if len(compressed) >= len(data):
+                    continue
+                with open(os.path.join(self.root, asset.path + ext), 'wb') as f:
+                    f.write(compressed)
+                created += 1
+
+        self.build_manifest()
+        return created
+
+
+def _etag(rel_path, stat):
+    return hashlib.sha1(f'{rel_path}:{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()[:20]
+
+
+static_assets = StaticAssets()
@@ -0,0 +1,95 @@
+"""データベースのストレージ設定
+
+接続先は次の順で決める。
+
+1. ``DATABASE_URL`` 環境変数（PostgreSQL などのサーバーDB。接続プールを使う）
+2. ``RENDER`` 環境変数がある場合は ``RENDER_DISK_PATH``（既定はインスタンス
+   フォルダ）上のSQLiteファイル。永続ディスクを割り当てれば再起動後も残り、
+   全ワーカーが同じDBを共有する
+3. ローカルでは ``database/timetable.db``
+
+SQLiteファイルの場合は接続ごとに WAL などの PRAGMA を設定し、複数ワーカー
+からの読み書きが互いをブロックしにくくする。
+"""
+import os
+
+from sqlalchemy import event
+
+# 接続ごとに実行する PRAGMA。SQLITE_PRAGMAS で上書きできる
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',        # 読み取りが書き込みにブロックされない
+    'synchronous': 'NORMAL',      # WAL ではチェックポイント時のみ fsync
+    'busy_timeout': 5000,         # ロック中は最大5秒待つ（ミリ秒）
+    'cache_size': -20000,         # ページキャッシュ約20MB（負の値はKiB）
+    'mmap_size': 268435456,       # 256MB までメモリマップで読む
+    'temp_store': 'MEMORY',
+}
+
+# サーバーDB用の接続プール設定
+DEFAULT_POOL_OPTIONS = {
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_pre_ping': True,
+    'pool_recycle': 1800,
+}
+
+
+def resolve_database_url(app, environ=None):
+    environ = os.environ if environ is None else environ
+
+    url = environ.get('DATABASE_URL')
+    if url:
+        # Heroku/Render 形式の postgres:// は SQLAlchemy では postgresql://
+        if url.startswith('postgres://'):
+            url = 'postgresql://' + url[len('postgres://'):]
+        return url
+
+    if environ.get('RENDER'):
+        directory = environ.get('RENDER_DISK_PATH', app.instance_path)
+    else:
+        directory = os.path.join(app.instance_path, 'database')
+    os.makedirs(directory, exist_ok=True)
+    return 'sqlite:///' + os.path.join(directory, 'timetable.db')
+
+
+def is_sqlite_file(url):
+    return url.startswith('sqlite') and ':memory:' not in url and url not in ('sqlite://', 'sqlite:///')
+
+
+def configure_storage(app):
+    """db.init_app() の前に接続URLとエンジン設定を決める"""
+    url = app.config.get('SQLALCHEMY_DATABASE_URI') or resolve_database_url(app)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    if is_sqlite_file(url):
+        pragmas = app.config.setdefault('SQLITE_PRAGMAS', dict(DEFAULT_SQLITE_PRAGMAS))
+        connect_args = options.setdefault('connect_args', {})
+        # Python側のロック待ちも busy_timeout に揃える
+        connect_args.setdefault('timeout', pragmas.get('busy_timeout', 5000) / 1000)
+    elif not url.startswith('sqlite'):
+        for key, value in app.config.get('DATABASE_POOL_OPTIONS', DEFAULT_POOL_OPTIONS).items():
+            options.setdefault(key, value)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def init_storage(app, db):
+    """db.init_app() の後、接続時に PRAGMA を設定するイベントを登録する"""
+    if not is_sqlite_file(app.config['SQLALCHEMY_DATABASE_URI']):
+        return
+
+    pragmas = app.config['SQLITE_PRAGMAS']
+    with app.app_context():
+        event.listen(
+            db.engine, 'connect',
+            lambda dbapi_connection, connection_record: apply_sqlite_pragmas(dbapi_connection, pragmas)
+        )
+
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
@@ -0,0 +1,359 @@
+"""「知り合いかも」の友達候補
+
+リクエストのたびに friends を2段に自己結合しないよう、2つのテーブルを
+事前に計算しておく:
+
+- mutual_friend_counts: (ユーザー, 候補) ごとの共通の友達数。友達になった
+  ときにアウトボックスの処理が、その2人と相手の友達の組だけ数え直す。
+  全件の作り直しは ``flask --app src.main rebuild-suggestions`` で、隣接行列の
+  2乗（A·A）にあたる集計をユーザーの区切りごとの INSERT ... SELECT で行う
+- friend_suggestions: ユーザーごとの上位 SUGGESTIONS_PER_USER 件。共通の
+  友達数と、同じ授業（曜日・時限・科目名が同じ時間割）の数から点数を付ける
+
+既に友達・申請中の相手は計算時に除き、表示時にも除く（申請は頻繁に変わる）。
+"""
+import time
+from collections import defaultdict
+
+from sqlalchemy import and_, bindparam, func, select, union_all
+from sqlalchemy.orm import aliased
+
+from src.models.db import db
+from src.models.friend import Friend
+from src.models.suggestion import FriendSuggestion, MutualFriendCount
+from src.models.timetable import Timetable
+from src.models.user import User
+
+MUTUAL_WEIGHT = 1.0
+SHARED_CLASS_WEIGHT = 0.5
+SUGGESTIONS_PER_USER = 50
+CANDIDATE_POOL = 200  # 共通の友達・同じ授業のそれぞれから取る候補の数
+CHUNK_SIZE = 500      # IN 句と一括 INSERT の1回あたりの件数
+
+
+def accepted_friend_ids(user_id):
+    """承認済みの友達のIDの集合（申請した側・された側の両方向）"""
+    query = union_all(
+        select(Friend.friend_user_id).where(Friend.user_id == user_id, Friend.status == 'accepted'),
+        select(Friend.user_id).where(Friend.friend_user_id == user_id, Friend.status == 'accepted'),
+    )
+    return {row[0] for row in db.session.execute(query)}
+
+
+def related_user_ids(user_id):
+    """友達・申請中・拒否済みを問わず、関係のある相手のIDを返す SELECT"""
+    return union_all(
+        select(Friend.friend_user_id).where(Friend.user_id == user_id),
+        select(Friend.user_id).where(Friend.friend_user_id == user_id),
+    )
+
+
+def shared_class_counts(user_id, candidate_ids=None, limit=None):
+    """同じ授業を取っている相手ごとの授業数 {user_id: 件数}"""
+    mine = aliased(Timetable)
+    theirs = aliased(Timetable)
+    shared = func.count().label('shared')
+    query = db.session.query(theirs.user_id, shared).join(mine, and_(
+        mine.day_of_week == theirs.day_of_week,
+        mine.period == theirs.period,
+        mine.subject_name == theirs.subject_name,
+    )).filter(
+        mine.user_id == user_id,
+        theirs.user_id != user_id,
+        mine.subject_name.isnot(None),
+        mine.subject_name != '',
+    ).group_by(theirs.user_id)
+    if candidate_ids is not None:
+        query = query.filter(theirs.user_id.in_(candidate_ids))
+    if limit is not None:
+        query = query.order_by(shared.desc(), theirs.user_id).limit(limit)
+    return dict(query.all())
+
+
+def apply_friendship_change(user_a, user_b):
+    """a と b が友達になった・友達でなくなったときに共通の友達数を更新する
+
+    変わるのは (a, b の友達) と (b, a の友達) の組だけなので、その相手の
+    友達の集合をインデックスで引いて、その組だけを数え直す（共通の友達数は
+    対称なので逆向きの行も同じ値にする）。差分ではなく数え直すので、複数の
+    承認がまとめて処理されても、同じ処理が再実行されても二重には数えない。
+    変わった組を {ユーザー: {候補: 新しい共通の友達数}} で返す（両方向）。
+    コミットは呼び出し側。
+    """
+    friends_a = accepted_friend_ids(user_a) - {user_b}
+    friends_b = accepted_friend_ids(user_b) - {user_a}
+    neighbours = accepted_friend_sets(friends_a | friends_b | {user_a, user_b})
+
+    table = MutualFriendCount.__table__
+    changed = defaultdict(dict)
+    for user_id, candidate_ids in ((user_a, friends_b), (user_b, friends_a)):
+        if not candidate_ids:
+            continue
+        current = {}
+        for chunk in chunked(sorted(candidate_ids)):
+            current.update(db.session.execute(
+                select(table.c.candidate_id, table.c.mutual_count)
+                .where(table.c.user_id == user_id, table.c.candidate_id.in_(chunk))
+            ).all())
+
+        counts = {
+            candidate_id: len(neighbours[user_id] & neighbours[candidate_id])
+            for candidate_id in candidate_ids
+        }
+        stale = sorted(candidate_id for candidate_id, count in counts.items()
+                       if current.get(candidate_id, 0) != count)
+        for candidate_id in stale:
+            changed[user_id][candidate_id] = counts[candidate_id]
+            changed[candidate_id][user_id] = counts[candidate_id]
+
+        for chunk in chunked(stale):
+            db.session.execute(table.delete().where(table.c.user_id == user_id, table.c.candidate_id.in_(chunk)))
+            db.session.execute(table.delete().where(table.c.user_id.in_(chunk), table.c.candidate_id == user_id))
+            rows = []
+            for candidate_id in chunk:
+                if counts[candidate_id]:
+                    rows.append({'user_id': user_id, 'candidate_id': candidate_id, 'mutual_count': counts[candidate_id]})
+                    rows.append({'user_id': candidate_id, 'candidate_id': user_id, 'mutual_count': counts[candidate_id]})
+            if rows:
+                db.session.execute(table.insert(), rows)
+
+    return dict(changed)
+
+
+def accepted_friend_sets(user_ids):
+    """ユーザーごとの承認済みの友達の集合 {user_id: set}（CHUNK_SIZE 人ずつ引く）"""
+    friend_sets = {user_id: set() for user_id in user_ids}
+    for chunk in chunked(sorted(user_ids)):
+        query = union_all(
+            select(Friend.user_id, Friend.friend_user_id)
+            .where(Friend.user_id.in_(chunk), Friend.status == 'accepted'),
+            select(Friend.friend_user_id, Friend.user_id)
+            .where(Friend.friend_user_id.in_(chunk), Friend.status == 'accepted'),
+        )
+        for user_id, friend_id in db.session.execute(query):
+            if user_id in friend_sets:
+                friend_sets[user_id].add(friend_id)
+    return friend_sets
+
+
+def chunked(items, size=CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def refresh_suggestions(user_id):
+    """ユーザーの上位N件を計算し直す（コミットは呼び出し側）"""
+    exclude = {row[0] for row in db.session.execute(related_user_ids(user_id))}
+    exclude.add(user_id)
+
+    mutual = {
+        candidate_id: count
+        for candidate_id, count in db.session.query(
+            MutualFriendCount.candidate_id, MutualFriendCount.mutual_count
+        ).filter(
+            MutualFriendCount.user_id == user_id,
+            MutualFriendCount.mutual_count > 0
+        ).order_by(MutualFriendCount.mutual_count.desc(), MutualFriendCount.candidate_id)
+        .limit(CANDIDATE_POOL + len(exclude))
+        if candidate_id not in exclude
+    }
+
+    shared = shared_class_counts(user_id, limit=CANDIDATE_POOL + len(exclude))
+    missing = [candidate_id for candidate_id in mutual if candidate_id not in shared]
+    if missing:
+        shared.update(shared_class_counts(user_id, candidate_ids=missing))
+
+    FriendSuggestion.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    rows = rank_candidates(user_id, mutual, shared, exclude)
+    if rows:
+        db.session.execute(FriendSuggestion.__table__.insert(), rows)
+    return len(rows)
+
+
+def update_suggestions(user_id, mutual_counts):
+    """共通の友達数が変わった候補 {候補: 新しい数} の分だけ上位N件を直す
+
+    点数が上がった候補が既に一覧にあるか、変わった候補が一覧の最下位に
+    届かないなら、他の行の順位は変わらないのでその行だけを書き換える。
+    そうでなければ refresh_suggestions で計算し直す。コミットは呼び出し側。
+    """
+    table = FriendSuggestion.__table__
+    rows = {
+        row.candidate_id: row for row in db.session.execute(
+            select(table.c.candidate_id, table.c.score, table.c.shared_classes).where(table.c.user_id == user_id)
+        )
+    }
+    if len(rows) < SUGGESTIONS_PER_USER and any(candidate_id not in rows for candidate_id in mutual_counts):
+        return refresh_suggestions(user_id)
+
+    worst = max(((-row.score, candidate_id) for candidate_id, row in rows.items()), default=None)
+    outside = [candidate_id for candidate_id in mutual_counts if candidate_id not in rows]
+    shared = shared_class_counts(user_id, candidate_ids=outside) if outside else {}
+    updates = []
+    for candidate_id, mutual_count in mutual_counts.items():
+        row = rows.get(candidate_id)
+        shared_classes = row.shared_classes if row is not None else shared.get(candidate_id, 0)
+        score = mutual_count * MUTUAL_WEIGHT + shared_classes * SHARED_CLASS_WEIGHT
+        if row is None:
+            if (-score, candidate_id) < worst:
+                return refresh_suggestions(user_id)
+        elif score < row.score:
+            return refresh_suggestions(user_id)
+        else:
+            updates.append({'candidate': candidate_id, 'score': score, 'mutual': mutual_count})
+
+    if updates:
+        db.session.execute(
+            table.update().where(table.c.user_id == user_id, table.c.candidate_id == bindparam('candidate'))
+            .values(score=bindparam('score'), mutual_count=bindparam('mutual')),
+            updates,
+        )
+    return len(rows)
+
+
+def rank_candidates(user_id, mutual, shared, exclude):
+    """共通の友達数と同じ授業の数から点数を付け、上位 SUGGESTIONS_PER_USER 件の行を返す"""
+    scored = []
+    for candidate_id in (set(mutual) | set(shared)) - exclude:
+        mutual_count = mutual.get(candidate_id, 0)
+        shared_classes = shared.get(candidate_id, 0)
+        score = mutual_count * MUTUAL_WEIGHT + shared_classes * SHARED_CLASS_WEIGHT
+        scored.append((score, mutual_count, shared_classes, candidate_id))
+    scored.sort(key=lambda s: (-s[0], s[3]))
+    return [
+        {'user_id': user_id, 'candidate_id': candidate_id, 'score': score,
+         'mutual_count': mutual_count, 'shared_classes': shared_classes}
+        for score, mutual_count, shared_classes, candidate_id in scored[:SUGGESTIONS_PER_USER]
+    ]
+
+
+def friendship_edges(user_ids):
+    """user_ids から出る承認済みの友達関係の辺 (user_id, friend_id) の副問い合わせ（両方向ともインデックスで引く）"""
+    return union_all(
+        select(Friend.user_id.label('user_id'), Friend.friend_user_id.label('friend_id'))
+        .where(Friend.user_id.in_(user_ids), Friend.status == 'accepted'),
+        select(Friend.friend_user_id, Friend.user_id)
+        .where(Friend.friend_user_id.in_(user_ids), Friend.status == 'accepted'),
+    ).subquery()
+
+
+def rebuild_mutual_counts(user_ids):
+    """user_ids の共通の友達数を数え直す（コミットは呼び出し側）
+
+    隣接行列の2乗（A·A）のうち、区切ったユーザーの行だけを自己結合の集計で
+    INSERT ... SELECT する。集計の大きさは区切った人数分で済む。
+    """
+    edges = friendship_edges(user_ids).alias('edges')
+    # 友達（共通の友達）からその先の相手へは、両方向ともインデックスで引く
+    hops = union_all(
+        select(edges.c.user_id, Friend.user_id.label('candidate_id')).join(
+            Friend, and_(Friend.friend_user_id == edges.c.friend_id, Friend.status == 'accepted')),
+        select(edges.c.user_id, Friend.friend_user_id).join(
+            Friend, and_(Friend.user_id == edges.c.friend_id, Friend.status == 'accepted')),
+    ).subquery('hops')
+    pairs = select(hops.c.user_id, hops.c.candidate_id, func.count()).where(
+        hops.c.user_id != hops.c.candidate_id
+    ).group_by(hops.c.user_id, hops.c.candidate_id)
+
+    table = MutualFriendCount.__table__
+    db.session.execute(table.delete().where(table.c.user_id.in_(user_ids)))
+    db.session.execute(table.insert().from_select(
+        [table.c.user_id, table.c.candidate_id, table.c.mutual_count], pairs
+    ))
+
+
+def rebuild_all(batch_size=500, echo=None):
+    """共通の友達数を全件作り直し、全ユーザーの上位N件を計算し直す
+
+    ユーザーを batch_size 人ずつに区切り、区切りごとに共通の友達数を集計し直して
+    から、共通の友達数と同じ授業の数をユーザー・件数の順に流して読み、ユーザーごとに
+    候補の枠（refresh_suggestions と同じ）に入る分だけを残す。メモリは区切った
+    人数分で済み、区切りごとにコミットするので途中でも表は欠けない。
+    """
+    echo = echo or (lambda message: None)
+    started = time.perf_counter()
+
+    # ユーザーを id 順に区切って計算し直す
+    users = 0
+    last_id = ''
+    while True:
+        user_ids = [row[0] for row in db.session.query(User.id).filter(User.id > last_id)
+                    .order_by(User.id).limit(batch_size)]
+        if not user_ids:
+            break
+        rebuild_mutual_counts(user_ids)
+        rebuild_batch(user_ids)
+        db.session.commit()
+        users += len(user_ids)
+        last_id = user_ids[-1]
+        echo(f'suggestions: {users} users')
+
+    # 消えたユーザーの行が残っていれば消す
+    table = MutualFriendCount.__table__
+    db.session.execute(table.delete().where(table.c.user_id.notin_(select(User.id))))
+    db.session.commit()
+    pair_count = db.session.query(func.count()).select_from(MutualFriendCount).scalar()
+    echo(f'mutual friend counts: {pair_count} pairs')
+
+    return {
+        'pairs': pair_count,
+        'users': users,
+        'duration_s': round(time.perf_counter() - started, 2),
+    }
+
+
+def rebuild_batch(user_ids):
+    """user_ids の上位N件を、区切った人数分の問い合わせだけで計算し直す（コミットは呼び出し側）"""
+    exclude = {user_id: {user_id} for user_id in user_ids}
+    for user_id, other_id in db.session.execute(union_all(
+        select(Friend.user_id, Friend.friend_user_id).where(Friend.user_id.in_(user_ids)),
+        select(Friend.friend_user_id, Friend.user_id).where(Friend.friend_user_id.in_(user_ids)),
+    )):
+        exclude[user_id].add(other_id)
+    pool = {user_id: CANDIDATE_POOL + len(excluded) for user_id, excluded in exclude.items()}
+
+    # 共通の友達数の多い順に流して、枠に入る分だけ残す
+    mutual = {user_id: {} for user_id in user_ids}
+    seen = dict.fromkeys(user_ids, 0)
+    table = MutualFriendCount.__table__
+    for user_id, candidate_id, count in db.session.execute(
+        select(table.c.user_id, table.c.candidate_id, table.c.mutual_count)
+        .where(table.c.user_id.in_(user_ids), table.c.mutual_count > 0)
+        .order_by(table.c.user_id, table.c.mutual_count.desc(), table.c.candidate_id)
+        .execution_options(yield_per=CHUNK_SIZE)
+    ):
+        seen[user_id] += 1
+        if seen[user_id] <= pool[user_id] and candidate_id not in exclude[user_id]:
+            mutual[user_id][candidate_id] = count
+
+    # 同じ授業の数も多い順に流し、枠に入る分と共通の友達の候補の分だけ残す
+    shared = {user_id: {} for user_id in user_ids}
+    seen = dict.fromkeys(user_ids, 0)
+    mine = aliased(Timetable)
+    theirs = aliased(Timetable)
+    count = func.count()
+    for user_id, candidate_id, shared_classes in db.session.execute(
+        select(mine.user_id, theirs.user_id, count).join(theirs, and_(
+            mine.day_of_week == theirs.day_of_week,
+            mine.period == theirs.period,
+            mine.subject_name == theirs.subject_name,
+        )).where(
+            mine.user_id.in_(user_ids),
+            theirs.user_id != mine.user_id,
+            mine.subject_name.isnot(None),
+            mine.subject_name != '',
+        ).group_by(mine.user_id, theirs.user_id)
+        .order_by(mine.user_id, count.desc(), theirs.user_id)
+        .execution_options(yield_per=CHUNK_SIZE)
+    ):
+        seen[user_id] += 1
+        if seen[user_id] <= pool[user_id] or candidate_id in mutual[user_id]:
+            shared[user_id][candidate_id] = shared_classes
+
+    table = FriendSuggestion.__table__
+    db.session.execute(table.delete().where(table.c.user_id.in_(user_ids)))
+    rows = []
+    for user_id in user_ids:
+        rows.extend(rank_candidates(user_id, mutual[user_id], shared[user_id], exclude[user_id]))
+    for chunk in chunked(rows):
+        db.session.execute(table.insert(), chunk)
@@ -0,0 +1,83 @@
+"""同時に受け付ける件数に上限のあるワーカープール
+
+CPUを長時間使う処理（パスワードのハッシュ、画像の縮小）をリクエストの
+スレッドから外して実行する。受け付け中の件数が queue_limit に達していたら
+待たずに overloaded(retry_after) の例外で断り（呼び出し側で503）、timeout 秒
+待っても終わらなければ同じ例外で返す。workers=0 ならその場で実行する。
+
+実行が始まった処理は cancel() では止まらないので、枠は処理が終わったときに
+返す（待ちきれずに返ったリクエストの分も、終わるまでは件数に数える）。
+処理が読む一時ファイルなども同じ理由で呼び出し側では消さず、cleanup に渡して
+処理が終わるか、実行されないと決まった後に消す。
+fork 後（gunicorn のワーカー）は親のプールを使えないので作り直す。
+"""
+import os
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+
+class BoundedPool:
+    def __init__(self, executor_factory, overloaded, workers, queue_limit=None, timeout=None, retry_after=None):
+        """executor_factory(workers) は Executor を返す。overloaded(retry_after) は送出する例外"""
+        self.executor_factory = executor_factory
+        self.overloaded = overloaded
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+        self.configure(workers, queue_limit, timeout, retry_after)
+
+    def configure(self, workers, queue_limit=None, timeout=None, retry_after=None):
+        self.workers = workers
+        self.queue_limit = queue_limit if queue_limit is not None else max(workers, 1) * 4
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(self.queue_limit)
+
+    def run(self, func, *args, cleanup=None):
+        """func(*args) の結果を返す。cleanup は func が終わるか、実行されないと決まった後に1回だけ呼ぶ"""
+        if not self.workers:
+            try:
+                return func(*args)
+            finally:
+                if cleanup is not None:
+                    cleanup()
+
+        slots = self._slots
+
+        def finished(_=None):
+            slots.release()
+            if cleanup is not None:
+                cleanup()
+
+        if not slots.acquire(blocking=False):
+            if cleanup is not None:
+                cleanup()
+            raise self.overloaded(self.retry_after)
+        try:
+            future = self._get_pool().submit(func, *args)
+        except BaseException:
+            finished()
+            raise
+        # 取り消された場合もコールバックは呼ばれる
+        future.add_done_callback(finished)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise self.overloaded(self.retry_after)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            self._pool_pid = None
+
+    def _get_pool(self):
+        pid = os.getpid()
+        if self._pool is None or self._pool_pid != pid:
+            with self._lock:
+                if self._pool is None or self._pool_pid != pid:
+                    self._pool = self.executor_factory(self.workers)
+                    self._pool_pid = pid
+        return self._pool
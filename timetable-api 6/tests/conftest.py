@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+# src.main はインポート時に既定のアプリを組み立てるので、先にメモリ上のDBを指定する
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.main import create_app  # noqa: E402
+from src.models.db import db  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'AUTO_MIGRATE': True,
+        'PASSWORD_HASH_WORKERS': 0,
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+        'AVATAR_WORKERS': 0,
+        'AVATAR_DIR': str(tmp_path / 'avatars'),
+        'QR_CACHE_DIR': str(tmp_path / 'qr'),
+        'EVENT_BUS_POLL_INTERVAL': 0,
+    })
+    yield app
+    with app.app_context():
+        db.session.remove()
+
+
+@pytest.fixture
+def register(app):
+    """ユーザーを登録し、ログイン済みのクライアントとユーザーを返す"""
+    def register(username):
+        client = app.test_client()
+        response = client.post('/api/register', json={
+            'username': username, 'email': f'{username}@example.com', 'password': 'secret',
+        })
+        assert response.status_code == 201, response.get_json()
+        return client, response.get_json()['user']
+    return register
@@ -0,0 +1,70 @@
+import io
+import os
+import threading
+import time
+
+import pytest
+
+from src.services import avatars
+from src.services.avatars import AvatarBusy, AvatarStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = AvatarStore()
+    store.directory = str(tmp_path)
+    os.makedirs(tmp_path / 'tmp')
+    yield store
+    store.shutdown()
+
+
+def upload_dir(store):
+    return os.listdir(os.path.join(store.directory, 'tmp'))
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_timed_out_render_keeps_upload_until_it_finishes(store, monkeypatch):
+    release = threading.Event()
+    finished = threading.Event()
+    read = []
+
+    def slow_render(source_path, directory, key, max_pixels):
+        release.wait(5)
+        with open(source_path, 'rb') as f:
+            read.append(f.read())
+        finished.set()
+
+    monkeypatch.setattr(avatars, 'render_variants', slow_render)
+    store.pool.configure(1, 1, 0.05, 1)
+
+    with pytest.raises(AvatarBusy):
+        store.save(io.BytesIO(b'image bytes'))
+    # 待ちきれずに返っても、処理中の一時ファイルは消さない
+    assert len(upload_dir(store)) == 1
+
+    release.set()
+    assert finished.wait(5)
+    assert read == [b'image bytes']
+    assert wait_until(lambda: upload_dir(store) == [])
+
+
+def test_rejected_upload_is_removed(store, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(avatars, 'render_variants', lambda *args: release.wait(5))
+    store.pool.configure(1, 1, 0.05, 1)
+
+    with pytest.raises(AvatarBusy):
+        store.save(io.BytesIO(b'first'))
+    # 枠が埋まっているので2件目は実行されず、その場で消える
+    with pytest.raises(AvatarBusy):
+        store.save(io.BytesIO(b'second'))
+    assert len(upload_dir(store)) == 1
+
+    release.set()
+    assert wait_until(lambda: upload_dir(store) == [])
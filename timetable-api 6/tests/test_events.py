@@ -0,0 +1,108 @@
+import json
+import time
+
+import pytest
+
+from src.models.change_event import ChangeEvent
+from src.models.db import db
+from src.services.events import DatabaseBackend, _table
+
+
+class RecordingBus:
+    def __init__(self):
+        self.received = []
+
+    def receive(self, event):
+        self.received.append(event.payload['n'])
+
+
+@pytest.fixture
+def insert_event(app):
+    def insert_event(event_id):
+        with db.engine.begin() as connection:
+            connection.execute(_table().insert().values(
+                id=event_id, topic='test', payload=json.dumps({'n': event_id}), origin='other',
+            ))
+    with app.app_context():
+        yield insert_event
+
+
+def topics(app):
+    with app.app_context():
+        return [(row.topic, json.loads(row.payload)) for row in ChangeEvent.query.order_by(ChangeEvent.id)]
+
+
+def test_poll_delivers_late_commit_with_lower_id_once(insert_event):
+    backend = DatabaseBackend(lookback=60)
+    bus = RecordingBus()
+    gaps = {}
+    with db.engine.connect() as connection:
+        insert_event(1)
+        insert_event(2)
+        insert_event(4)
+        cursor, _ = backend._poll(connection, bus, 0, gaps)
+        assert cursor == 4 and bus.received == [1, 2, 4] and set(gaps) == {3}
+
+        # カーソルが通り過ぎた後で、小さい id がコミットされる
+        insert_event(3)
+        cursor, _ = backend._poll(connection, bus, cursor, gaps)
+        assert cursor == 4 and bus.received == [1, 2, 4, 3] and not gaps
+
+        cursor, _ = backend._poll(connection, bus, cursor, gaps)
+        assert bus.received == [1, 2, 4, 3]
+
+
+def test_poll_forgets_gap_after_lookback(insert_event):
+    backend = DatabaseBackend(lookback=0.05)
+    bus = RecordingBus()
+    gaps = {}
+    with db.engine.connect() as connection:
+        insert_event(1)
+        insert_event(3)
+        cursor, _ = backend._poll(connection, bus, 0, gaps)
+        assert set(gaps) == {2}
+
+        time.sleep(0.1)
+        cursor, _ = backend._poll(connection, bus, cursor, gaps)
+        assert not gaps
+
+        # 期限が過ぎた id は、後から現れても読み直さない
+        insert_event(2)
+        backend._poll(connection, bus, cursor, gaps)
+        assert bus.received == [1, 3]
+
+
+def test_open_conversation_with_friend_publishes_change(app, register):
+    alice, alice_user = register('alice')
+    bob, bob_user = register('bob')
+    alice.post('/api/friend-request', json={'user_id': bob_user['id']})
+    request_id = bob.get('/api/friend-requests').get_json()['received_requests'][0]['id']
+    assert bob.post(f'/api/friend-request/{request_id}/accept').status_code == 200
+
+    response = alice.get(f"/api/conversations/{bob_user['id']}")
+    assert response.status_code == 200
+    conversation_id = response.get_json()['conversation']['id']
+    assert alice.get(f"/api/conversations/{bob_user['id']}").get_json()['conversation']['id'] == conversation_id
+    assert [payload for topic, payload in topics(app) if topic == 'conversation.changed'] == [
+        {'user_ids': sorted([alice_user['id'], bob_user['id']])}
+    ]
+
+
+def test_delete_user_publishes_changes_and_removes_related_rows(app, register):
+    alice, alice_user = register('alice')
+    bob, bob_user = register('bob')
+    alice.post('/api/friend-request', json={'user_id': bob_user['id']})
+    assert alice.post('/api/timetable', json={
+        'day_of_week': 'monday', 'period': 1, 'subject_name': 'Math', 'room': 'A101',
+    }).status_code == 201
+    assert [r['user']['username'] for r in bob.get('/api/friend-requests').get_json()['received_requests']] == ['alice']
+
+    assert bob.delete(f"/api/users/{alice_user['id']}").status_code == 204
+    assert bob.get(f"/api/users/{alice_user['id']}").status_code == 404
+    assert bob.get('/api/friend-requests').get_json()['received_requests'] == []
+
+    published = topics(app)
+    assert ('user.changed', {'user_id': alice_user['id']}) in published
+    assert ('friendship.changed', {'user_ids': sorted([alice_user['id'], bob_user['id']])}) in published
+    assert any(topic == 'timetable.changed' and payload['after'] is None for topic, payload in published)
+
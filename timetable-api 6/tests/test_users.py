@@ -0,0 +1,71 @@
+from src.models.db import db
+from src.models.message import Conversation
+from src.models.user import User
+from src.routes.user import USERS_PAGE_DEFAULT
+
+
+def test_rename_updates_counterparts_cached_lists(app, register):
+    alice, alice_user = register('alice')
+    bob, _ = register('bob')
+    carol, carol_user = register('carol')
+    assert alice.post('/api/friend-request', json={'user_id': carol_user['id']}).status_code == 201
+    with app.app_context():
+        db.session.add(Conversation(user1_id=alice_user['id'], user2_id=carol_user['id']))
+        db.session.commit()
+
+    # 相手側の一覧をキャッシュに載せておく
+    received = carol.get('/api/friend-requests').get_json()['received_requests']
+    assert [r['user']['username'] for r in received] == ['alice']
+    conversations = carol.get('/api/conversations').get_json()['conversations']
+    assert [c['other_user']['username'] for c in conversations] == ['alice']
+
+    response = bob.put(f"/api/users/{alice_user['id']}", json={'username': 'alice2'})
+    assert response.status_code == 200
+    assert response.get_json()['username'] == 'alice2'
+
+    received = carol.get('/api/friend-requests').get_json()['received_requests']
+    assert [r['user']['username'] for r in received] == ['alice2']
+    conversations = carol.get('/api/conversations').get_json()['conversations']
+    assert [c['other_user']['username'] for c in conversations] == ['alice2']
+
+
+def test_get_user_by_id(register):
+    client, user = register('dave')
+    response = client.get(f"/api/users/{user['id']}")
+    assert response.status_code == 200
+    assert response.get_json()['username'] == 'dave'
+
+
+def add_users(app, count):
+    with app.app_context():
+        db.session.add_all([
+            User(username=f'bulk{i}', email=f'bulk{i}@example.com', password_hash='x') for i in range(count)
+        ])
+        db.session.commit()
+
+
+def test_users_list_is_complete_without_paging_params(app):
+    add_users(app, USERS_PAGE_DEFAULT + 5)
+    client = app.test_client()
+
+    response = client.get('/api/users')
+    assert response.status_code == 200
+    assert 'Link' not in response.headers
+    assert len(response.get_json()) == USERS_PAGE_DEFAULT + 5
+
+
+def test_users_pages_follow_link_header_to_the_end(app):
+    add_users(app, 7)
+    client = app.test_client()
+    everyone = [user['id'] for user in client.get('/api/users').get_json()]
+
+    seen = []
+    url = '/api/users?limit=3'
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        seen.extend(user['id'] for user in response.get_json())
+        link = response.headers.get('Link')
+        url = link[link.index('<') + 1:link.index('>')] if link else None
+
+    assert seen == everyone
@@ -52,15 +52,14 @@ const QRCodeComponent = ({ user, onLogout }) => {
         await navigator.share({
           title: 'BlueLink 友達追加QRコード',
           text: `${qrData.username}さんの友達追加QRコード`,
-          url: `https://bluelink-app-lx59.onrender.com/add-friend/${qrData.user_id}`
+          url: qrData.qr_data
         });
       } catch (error) {
         console.log('共有がキャンセルされました');
       }
     } else {
       // フォールバック: クリップボードにコピー
-      const url = `https://bluelink-app-lx59.onrender.com/add-friend/${qrData.user_id}`;
-      navigator.clipboard.writeText(url);
+      navigator.clipboard.writeText(qrData.qr_data);
       alert('友達追加URLをクリップボードにコピーしました');
     }
   };
@@ -68,18 +67,18 @@ const QRCodeComponent = ({ user, onLogout }) => {
   const parseQRCode = async () => {
     if (!scanInput.trim()) return;
     
-    // URLから友達IDを抽出
-    const match = scanInput.match(/add-friend\/(\d+)/);
+    // URLから友達追加コード（署名付きトークン「鍵ID.内容.署名」、旧形式はユーザーID）を抽出
+    const match = scanInput.match(/add-friend\/([A-Za-z0-9_.-]+)/);
     if (!match) {
       alert('無効なQRコードです');
       return;
     }
     
-    const friendId = match[1];
+    const code = match[1];
     
     setLoading(true);
     try {
-      const response = await fetch(`https://bluelink-app-lx59.onrender.com/api/add-friend/${friendId}`, {
+      const response = await fetch(`https://bluelink-app-lx59.onrender.com/api/add-friend/${encodeURIComponent(code)}`, {
         method: 'POST',
         credentials: 'include'
       });